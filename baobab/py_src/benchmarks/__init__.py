@@ -0,0 +1,4 @@
+"""
+Benchmarks of the data cube utilities on synthetic Landsat and Sentinel 2 cubes, which do not need a
+running Data Cube. See `benchmarks.run` for their usage and `benchmarks.synthetic` for the cubes.
+"""
@@ -0,0 +1,137 @@
+"""
+The benchmark cases: the analysis utilities run on synthetic cubes.
+
+Every case is a `BenchmarkCase` whose `setup` builds, from a synthetic cube, the call of the benchmarked
+function (a callable without arguments). `setup` is not timed and is called again before every run.
+The modules of the utilities are imported by `setup`, so the cases whose dependencies are not installed
+are reported as skipped. `max_size` is the largest size a slow case is run at.
+"""
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+
+from .synthetic import synthetic_landsat, synthetic_sentinel2, landsat_clear_mask
+
+BenchmarkCase = namedtuple('BenchmarkCase', ['name', 'sensor', 'setup', 'max_size'])
+BenchmarkCase.__new__.__defaults__ = (None,)
+
+benchmark_sensors = {'landsat': synthetic_landsat, 'sentinel2': synthetic_sentinel2}
+
+# Pixels (per side) of the cubes processed by the per-pixel CCD case, whatever the size.
+ccd_pixels = 8
+
+
+## Cloud masks ##
+
+def _setup_ls_qa_clean(dataset):
+    from swiss_utils.data_cube_utilities.sdc_utilities import ls_qa_clean
+    return partial(ls_qa_clean, dataset.pixel_qa, [1, 2, 4])
+
+
+def _setup_slc_clean_mask(dataset):
+    from swiss_utils.data_cube_utilities.sdc_utilities import create_slc_clean_mask
+    return partial(create_slc_clean_mask, dataset.slc, [4, 5, 6, 7, 11])
+
+
+## Mosaics ##
+
+def _setup_mosaic(function_name, **kwargs):
+    def setup(dataset):
+        from utils.data_cube_utilities import dc_mosaic
+        if function_name == 'create_hdmedians_multiple_band_mosaic':
+            import hdmedians  # Imported by the function itself
+        clean_mask = landsat_clear_mask(dataset).values
+        return partial(getattr(dc_mosaic, function_name), dataset.drop_vars('pixel_qa'), clean_mask=clean_mask,
+                       **kwargs)
+    return setup
+
+
+## Classifiers ##
+
+def _setup_wofs(dataset):
+    from utils.data_cube_utilities.dc_water_classifier import wofs_classify
+    clean_mask = landsat_clear_mask(dataset).values
+    return partial(wofs_classify, dataset.drop_vars('pixel_qa'), clean_mask=clean_mask)
+
+
+def _setup_frac_coverage(dataset):
+    from utils.data_cube_utilities.dc_fractional_coverage_classifier import frac_coverage_classify
+    # One scene, as in the notebooks (on a mosaic).
+    scene = dataset.isel(time=0)
+    clean_mask = landsat_clear_mask(scene).values
+    return partial(frac_coverage_classify, scene.drop_vars('pixel_qa'), clean_mask=clean_mask)
+
+
+def _setup_ccd(dataset):
+    from utils.data_cube_utilities.dc_ccd import process_xarray
+    subset = dataset.isel(latitude=slice(0, ccd_pixels), longitude=slice(0, ccd_pixels))
+    return partial(process_xarray, subset, process='change_count')
+
+
+## Raster filters ##
+
+def _clean_red(dataset):
+    return dataset.red.where(landsat_clear_mask(dataset)).astype(np.float64)
+
+
+def _setup_stats_filter_2d(statistic, dataset):
+    from utils.data_cube_utilities.raster_filter import stats_filter_2d
+    return partial(stats_filter_2d, _clean_red(dataset).median('time'), statistic, filter_size=3)
+
+
+def _setup_stats_filter_3d(statistic, dataset):
+    from utils.data_cube_utilities.raster_filter import stats_filter_3d_composite_2d
+    red = _clean_red(dataset).transpose('latitude', 'longitude', 'time')
+    return partial(stats_filter_3d_composite_2d, red, statistic, filter_size=3)
+
+
+def _setup_lone_object_filter(dataset):
+    from utils.data_cube_utilities.raster_filter import lone_object_filter
+    # A noisy classification: water where the first scene is dark in the nir.
+    classes = (dataset.nir.isel(time=0).values < 500).astype(np.uint8)
+    return partial(lone_object_filter, classes, min_size=3)
+
+
+## Trends ##
+
+def _ndvi(dataset):
+    clean = dataset[['red', 'nir']].where(landsat_clear_mask(dataset)).astype(np.float32)
+    return (clean.nir - clean.red) / (clean.nir + clean.red)
+
+
+def _setup_trends(dataset):
+    from utils.data_cube_utilities.trend import trends
+    return partial(trends, _ndvi(dataset))
+
+
+def _setup_linear(dataset):
+    from utils.data_cube_utilities.trend import linear
+    return partial(linear, _ndvi(dataset))
+
+
+benchmark_cases = [
+    BenchmarkCase('ls_qa_clean', 'landsat', _setup_ls_qa_clean),
+    BenchmarkCase('create_slc_clean_mask', 'sentinel2', _setup_slc_clean_mask),
+    BenchmarkCase('create_mosaic', 'landsat', _setup_mosaic('create_mosaic')),
+    BenchmarkCase('create_mosaic_most_recent', 'landsat',
+                  _setup_mosaic('create_mosaic', reverse_time=True)),
+    BenchmarkCase('create_mean_mosaic', 'landsat', _setup_mosaic('create_mean_mosaic')),
+    BenchmarkCase('create_median_mosaic', 'landsat', _setup_mosaic('create_median_mosaic')),
+    BenchmarkCase('create_max_ndvi_mosaic', 'landsat', _setup_mosaic('create_max_ndvi_mosaic')),
+    BenchmarkCase('create_min_ndvi_mosaic', 'landsat', _setup_mosaic('create_min_ndvi_mosaic')),
+    BenchmarkCase('create_min_max_var_mosaic', 'landsat',
+                  _setup_mosaic('create_min_max_var_mosaic', var='swir1', min_max='max')),
+    BenchmarkCase('create_hdmedians_multiple_band_mosaic', 'landsat',
+                  _setup_mosaic('create_hdmedians_multiple_band_mosaic'), 'small'),
+    BenchmarkCase('wofs_classify', 'landsat', _setup_wofs),
+    BenchmarkCase('frac_coverage_classify', 'landsat', _setup_frac_coverage),
+    BenchmarkCase('dc_ccd.process_xarray[{0}x{0}]'.format(ccd_pixels), 'landsat', _setup_ccd, 'medium'),
+    BenchmarkCase('stats_filter_2d_mean', 'landsat', partial(_setup_stats_filter_2d, 'mean'), 'medium'),
+    BenchmarkCase('stats_filter_2d_median', 'landsat', partial(_setup_stats_filter_2d, 'median'), 'medium'),
+    BenchmarkCase('stats_filter_3d_composite_2d_median', 'landsat',
+                  partial(_setup_stats_filter_3d, 'median'), 'medium'),
+    BenchmarkCase('lone_object_filter', 'landsat', _setup_lone_object_filter),
+    BenchmarkCase('trends', 'landsat', _setup_trends),
+    BenchmarkCase('linear', 'landsat', _setup_linear),
+]
@@ -0,0 +1,152 @@
+"""
+Runs the benchmark cases on synthetic cubes of several sizes and records their wall time and peak memory.
+
+Usage (from baobab/py_src):
+
+    python -m benchmarks --sizes small,medium --output results.json
+    python -m benchmarks --cases mosaic --compare results.json
+
+Every (case, size) runs in a fresh process, so that the peak memory of a case does not depend on the
+previous ones. The peak memory is measured on a first run: `peak_traced_mb` is the peak of the memory
+allocated by Python and numpy during the run (tracemalloc),
+`max_rss_mb` the peak resident memory of the process (including the synthetic cube).
+The wall time is the best of the `--repeat` following runs.
+"""
+import argparse
+import json
+import re
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from .cases import benchmark_cases, benchmark_sensors
+from .synthetic import benchmark_sizes
+
+
+def _materialize(result):
+    """Computes the lazy (dask backed) parts of the result of a case."""
+    if isinstance(result, (tuple, list)):
+        for element in result:
+            _materialize(element)
+    elif hasattr(result, 'load'):
+        result.load()
+    elif hasattr(result, 'compute'):
+        result.compute()
+
+
+def _run_case(case_index, size, repeat, measure_memory, seed):
+    """Runs a case in the current process. Returns its record (without the case name and size)."""
+    case = benchmark_cases[case_index]
+    dataset = benchmark_sensors[case.sensor](*benchmark_sizes[size], seed=seed)
+    try:
+        case.setup(dataset)
+    except ImportError as error:
+        return dict(status='skipped', error=str(error))
+
+    record = dict(status='ok')
+    try:
+        if measure_memory:
+            # First run of the process: later runs may reuse memory cached by the first one.
+            function = case.setup(dataset)
+            tracemalloc.start()
+            _materialize(function())
+            record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+        wall_times = []
+        for _ in range(repeat):
+            function = case.setup(dataset)
+            start = time.perf_counter()
+            _materialize(function())
+            wall_times.append(time.perf_counter() - start)
+    except ImportError as error:
+        # Dependencies imported by the benchmarked function itself
+        return dict(status='skipped', error=str(error))
+    record.update(wall_s=min(wall_times), wall_all_s=wall_times)
+    record['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    return record
+
+
+def run_benchmarks(cases=None, sizes=('small', 'medium'), repeat=3, measure_memory=True, seed=0, verbose=True):
+    """
+    Runs the benchmark cases whose name matches one of the regular expressions `cases` (all if None)
+    on the synthetic cubes of `sizes`.
+
+    Returns
+    -------
+    records: list of dict
+        The case, size, cube shape, status ('ok', 'skipped' or 'error'), wall time and peak memory
+        of every (case, size).
+    """
+    records = []
+    for case_index, case in enumerate(benchmark_cases):
+        if cases is not None and not any(re.search(pattern, case.name) for pattern in cases):
+            continue
+        for size in sizes:
+            record = dict(case=case.name, size=size, shape=list(benchmark_sizes[size]))
+            if case.max_size is not None and \
+                    benchmark_sizes[size][1] * benchmark_sizes[size][2] > \
+                    benchmark_sizes[case.max_size][1] * benchmark_sizes[case.max_size][2]:
+                record.update(status='skipped', error='slower than the size limit of the case')
+            else:
+                try:
+                    with ProcessPoolExecutor(1) as executor:
+                        record.update(executor.submit(_run_case, case_index, size, repeat,
+                                                      measure_memory, seed).result())
+                except Exception as error:
+                    record.update(status='error', error='{}: {}'.format(type(error).__name__, error))
+            records.append(record)
+            if verbose:
+                print(_format_record(record), flush=True)
+    return records
+
+
+def _format_record(record, previous=None):
+    line = '{case:<45} {size:<7} '.format(**record)
+    if record['status'] != 'ok':
+        return line + '{status}: {error}'.format(**record)
+    line += '{:>9.3f} s'.format(record['wall_s'])
+    if 'peak_traced_mb' in record:
+        line += ' {:>9.1f} MB peak'.format(record['peak_traced_mb'])
+    line += ' {:>9.1f} MB max rss'.format(record['max_rss_mb'])
+    if previous is not None and previous.get('status') == 'ok':
+        line += '   time x{:.2f}'.format(record['wall_s'] / previous['wall_s'])
+        if 'peak_traced_mb' in record and 'peak_traced_mb' in previous and previous['peak_traced_mb'] > 0:
+            line += ' peak x{:.2f}'.format(record['peak_traced_mb'] / previous['peak_traced_mb'])
+    return line
+
+
+def compare_records(records, previous_records):
+    """Returns the report of `records` with the ratios to the matching `previous_records`."""
+    previous = {(record['case'], record['size']): record for record in previous_records}
+    return '\n'.join(_format_record(record, previous.get((record['case'], record['size'])))
+                     for record in records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the data cube utilities on synthetic cubes.')
+    parser.add_argument('--cases', help='Comma separated regular expressions of the case names to run (all).')
+    parser.add_argument('--sizes', default='small,medium',
+                        help='Comma separated sizes among {} (small,medium).'.format(', '.join(benchmark_sizes)))
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs (3).')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure the peak memory.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic cubes (0).')
+    parser.add_argument('--output', help='JSON file to write the results to.')
+    parser.add_argument('--compare', help='JSON file of previous results to compare with.')
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(cases=args.cases.split(',') if args.cases else None, sizes=args.sizes.split(','),
+                             repeat=args.repeat, measure_memory=not args.no_memory, seed=args.seed,
+                             verbose=args.compare is None)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare_records(records, json.load(f)['records']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(python=sys.version, records=records), f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
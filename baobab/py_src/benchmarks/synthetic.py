@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+## Synthetic data cubes ##
+
+# (time, latitude, longitude) sizes of the synthetic cubes of the benchmarks.
+benchmark_sizes = {
+    'small': (20, 100, 100),
+    'medium': (60, 300, 300),
+    'large': (120, 1000, 1000),
+}
+
+synthetic_bands = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+
+# Surface reflectance (x 10000) of the land covers, in the order of `synthetic_bands`.
+_cover_spectra = {
+    'water': [600, 500, 300, 150, 80, 50],
+    'vegetation': [400, 700, 400, 3500, 1800, 900],
+    'bare': [900, 1200, 1500, 2200, 2800, 2400],
+    'urban': [1000, 1100, 1200, 1800, 2000, 1800],
+    'snow': [8500, 8300, 8000, 7000, 1000, 800],
+    'cloud': [6000, 6000, 6100, 6200, 4000, 3000],
+}
+_covers = ['water', 'vegetation', 'bare', 'urban']
+
+# Landsat Collection 1 pixel_qa values of the pixel classes (fill, clear, water, cloud shadow, snow, cloud,
+# cloud with high confidence cirrus), for Landsat 8 (with cirrus and terrain occlusion bits)
+# and Landsat 4 to 7 (8 bits).
+_pixel_qa_values = {
+    'LANDSAT_8': dict(fill=1, clear=322, water=324, shadow=328, snow=336, cloud=480, cirrus=992),
+    'LANDSAT_7': dict(fill=1, clear=66, water=68, shadow=72, snow=80, cloud=224, cirrus=224),
+}
+_pixel_qa_values['LANDSAT_5'] = _pixel_qa_values['LANDSAT_4'] = _pixel_qa_values['LANDSAT_7']
+
+# Sentinel 2 sen2cor scene classification (slc) values of the pixel classes.
+_slc_values = dict(fill=0, shadow=3, vegetation=4, bare=5, urban=5, water=6, cloud=9, cirrus=10, snow=11)
+
+
+def _smooth_field(rng, shape, scale):
+    """
+    Returns spatially correlated noise of `shape`: white noise smoothed with a gaussian kernel
+    of `scale` pixels, transformed to its ranks in [0, 1) so that thresholds are quantiles.
+    """
+    noise = rng.standard_normal(shape)
+    frequencies = [np.fft.fftfreq(shape[0])[:, np.newaxis], np.fft.rfftfreq(shape[1])[np.newaxis]]
+    kernel = np.exp(-2 * (np.pi * scale) ** 2 * (frequencies[0] ** 2 + frequencies[1] ** 2))
+    field = np.fft.irfft2(np.fft.rfft2(noise) * kernel, s=shape)
+    ranks = np.empty(field.size)
+    ranks[np.argsort(field, axis=None)] = np.arange(field.size) / field.size
+    return ranks.reshape(shape)
+
+
+def _synthetic_scenes(n_times, n_lat, n_lon, cloud_fraction, water_fraction, snow_fraction, nodata_fraction,
+                      start, revisit_days, resolution, seed, no_data):
+    """
+    Generates the reflectances and pixel classes of a synthetic cube, one time slice at a time.
+
+    Returns
+    -------
+    dataset: xarray.Dataset
+        The int16 reflectances of `synthetic_bands`.
+    classes: numpy.ndarray of str
+        Array of shape (time, latitude, longitude) of the pixel classes: 'fill', 'water', 'vegetation',
+        'bare', 'urban', 'snow', 'shadow', 'cloud' and 'cirrus'.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_lat, n_lon)
+    jitter = rng.integers(-1, 2, n_times) if revisit_days > 2 else np.zeros(n_times, dtype=int)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(n_times) * revisit_days + jitter, unit='D') + \
+        pd.Timedelta(hours=10, minutes=15)
+    latitude = 47. - resolution * (np.arange(n_lat) + 0.5)
+    longitude = 7. + resolution * (np.arange(n_lon) + 0.5)
+
+    # Land covers: water, vegetation (half of the land), bare and urban.
+    cover_field = _smooth_field(rng, shape, max(2., min(shape) / 20))
+    land_quantiles = water_fraction + (1 - water_fraction) * np.array([0.5, 0.8])
+    cover = np.digitize(cover_field, [water_fraction, *land_quantiles])
+    base = np.array([_cover_spectra[name] for name in _covers], dtype=np.float32)[cover]
+
+    # No data in the lower right corner (edge of a swath) covering `nodata_fraction` of the pixels.
+    rows, cols = np.ogrid[:n_lat, :n_lon]
+    edge = np.sqrt(2 * nodata_fraction)
+    fill = (1 - rows / n_lat) + (1 - cols / n_lon) < edge
+
+    years = (times - times[0]).days.values / 365.25
+    season = np.sin(2 * np.pi * (times.dayofyear.values - 80) / 365.25)
+    bands = {band: np.empty((n_times,) + shape, dtype=np.int16) for band in synthetic_bands}
+    classes = np.empty((n_times,) + shape, dtype='<U10')
+    for t in range(n_times):
+        # Seasonal vegetation cycle with a slow greening trend.
+        reflectance = base.copy()
+        vegetation = cover == 1
+        reflectance[vegetation, 3] *= 1 + 0.25 * season[t] + 0.01 * years[t]
+        reflectance[vegetation, 2] *= 1 - 0.2 * season[t]
+        scene_classes = np.array(_covers)[cover]
+
+        snow = (_smooth_field(rng, shape, min(shape) / 10) < snow_fraction * max(0., -season[t]) * 2) & (cover != 0)
+        reflectance[snow] = _cover_spectra['snow']
+        scene_classes[snow] = 'snow'
+
+        # Clouds: correlated blobs of a cloud fraction varying around `cloud_fraction`, with shadows
+        # cast a few pixels away and high confidence cirrus on a tenth of them.
+        scene_cloud_fraction = np.clip(cloud_fraction + rng.normal(0, 0.15), 0, 1) if cloud_fraction > 0 else 0.
+        cloud_field = _smooth_field(rng, shape, max(1.5, min(shape) / 30))
+        cloud = cloud_field >= 1 - scene_cloud_fraction
+        offset = max(1, min(shape) // 50)
+        shadow = np.roll(cloud, (offset, offset), axis=(0, 1)) & ~cloud
+        reflectance[shadow] *= 0.4
+        opacity = np.clip((cloud_field[cloud] - (1 - scene_cloud_fraction)) * 20, 0.5, 1)[:, np.newaxis]
+        reflectance[cloud] = (1 - opacity) * reflectance[cloud] + opacity * np.array(_cover_spectra['cloud'])
+        scene_classes[shadow] = 'shadow'
+        scene_classes[cloud] = np.where(rng.random(cloud.sum()) < 0.1, 'cirrus', 'cloud')
+
+        reflectance += rng.normal(0, 80, reflectance.shape).astype(np.float32)
+        reflectance = np.clip(reflectance, -100, 16000)
+        reflectance[fill] = no_data
+        scene_classes[fill] = 'fill'
+        for index, band in enumerate(synthetic_bands):
+            bands[band][t] = reflectance[..., index]
+        classes[t] = scene_classes
+
+    dims = ('time', 'latitude', 'longitude')
+    dataset = xr.Dataset({band: (dims, values, dict(nodata=no_data, units='reflectance'))
+                          for band, values in bands.items()},
+                         coords=dict(time=times.values, latitude=latitude, longitude=longitude),
+                         attrs=dict(crs='EPSG:4326'))
+    return dataset, classes
+
+
+def synthetic_landsat(n_times, n_lat, n_lon, cloud_fraction=0.3, platform='LANDSAT_8', water_fraction=0.1,
+                      snow_fraction=0., nodata_fraction=0.05, start='2013-04-01', revisit_days=16,
+                      resolution=0.00027, seed=0, no_data=-9999):
+    """
+    Generates a synthetic Landsat Collection 1 surface reflectance cube, as loaded from the Data Cube.
+
+    Parameters
+    ----------
+    n_times, n_lat, n_lon: int
+        The sizes of the time, latitude and longitude dimensions.
+    cloud_fraction: float
+        The mean fraction of cloudy pixels of the scenes (it varies between scenes).
+    platform: str
+        'LANDSAT_4', 'LANDSAT_5', 'LANDSAT_7' or 'LANDSAT_8', which determines the pixel_qa encoding.
+    water_fraction, snow_fraction: float
+        The fractions of water pixels and of land pixels covered by snow in winter.
+    nodata_fraction: float
+        The fraction of no data pixels, in the lower right corner.
+    start: str
+        The date of the first acquisition. The following ones are `revisit_days` apart (+/- 1 day).
+    resolution: float
+        The pixel size in degrees.
+    seed: int
+        The seed of the random generator. The same arguments always give the same cube.
+
+    Returns
+    -------
+    dataset: xarray.Dataset
+        Dataset with the int16 variables blue, green, red, nir, swir1 and swir2, `no_data` where there is
+        no data, and the uint16 Collection 1 pixel_qa variable (fill, clear, water, cloud shadow, snow and
+        cloud bits and cloud and cirrus confidences).
+    """
+    dataset, classes = _synthetic_scenes(n_times, n_lat, n_lon, cloud_fraction, water_fraction, snow_fraction,
+                                         nodata_fraction, start, revisit_days, resolution, seed, no_data)
+    qa_values = dict(_pixel_qa_values[platform], vegetation=_pixel_qa_values[platform]['clear'],
+                     bare=_pixel_qa_values[platform]['clear'], urban=_pixel_qa_values[platform]['clear'])
+    pixel_qa = np.zeros(classes.shape, dtype=np.uint16)
+    for name, value in qa_values.items():
+        pixel_qa[classes == name] = value
+    dataset['pixel_qa'] = (dataset.red.dims, pixel_qa, dict(units='bit_index'))
+    return dataset
+
+
+def synthetic_sentinel2(n_times, n_lat, n_lon, cloud_fraction=0.3, water_fraction=0.1, snow_fraction=0.,
+                        nodata_fraction=0.05, start='2017-04-01', revisit_days=5, resolution=0.0001,
+                        seed=0, no_data=-9999):
+    """
+    Generates a synthetic Sentinel 2 L2A (dc_preproc) cube, as loaded from the Data Cube.
+
+    The parameters are the ones of `synthetic_landsat`.
+
+    Returns
+    -------
+    dataset: xarray.Dataset
+        Dataset with the int16 variables blue, green, red, nir, swir1 and swir2, `no_data` where there is
+        no data, and the uint8 sen2cor scene classification variable slc.
+    """
+    dataset, classes = _synthetic_scenes(n_times, n_lat, n_lon, cloud_fraction, water_fraction, snow_fraction,
+                                         nodata_fraction, start, revisit_days, resolution, seed, no_data)
+    slc = np.zeros(classes.shape, dtype=np.uint8)
+    for name, value in _slc_values.items():
+        slc[classes == name] = value
+    dataset['slc'] = (dataset.red.dims, slc)
+    return dataset
+
+
+def landsat_clear_mask(dataset):
+    """
+    Returns the clear (clear, water or snow, not cloud) pixels of a Collection 1 pixel_qa variable,
+    a fast equivalent of `ls_qa_clean` for the synthetic cubes.
+    """
+    qa = dataset.pixel_qa
+    return ((qa & 0b10110) != 0) & ((qa & 0b100001) == 0)
+
+## End Synthetic data cubes ##
@@ -53,6 +53,8 @@ from osgeo import ogr
 from shapely.geometry import Polygon
 
 from utils.data_cube_utilities.dc_display_map import _degree_to_zoom_level
+from utils.data_cube_utilities.dc_timing import (enable_stage_timing, disable_stage_timing, timed_stage,
+                                                  stage_summary, read_stage_log)
 
 
 def draw_map(lat_ext = None, lon_ext = None):
@@ -150,6 +152,29 @@ def printandlog(msg, logname = 'default.log', started = False, reset = False):
     return
 
 
+def printandlog_stages(logname = 'default.log', stages_log = None):
+    """
+    Description:
+      Print and write in a log file the summary of the stages timed with timed_stage
+      (dc.load in load_multi_clean, mosaics, classifiers, ...) during the current run
+    -----
+    Input:
+      logname: Name of the logfile (as printandlog)
+      stages_log: (OPTIONAL) JSON lines log of stages to summarize (last run), current run by default
+    Output:
+      Print the summary table in page and logname
+    -----
+    Usage:
+      enable_stage_timing('stages.jsonl')
+      ...
+      printandlog_stages('any_name.log')
+    """
+    records = None if stages_log is None else read_stage_log(stages_log)
+    summary = stage_summary(records)
+    printandlog('Stages summary:\n%s' % summary.to_string(float_format = lambda v: '%.3f' % v), logname)
+    return summary
+
+
 def str_ds(ds):
     """
     create a string from a given xarray.Dataset by combining geographical extent and resolution
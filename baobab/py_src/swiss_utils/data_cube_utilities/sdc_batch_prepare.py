@@ -0,0 +1,165 @@
+# Copyright 2018 GRID-Geneva. All Rights Reserved.
+#
+# This code is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Batch mode shared by the prepare scripts of the ingestors folder (usgs_ls_c1_ard_prepare.py,
+gee_s2_ard_prepare.py, uzh_s1_l3comp_prepare.py).
+
+A directory tree is scanned for scene folders, which are prepared across a process pool.
+A JSON manifest keeps, for every scene, the modification time, size and number of its files
+and the hash of its metadata document, so that on re-runs:
+- unchanged scenes are skipped without opening any file,
+- the metadata YAML of a changed scene is only rewritten when its document changed.
+The dataset id of an already prepared scene is kept, so re-running never creates new ids.
+
+The prepare scripts import it from baobab/py_src, which must be on the PYTHONPATH (see baobab/modulefiles).
+"""
+# Import necessary stuff
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import yaml
+
+MANIFEST_NAME = '.prepare-manifest.json'
+
+# Number of prepared scenes after which the manifest is saved, so an interrupted run resumes.
+manifest_save_interval = 200
+
+
+def find_scenes(roots, is_scene):
+    """
+    Yields the scene folders found under roots (folders or scene folders), as Path.
+    is_scene(path) tells if a folder is a scene; the content of scene folders is not scanned.
+    """
+    for root in roots:
+        for folder, subfolders, _ in os.walk(str(root)):
+            path = Path(folder)
+            if is_scene(path):
+                subfolders[:] = []
+                yield path
+            else:
+                subfolders.sort()
+
+
+def scene_signature(path, yaml_name):
+    """
+    Returns the latest modification time (ns), total size and number of the files of a scene folder,
+    the metadata YAML and the hidden files (caches of the prepare scripts) excepted.
+    """
+    mtime, size, files = 0, 0, 0
+    for entry in os.scandir(str(path)):
+        if not entry.is_file() or entry.name.startswith(yaml_name) or entry.name.startswith('.'):
+            continue
+        stat = entry.stat()
+        mtime, size, files = max(mtime, stat.st_mtime_ns), size + stat.st_size, files + 1
+    return {'mtime': mtime, 'size': size, 'files': files}
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    with open(manifest_path + '.part', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.part', manifest_path)
+
+
+def document_hash(doc):
+    """Hash of a metadata document, its id excepted."""
+    doc = {key: value for key, value in doc.items() if key != 'id'}
+    return hashlib.sha1(yaml.dump(doc).encode('utf-8')).hexdigest()
+
+
+def _existing_id(yaml_path):
+    if not os.path.exists(yaml_path):
+        return None
+    with open(yaml_path) as stream:
+        return (yaml.safe_load(stream) or {}).get('id')
+
+
+def prepare_scene(prepare_datasets, path, yaml_name, previous=None):
+    """
+    Prepares the scene folder path with prepare_datasets (the function of a prepare script) and writes
+    its metadata YAML if its document differs from the one of the manifest entry previous.
+    Returns the new manifest entry of the scene and whether the YAML was written.
+    """
+    signature = scene_signature(path, yaml_name)
+    doc, folder = prepare_datasets(path)
+    yaml_path = str(folder.joinpath(yaml_name))
+    previous = previous or {}
+    doc_id = previous.get('id') or _existing_id(yaml_path)
+    if doc_id is not None:
+        doc['id'] = doc_id
+    doc_hash = document_hash(doc)
+    written = doc_hash != previous.get('doc_hash') or not os.path.exists(yaml_path)
+    if written:
+        with open(yaml_path + '.part', 'w') as stream:
+            yaml.dump(doc, stream)
+        os.replace(yaml_path + '.part', yaml_path)
+    signature.update({'doc_hash': doc_hash, 'id': doc['id']})
+    return signature, written
+
+
+def prepare_tree(roots, prepare_datasets, is_scene, yaml_name, manifest_path=None, workers=None, force=False):
+    """
+    Prepares every scene found under roots across a pool of workers processes (os.cpu_count() if None),
+    skipping the scenes unchanged since the last run recorded in the manifest (MANIFEST_NAME in the first
+    root if manifest_path is None), unless force is True.
+    prepare_datasets must be a module level function (it is sent to the worker processes).
+    Returns the number of scenes prepared, written, skipped and failed.
+    """
+    roots = [Path(root) for root in roots]
+    manifest_path = str(manifest_path or roots[0].joinpath(MANIFEST_NAME))
+    manifest = load_manifest(manifest_path)
+    counts = {'prepared': 0, 'written': 0, 'skipped': 0, 'failed': 0}
+
+    pending = {}
+    with ProcessPoolExecutor(workers) as executor:
+        for path in find_scenes(roots, is_scene):
+            key = str(path.resolve())
+            previous = manifest.get(key)
+            yaml_exists = path.joinpath(yaml_name).exists()
+            if not force and previous is not None and yaml_exists and \
+                    all(previous.get(field) == value for field, value in scene_signature(path, yaml_name).items()):
+                counts['skipped'] += 1
+                continue
+            future = executor.submit(prepare_scene, prepare_datasets, path, yaml_name, previous)
+            pending[future] = key
+        logging.info("%d scenes to prepare, %d unchanged", len(pending), counts['skipped'])
+
+        try:
+            for future in as_completed(pending):
+                key = pending[future]
+                try:
+                    manifest[key], written = future.result()
+                except Exception:
+                    logging.exception("Failed preparing %s", key)
+                    counts['failed'] += 1
+                    continue
+                counts['prepared'] += 1
+                counts['written'] += written
+                logging.info("%s %s", "Wrote" if written else "Unchanged", key)
+                if counts['prepared'] % manifest_save_interval == 0:
+                    save_manifest(manifest, manifest_path)
+        finally:
+            save_manifest(manifest, manifest_path)
+    logging.info("%(prepared)d scenes prepared, %(written)d written, %(skipped)d skipped, %(failed)d failed", counts)
+    return counts
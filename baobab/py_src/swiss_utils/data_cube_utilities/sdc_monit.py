@@ -14,8 +14,11 @@
 # Import necessary stuff
 # import os
 # import sys
+import os
 import time
 import datetime
+import threading
+from collections import deque
 import psutil
 # from shutil import which
 from IPython.display import clear_output # , IFrame
@@ -43,6 +46,7 @@ def monit_sys(proc_time = 10):
     """
     Description:
       Monitor and average CPU and RAM activity during a given time
+      (the kernel is blocked meanwhile, ResourceSampler samples in the background)
     -----
     Input:
       proc_time: monitoring time (in seconds, 10 by default)
@@ -109,6 +113,7 @@ def activity_logger(log_name = 'activity.log', interval_s = 10):
     """
     Description:
       Loggin RAM, Swap and CPU activity at a given interval until kernel is interrupted
+      (host totals, ResourceSampler samples the processes of the kernel and dask workers in the background)
     -----
     Input:
       log_name: (OPTIONAL) name of log file to create  (activity.log by default)
@@ -139,3 +144,271 @@ def activity_logger(log_name = 'activity.log', interval_s = 10):
     f.close()
 
     return 0
+
+
+# Dask worker task states sampled: name in the task_counts metric (recent distributed versions),
+# name of the individual metric before.
+_dask_task_states = {'executing': 'executing', 'ready': 'ready', 'memory': 'in_memory'}
+
+
+def _dask_client():
+    """
+    Return the current dask.distributed client (e.g. created by create_local_dask_cluster), None if there is none
+    """
+    try:
+        from distributed import default_client
+        return default_client()
+    except (ImportError, ValueError):
+        return None
+
+
+def _dask_workers(client):
+    """
+    Return a list of (name, memory bytes, {state: tasks}) of the workers of client
+    """
+    try:
+        info = client.scheduler_info(n_workers = -1)
+    except TypeError:
+        # Versions without n_workers (all workers are returned)
+        info = client.scheduler_info()
+    workers = []
+    for address, worker in sorted(info.get('workers', {}).items()):
+        metrics = worker.get('metrics', {})
+        if 'task_counts' in metrics:
+            tasks = {state: metrics['task_counts'].get(state, 0) for state in _dask_task_states}
+        else:
+            tasks = {state: metrics.get(legacy, 0) for state, legacy in _dask_task_states.items()}
+        workers.append((worker.get('name', address), metrics.get('memory', 0), tasks))
+    return workers
+
+
+class ResourceSampler(object):
+    """
+    Description:
+      Sample the resources used by the current process (and its children) in a background thread,
+      without blocking the kernel (unlike monit_sys and activity_logger), and when a dask.distributed client
+      is active (e.g. from create_local_dask_cluster) the memory and task counts of every worker.
+      Columns of the samples:
+        rss_mb:            RSS of the current process
+        pss_mb:            PSS of the current process and its children (their shared, e.g. copy-on-write, pages
+                           counted once; USS where PSS is not available, e.g. on macOS)
+        cpu_pc:            CPU of the current process and its children (100 per fully used core)
+        read_mb, write_mb: MB read and written by the current process and its children since the previous sample
+        processes:         number of processes sampled
+      The last size samples are kept in a ring buffer, they can be exported (to_csv, to_parquet) or plotted
+      over the stages timed with timed_stage (utils.data_cube_utilities.dc_timing) and the marks,
+      to trace memory blow-ups to specific calls.
+    -----
+    Input:
+      interval_s: (OPTIONAL) sampling interval in seconds (1 second by default)
+      size:       (OPTIONAL) number of samples kept (3600 by default, 1 hour at 1 second)
+      children:   (OPTIONAL) add the child processes (e.g. of a ProcessPoolExecutor) to the process (True by default)
+      client:     (OPTIONAL) dask.distributed client (the current one by default, False to disable)
+    -----
+    Usage:
+      with ResourceSampler() as sampler:
+          dsc, cm = load_multi_clean(...)
+          sampler.mark('mosaic')
+          mosaic = create_median_mosaic(dsc, cm)
+      sampler.plot()
+      sampler.to_csv('resources.csv')
+    """
+    def __init__(self, interval_s = 1, size = 3600, children = True, client = None):
+        self.interval_s = interval_s
+        self.children = children
+        self.client = client
+        self.samples = deque(maxlen = size)
+        self.marks = []
+        self._process = psutil.Process(os.getpid())
+        self._children = {}
+        self._io = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _processes(self):
+        processes = [self._process]
+        if self.children:
+            try:
+                children = self._process.children(recursive = True)
+            except psutil.NoSuchProcess:
+                children = []
+            # The same Process objects are kept from sample to sample, as cpu_percent is relative to the previous call
+            # (Process equality also compares the creation time, in case a pid is reused)
+            self._children = {child.pid: self._children[child.pid] if self._children.get(child.pid) == child
+                              else child for child in children}
+            processes += list(self._children.values())
+        return processes
+
+    @staticmethod
+    def _io_counters(process):
+        """
+        Return the (read, written) bytes of a process since its start ((0, 0) where not available, e.g. on macOS)
+        """
+        if not hasattr(process, 'io_counters'):
+            return 0, 0
+        io = process.io_counters()
+        return io.read_bytes, io.write_bytes
+
+    def _sample(self, client):
+        sample = {'time': datetime.datetime.now(), 'rss_mb': 0., 'pss_mb': 0., 'cpu_pc': 0., 'read_mb': 0.,
+                  'write_mb': 0., 'processes': 0}
+        io = {}
+        for process in self._processes():
+            try:
+                with process.oneshot():
+                    if process is self._process:
+                        sample['rss_mb'] = process.memory_info().rss / 2 ** 20
+                    try:
+                        memory = process.memory_full_info()
+                        sample['pss_mb'] += getattr(memory, 'pss', memory.uss) / 2 ** 20
+                    except psutil.AccessDenied:
+                        sample['pss_mb'] += process.memory_info().rss / 2 ** 20
+                    sample['cpu_pc'] += process.cpu_percent()
+                    # The counters of a process are cumulated since its start: only their increase is added,
+                    # so that the series does not drop when a child exits
+                    io[process.pid] = self._io_counters(process)
+                    read, write = self._io.get(process.pid, (0, 0))
+                    sample['read_mb'] += (io[process.pid][0] - read) / 2 ** 20
+                    sample['write_mb'] += (io[process.pid][1] - write) / 2 ** 20
+                sample['processes'] += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                # Finished children
+                pass
+        # The counters of a finished child are added to the ones of its parent when it waits for it (Linux):
+        # the part already sampled is removed
+        for pid in set(self._io) - set(io):
+            sample['read_mb'] -= self._io[pid][0] / 2 ** 20
+            sample['write_mb'] -= self._io[pid][1] / 2 ** 20
+        self._io = io
+        if client is not None:
+            try:
+                workers = _dask_workers(client)
+            except Exception:
+                # Client closed while sampling
+                workers = []
+            sample['dask_memory_mb'] = sum(memory for _, memory, _ in workers) / 2 ** 20
+            for state in _dask_task_states:
+                sample['dask_tasks_%s' % state] = sum(tasks[state] for _, _, tasks in workers)
+            for name, memory, tasks in workers:
+                sample['dask_%s_memory_mb' % name] = memory / 2 ** 20
+                sample['dask_%s_executing' % name] = tasks['executing']
+        return sample
+
+    def _run(self):
+        client = None if self.client is False else (self.client or _dask_client())
+        # cpu_percent and the read and written bytes are relative to the previous call: the first one initializes them
+        self._io = {}
+        for process in self._processes():
+            try:
+                process.cpu_percent()
+                self._io[process.pid] = self._io_counters(process)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        while not self._stop.wait(self.interval_s):
+            self.samples.append(self._sample(client))
+
+    def start(self):
+        """
+        Description:
+          Start sampling in a background (daemon) thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run, name = 'ResourceSampler', daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Description:
+          Stop sampling (the samples are kept)
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def mark(self, label):
+        """
+        Description:
+          Add a marker (e.g. the name of the next step) at the current time, shown on plot
+        """
+        self.marks.append((datetime.datetime.now(), label))
+
+    def to_dataframe(self):
+        """
+        Description:
+          Return the samples as a pandas.DataFrame indexed by time. The read_mb and write_mb columns are
+          the MB read and written between samples (cumsum for the totals)
+        """
+        import pandas as pd
+        return pd.DataFrame(list(self.samples)).set_index('time') if self.samples else pd.DataFrame()
+
+    def to_csv(self, path):
+        self.to_dataframe().to_csv(path)
+
+    def to_parquet(self, path):
+        # Requires pyarrow or fastparquet
+        self.to_dataframe().to_parquet(path)
+
+    def _stages(self, start, end, max_depth):
+        """
+        Return the (start, end, name) of the stages timed with timed_stage which ran between start and end
+        """
+        try:
+            from utils.data_cube_utilities.dc_timing import stage_records
+        except ImportError:
+            return []
+        stages = []
+        for record in stage_records():
+            stage_start = datetime.datetime.fromisoformat(record['start'])
+            stage_end = stage_start + datetime.timedelta(seconds = record['wall_s'])
+            if record['depth'] <= max_depth and stage_end >= start and stage_start <= end:
+                stages.append((stage_start, stage_end, record['stage']))
+        return stages
+
+    def plot(self, columns = ['pss_mb', 'dask_memory_mb'], stages = True, max_depth = 0, fig_name = None):
+        """
+        Description:
+          Plot sampled columns over time, with the timed stages (as spans) and the marks (as lines)
+        -----
+        Input:
+          columns:   (OPTIONAL) list of columns to plot (PSS and dask workers memory by default, when sampled)
+          stages:    (OPTIONAL) show the stages timed with timed_stage (True by default)
+          max_depth: (OPTIONAL) maximum depth of the nested stages shown (0: outer stages only)
+          fig_name:  (OPTIONAL) file name to save the figure to
+        Output:
+          matplotlib axes
+        """
+        import matplotlib.pyplot as plt
+
+        df = self.to_dataframe()
+        fig, ax = plt.subplots(figsize = (14, 5))
+        columns = [column for column in columns if column in df.columns]
+        if not len(df) or not columns:
+            print('No samples to plot')
+            return ax
+        df[columns].plot(ax = ax)
+        ax.set_ylabel('MB' if all(column.endswith('_mb') for column in columns) else '')
+        if stages:
+            colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+            for i, (start, end, name) in enumerate(self._stages(df.index[0], df.index[-1], max_depth)):
+                ax.axvspan(start, end, color = colors[i % len(colors)], alpha = 0.15)
+                ax.text(start, 1, name, transform = ax.get_xaxis_transform(), rotation = 90,
+                        va = 'top', fontsize = 8)
+        for marked, label in self.marks:
+            ax.axvline(marked, color = 'k', linestyle = '--', linewidth = 0.8)
+            ax.text(marked, 0, label, transform = ax.get_xaxis_transform(), rotation = 90,
+                    va = 'bottom', fontsize = 8)
+        if fig_name:
+            plt.savefig(fig_name, bbox_inches = 'tight')
+        return ax
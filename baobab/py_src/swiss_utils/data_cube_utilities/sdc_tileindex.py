@@ -0,0 +1,255 @@
+# Copyright 2018 GRID-Geneva. All Rights Reserved.
+#
+# This code is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Import necessary stuff
+import os
+import re
+import glob
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Number of threads reading the NetCDF files of a TileIndexDatacube.load. HDF5 serializes the
+# decompression, the threads mostly overlap the opening and reading of files (e.g. on NFS).
+tile_index_workers = 8
+
+_TILE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    name TEXT PRIMARY KEY, platform TEXT, crs TEXT, measurements TEXT, nodata TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, product TEXT, path TEXT UNIQUE, mtime INTEGER, size INTEGER,
+    min_lon REAL, max_lon REAL, min_lat REAL, max_lat REAL, min_time INTEGER, max_time INTEGER);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_rtree USING rtree(
+    id, min_lon, max_lon, min_lat, max_lat, min_time, max_time);
+"""
+
+
+def _template_glob(location, file_path_template):
+    """
+    Returns the glob pattern of the files written by an ingestion (the {...} fields of its template as *)
+    """
+    return os.path.join(location, re.sub(r'\{[^}]*\}', '*', file_path_template))
+
+
+def _netcdf_extent(path):
+    """
+    Returns the longitude, latitude and time (int64 ns) bounds of an ingested NetCDF file
+    (pixel centers), read from its coordinates only.
+    """
+    with xr.open_dataset(path, mask_and_scale = False) as ds:
+        lon, lat = ds.longitude.values, ds.latitude.values
+        times = ds.time.values.astype('datetime64[ns]').astype(np.int64)
+    return lon.min(), lon.max(), lat.min(), lat.max(), times.min(), times.max()
+
+
+def build_tile_index(index_path, ingestion_configs, location = None):
+    """
+    Description:
+      Create or update a local (SQLite with R-tree) index of the NetCDF files of ingested products,
+      found with the location and file_path_template of their ingestion configuration.
+      The longitude, latitude and time bounds and path of every file are stored.
+      Files unchanged (same modification time and size) since the last update are not opened again,
+      the files which disappeared are removed from the index.
+    -----
+    Input:
+      index_path:        path of the SQLite index
+      ingestion_configs: list of paths of ingestion configuration (.yaml) files
+    Args:
+      location:          (OPTIONAL) folder of the ingested data (location of the configurations by default)
+    Output:
+      dictionary of product: number of indexed files
+    """
+    import yaml
+
+    if isinstance(ingestion_configs, str):
+        ingestion_configs = [ingestion_configs]
+    counts = {}
+    with sqlite3.connect(index_path) as db:
+        db.executescript(_TILE_INDEX_SCHEMA)
+        for config_path in ingestion_configs:
+            with open(config_path) as f:
+                config = yaml.safe_load(f)
+            product = config['output_type']
+            platform = config.get('global_attributes', {}).get('platform', '')
+            db.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)',
+                       (product, platform.upper().replace('-', '_'), config['storage']['crs'],
+                        json.dumps([m['name'] for m in config['measurements']]),
+                        json.dumps({m['name']: m.get('nodata') for m in config['measurements']})))
+
+            known = {path: (file_id, mtime, size) for file_id, path, mtime, size in
+                     db.execute('SELECT id, path, mtime, size FROM files WHERE product = ?', (product,))}
+            paths = sorted(glob.glob(_template_glob(location or config['location'], config['file_path_template'])))
+            for path in paths:
+                stat = os.stat(path)
+                file_id, mtime, size = known.pop(path, (None, None, None))
+                if (mtime, size) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                extent = _netcdf_extent(path)
+                extent = [float(v) for v in extent[:4]] + [int(v) for v in extent[4:]]
+                if file_id is not None:
+                    db.execute('DELETE FROM files_rtree WHERE id = ?', (file_id,))
+                    db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                cursor = db.execute('INSERT INTO files (product, path, mtime, size, min_lon, max_lon, min_lat, '
+                                    'max_lat, min_time, max_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (product, path, stat.st_mtime_ns, stat.st_size, *extent))
+                # R-tree coordinates are 32 bit floats (rounded outwards): times in seconds, exact bounds in files.
+                db.execute('INSERT INTO files_rtree VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (cursor.lastrowid, *extent[:4], extent[4] / 1e9, extent[5] / 1e9))
+            for file_id, _, _ in known.values():
+                db.execute('DELETE FROM files_rtree WHERE id = ?', (file_id,))
+                db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+            counts[product] = len(paths)
+    return counts
+
+
+def _time_bounds(time):
+    """
+    Returns the int64 ns bounds of a dc.load time query: a pair of dates, partial dates ('2016', '2016-03')
+    covering their whole period.
+    """
+    if time is None:
+        return np.iinfo(np.int64).min, np.iinfo(np.int64).max
+    if isinstance(time, (str, np.datetime64, pd.Timestamp)) or not hasattr(time, '__len__'):
+        time = (time, time)
+    bounds = []
+    for value, end in zip(time, ('start_time', 'end_time')):
+        if isinstance(value, str):
+            value = getattr(pd.Period(value), end)
+        bounds.append(pd.Timestamp(value).value)
+    return tuple(bounds)
+
+
+def _index_slice(selected):
+    """
+    Returns the slice of the True values of selected, contiguous as selected along monotonic coordinates.
+    """
+    indices = np.flatnonzero(selected)
+    return slice(indices[0], indices[-1] + 1) if len(indices) else slice(0, 0)
+
+
+def _read_tile(path, measurements, lon, lat, time_bounds):
+    """
+    Reads the measurements of an ingested NetCDF file within lon and lat (pairs, or None) and time_bounds
+    (int64 ns), without masking nor scaling (as dc.load).
+    """
+    with xr.open_dataset(path, mask_and_scale = False) as ds:
+        selection = {}
+        for dim, bounds in (('longitude', lon), ('latitude', lat)):
+            if bounds is not None:
+                coord = ds[dim].values
+                selection[dim] = _index_slice((coord >= min(bounds)) & (coord <= max(bounds)))
+        times = ds.time.values.astype('datetime64[ns]').astype(np.int64)
+        selection['time'] = _index_slice((times >= time_bounds[0]) & (times <= time_bounds[1]))
+        return ds[measurements].isel(**selection).load()
+
+
+class TileIndexDatacube(object):
+    """
+    Description:
+      Datacube stand-in loading ingested products directly from their NetCDF files, found with a local
+      index created by build_tile_index (no PostgreSQL database is needed). The files of a query are read
+      concurrently and assembled on the grid of the ingestion.
+      It can be given to the functions calling dc.load and dc.list_products (e.g. load_multi_clean)
+      instead of a datacube.Datacube, as a fast path or in tests and benchmarks.
+      Only geographic (latitude, longitude) storage is supported.
+    -----
+    Input:
+      index_path: path of the SQLite index
+    Args:
+      workers:    (OPTIONAL) number of threads reading the files (tile_index_workers by default)
+    """
+    def __init__(self, index_path, workers = None):
+        self.index_path = index_path
+        self.workers = workers or tile_index_workers
+
+    def _query(self, sql, parameters = ()):
+        with sqlite3.connect(self.index_path) as db:
+            return db.execute(sql, parameters).fetchall()
+
+    def list_products(self):
+        rows = self._query('SELECT name, platform, crs, measurements FROM products ORDER BY name')
+        return pd.DataFrame([(name, platform, crs, json.loads(measurements))
+                             for name, platform, crs, measurements in rows],
+                            columns = ['name', 'platform', 'crs', 'measurements'])
+
+    def find_files(self, product, time = None, lon = None, lat = None):
+        """
+        Returns the paths of the files of product intersecting time, lon and lat (as in dc.load).
+        """
+        time_bounds = _time_bounds(time)
+        lon = lon if lon is not None else (-np.inf, np.inf)
+        lat = lat if lat is not None else (-np.inf, np.inf)
+        sql = ('SELECT files.path FROM files_rtree JOIN files ON files.id = files_rtree.id '
+               'WHERE files.product = ? '
+               'AND files_rtree.max_lon >= ? AND files_rtree.min_lon <= ? '
+               'AND files_rtree.max_lat >= ? AND files_rtree.min_lat <= ? '
+               'AND files_rtree.max_time >= ? AND files_rtree.min_time <= ? '
+               'AND files.max_time >= ? AND files.min_time <= ? ORDER BY files.min_time, files.path')
+        return [path for path, in self._query(sql, (product, min(lon), max(lon), min(lat), max(lat),
+                                                     max(time_bounds[0] / 1e9, -1e18),
+                                                     min(time_bounds[1] / 1e9, 1e18), *time_bounds))]
+
+    def load(self, product = None, time = None, lon = None, lat = None, measurements = None,
+             dask_chunks = None, longitude = None, latitude = None, **kwargs):
+        """
+        Description:
+          Load product as dc.load: one time slice by acquisition time (the tiles of the same time are
+          mosaicked), nodata where no file covers a pixel, an empty dataset if nothing is found.
+          dask_chunks only chunks the loaded dataset.
+        """
+        lon = lon if lon is not None else longitude
+        lat = lat if lat is not None else latitude
+        product_row = self._query('SELECT crs, measurements, nodata FROM products WHERE name = ?', (product,))
+        if not product_row:
+            raise ValueError('Unknown product "%s"' % product)
+        crs, all_measurements, nodata = product_row[0]
+        measurements = list(measurements or json.loads(all_measurements))
+        nodata = json.loads(nodata)
+
+        paths = self.find_files(product, time, lon, lat)
+        time_bounds = _time_bounds(time)
+        with ThreadPoolExecutor(self.workers) as executor:
+            tiles = list(executor.map(lambda path: _read_tile(path, measurements, lon, lat, time_bounds), paths))
+        tiles = [tile for tile in tiles if all(tile.sizes.values())]
+        if not tiles:
+            return xr.Dataset()
+
+        # Output grid: the union of the coordinates of the tiles (which share the ingestion grid).
+        times = np.unique(np.concatenate([tile.time.values for tile in tiles]))
+        lats = np.unique(np.concatenate([tile.latitude.values for tile in tiles]))[::-1]
+        lons = np.unique(np.concatenate([tile.longitude.values for tile in tiles]))
+        data = {name: np.full((len(times), len(lats), len(lons)),
+                              nodata.get(name) if nodata.get(name) is not None else 0,
+                              dtype = tiles[0][name].dtype)
+                for name in measurements}
+        for tile in tiles:
+            t = np.searchsorted(times, tile.time.values)
+            y = len(lats) - 1 - np.searchsorted(lats[::-1], tile.latitude.values)
+            x = np.searchsorted(lons, tile.longitude.values)
+            for name in measurements:
+                values = tile[name].transpose('time', 'latitude', 'longitude').values
+                target = data[name][np.ix_(t, y, x)]
+                # Pixels of an earlier tile of the same time are kept (as the datacube 'copy' fuser).
+                data[name][np.ix_(t, y, x)] = np.where(target == data[name].dtype.type(nodata.get(name) or 0),
+                                                       values, target)
+        dataset = xr.Dataset({name: (('time', 'latitude', 'longitude'), data[name], tiles[0][name].attrs)
+                              for name in measurements},
+                             coords = {'time': times, 'latitude': lats, 'longitude': lons},
+                             attrs = {'crs': crs})
+        if dask_chunks is not None:
+            dataset = dataset.chunk(dask_chunks)
+        return dataset
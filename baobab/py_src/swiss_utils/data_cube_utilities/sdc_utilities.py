@@ -22,6 +22,7 @@ from datetime import datetime
 from numpy.lib.stride_tricks import as_strided
 
 from utils.data_cube_utilities.dc_utilities import clear_attrs
+from utils.data_cube_utilities.dc_timing import timed_stage
 
 
 def create_slc_clean_mask(slc, valid_cats = [4, 5, 6, 7, 11]):
@@ -163,6 +164,7 @@ def get_platform(dc, products):
     return platforms
 
 
+@timed_stage()
 def load_multi_clean(dc, products, time, lon, lat, measurements, dropna = False, platforms = [], valid_cats = []):
     """
     Description:
@@ -173,8 +175,10 @@ def load_multi_clean(dc, products, time, lon, lat, measurements, dropna = False,
       Works with Landsat or Sentinel 2 (but not mixed).
       Platforms arguments are not mandatory
       dropna option removes time without any data
+      Time series heavy analyses can load products rechunked with sdc_zarr.zarr_rechunk by giving
+      a sdc_zarr.ZarrDatacube as dc
     Input:
-      dc:           datacube.api.core.Datacube
+      dc:           datacube.api.core.Datacube (or sdc_zarr.ZarrDatacube)
                     The Datacube instance to load data with.
     Args:
       platforms:    list of platforms (not mandatory)
@@ -232,11 +236,12 @@ def load_multi_clean(dc, products, time, lon, lat, measurements, dropna = False,
     # Create raw dataset
     dataset_clean = None
     for product,platform in zip(products, platforms):
-        dataset_tmp = dc.load(platform = platform, product = product,
-                         time = time,
-                         lon = lon,
-                         lat = lat,
-                         measurements = measurements)
+        with timed_stage('dc.load', product = product) as stage:
+            dataset_tmp = stage.add_bytes(dc.load(platform = platform, product = product,
+                                                  time = time,
+                                                  lon = lon,
+                                                  lat = lat,
+                                                  measurements = measurements))
 
         if len(dataset_tmp.variables) == 0: continue # skip the current iteration if empty
 
@@ -381,6 +386,7 @@ def updown_sample(ds_l, ds_s, resampl):
     return ds
 
 
+@timed_stage()
 def load_lss2_clean(dc, products, time, lon, lat, measurements,
                    resampl = '', dropna = False, platforms = [], valid_cats = [[],[]]):
     """
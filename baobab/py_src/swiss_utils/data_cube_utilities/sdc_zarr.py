@@ -0,0 +1,264 @@
+# Copyright 2018 GRID-Geneva. All Rights Reserved.
+#
+# This code is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Import necessary stuff
+import os
+import json
+
+import numpy as np
+import xarray as xr
+
+from swiss_utils.data_cube_utilities.sdc_tileindex import _time_bounds
+
+# Maximum number of bytes of source data loaded at once by zarr_rechunk.
+zarr_rechunk_budget = 2 ** 29
+
+# Sidecar file of a zarr store keeping the progress of the batch being written.
+ZARR_PROGRESS = '.rechunk_progress.json'
+
+
+def _zarr_attrs(attrs):
+    """
+    Returns attrs with the values which are not JSON serializable (e.g. datacube CRS) as strings.
+    """
+    def serializable(value):
+        try:
+            json.dumps(value)
+            return value
+        except TypeError:
+            return str(value)
+    return {key: serializable(value) for key, value in attrs.items()}
+
+
+def _zarr_template(source):
+    """
+    Returns source with JSON serializable attributes and without the coordinates which are not
+    along time, latitude or longitude (they can not be written in regions).
+    """
+    source = source.drop_vars([name for name, coord in source.coords.items()
+                               if not set(coord.dims) & {'time', 'latitude', 'longitude'}])
+    source.attrs = _zarr_attrs(source.attrs)
+    for name in source.variables:
+        source[name].attrs = _zarr_attrs(source[name].attrs)
+    return source
+
+
+def _read_progress(store):
+    path = os.path.join(store, ZARR_PROGRESS)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_progress(store, progress):
+    path = os.path.join(store, ZARR_PROGRESS)
+    if progress is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path + '.part', 'w') as f:
+        json.dump(progress, f)
+    os.replace(path + '.part', path)
+
+
+def zarr_rechunk(dc, product, store, time = None, lon = None, lat = None, measurements = None,
+                 chunk_size = 64, time_chunk = 256, budget = None):
+    """
+    Description:
+      Copy an ingested product into a zarr store chunked for time series analyses
+      (time_chunk x chunk_size x chunk_size chunks instead of the 1 x 200 x 200 chunks of ingested NetCDF),
+      a pixel time series of 20 years then only touches a few chunks instead of thousands of files.
+      The acquisitions are copied by batches of time_chunk (aligned to the zarr chunks, so each chunk
+      is written once) and every batch by spatial blocks of at most budget bytes of source data.
+      The progress is kept in the store, an interrupted copy resumes where it stopped.
+      Calling it again on an existing store appends the acquisitions newer than its last one
+      (on the extent and measurements of the store).
+    -----
+    Input:
+      dc:           datacube.api.core.Datacube
+                    The Datacube instance to load data with.
+      product:      product to copy
+      store:        path of the zarr store
+    Args:
+      time:         (OPTIONAL) pair (list) of minimum and maximum date (all by default)
+      lon:          pair (list) of minimum and maximum longitude (store extent by default)
+      lat:          pair (list) of minimum and maximum latitude (store extent by default)
+      measurements: (OPTIONAL) list of measurements (all, or the ones of the store, by default)
+      chunk_size:   (OPTIONAL) latitude and longitude size of the zarr chunks (64 by default)
+      time_chunk:   (OPTIONAL) time size of the zarr chunks (256 by default)
+      budget:       (OPTIONAL) maximum number of bytes of source data loaded at once (zarr_rechunk_budget by default)
+    Output:
+      number of acquisitions written (appended or resumed) to the store
+    """
+    budget = budget or zarr_rechunk_budget
+    store = str(store)
+    exists = os.path.exists(store)
+    stored_times = np.array([], dtype='datetime64[ns]')
+    if exists:
+        stored = xr.open_zarr(store)
+        lon = lon or stored.attrs['rechunk_lon']
+        lat = lat or stored.attrs['rechunk_lat']
+        measurements = measurements or list(stored.data_vars)
+        stored_times = stored.time.values
+        chunk_size = stored[measurements[0]].encoding['chunks'][1]
+        time_chunk = stored[measurements[0]].encoding['chunks'][0]
+    query = dict(product = product, lon = tuple(lon), lat = tuple(lat), measurements = measurements)
+    if time is not None:
+        query['time'] = tuple(time)
+
+    # Lazy load with one chunk per acquisition, used for the list of acquisitions and the grid only.
+    times = dc.load(dask_chunks = {'time': 1}, **query).time.values
+
+    progress = _read_progress(store) if exists else None
+    n_times = 0
+    if progress is None:
+        # Only the acquisitions newer than the last stored one are appended.
+        if len(stored_times):
+            times = times[times > stored_times[-1]]
+        if len(times) == 0:
+            return 0
+        start = len(stored_times)
+    else:
+        # Resume the interrupted batch, then the following acquisitions.
+        start = progress['time_start']
+        times = np.concatenate([stored_times[start:progress['time_stop']],
+                                times[times > stored_times[progress['time_stop'] - 1]]])
+
+    index = 0
+    while index < len(times):
+        # First batch completes the last, partial, time chunk of the store.
+        stop = index + time_chunk - (start + index) % time_chunk
+        batch_times = times[index:stop]
+        time_start, time_stop = start + index, start + index + len(batch_times)
+        batch_query = dict(query, time = (str(batch_times[0]), str(batch_times[-1])))
+
+        # Spatial blocks (multiple of the chunks) holding at most budget bytes of the batch.
+        lazy = dc.load(dask_chunks = {'time': 1}, **batch_query)
+        pixel_bytes = sum(lazy[name].dtype.itemsize for name in lazy.data_vars) * len(batch_times)
+        block = max(1, int(np.sqrt(budget / pixel_bytes)) // chunk_size) * chunk_size
+        if progress is not None:
+            # The blocks of the interrupted batch
+            block = progress['block']
+        batch = dc.load(dask_chunks = {'time': 1, 'latitude': block, 'longitude': block}, **batch_query)
+        batch = _zarr_template(batch.sel(time = batch_times))
+        n_lat, n_lon = batch.sizes['latitude'], batch.sizes['longitude']
+        blocks = [(r, c) for r in range(0, n_lat, block) for c in range(0, n_lon, block)]
+
+        if progress is None:
+            # Create or extend the store (metadata and coordinates only), then write the blocks.
+            batch.attrs.update({'rechunk_product': product, 'rechunk_lon': list(lon), 'rechunk_lat': list(lat)})
+            if not exists:
+                encoding = {name: {'chunks': (time_chunk, chunk_size, chunk_size)} for name in batch.data_vars}
+                batch.to_zarr(store, mode = 'w-', compute = False, encoding = encoding, safe_chunks = False)
+                exists = True
+            else:
+                batch.drop_vars(['latitude', 'longitude']).to_zarr(store, append_dim = 'time', compute = False,
+                                                                   safe_chunks = False)
+            progress = {'time_start': time_start, 'time_stop': time_stop, 'block': block, 'blocks_done': 0}
+            _write_progress(store, progress)
+
+        for block_index in range(progress['blocks_done'], len(blocks)):
+            r, c = blocks[block_index]
+            part = batch.isel(latitude = slice(r, r + block), longitude = slice(c, c + block)).load()
+            part.drop_vars(['latitude', 'longitude', 'time']).to_zarr(
+                store, region = {'time': slice(time_start, time_stop),
+                                 'latitude': slice(r, r + part.sizes['latitude']),
+                                 'longitude': slice(c, c + part.sizes['longitude'])})
+            progress['blocks_done'] = block_index + 1
+            _write_progress(store, progress)
+        _write_progress(store, None)
+        progress = None
+        n_times += len(batch_times)
+        index = stop
+    return n_times
+
+
+def load_zarr(store, time = None, lon = None, lat = None, measurements = None, dask_chunks = None):
+    """
+    Description:
+      Load a zarr store written by zarr_rechunk as dc.load would load the product
+    -----
+    Input:
+      store:        path of the zarr store
+    Args:
+      time:         (OPTIONAL) pair (list) of minimum and maximum date, partial dates ('2016', '2016-03-31')
+                    covering their whole period as in dc.load
+      lon:          (OPTIONAL) pair (list) of minimum and maximum longitude
+      lat:          (OPTIONAL) pair (list) of minimum and maximum latitude
+      measurements: (OPTIONAL) list of measurements
+      dask_chunks:  (OPTIONAL) if given the dataset is not loaded in memory but kept as dask arrays
+                    (with the chunks of the store)
+    Output:
+      xarray.Dataset
+    """
+    ds = xr.open_zarr(str(store))
+    if measurements is not None:
+        ds = ds[list(measurements)]
+    selection = {}
+    for dim, bounds in (('time', time), ('longitude', lon), ('latitude', lat)):
+        if bounds is None:
+            continue
+        if dim == 'time':
+            low, high = [np.datetime64(bound, 'ns') for bound in sorted(_time_bounds(bounds))]
+        else:
+            low, high = sorted(bounds)
+        # Coordinates may be decreasing (latitude)
+        decreasing = ds.sizes[dim] > 1 and ds[dim].values[1] < ds[dim].values[0]
+        selection[dim] = slice(high, low) if decreasing else slice(low, high)
+    ds = ds.sel(**selection)
+    if dask_chunks is None:
+        ds = ds.load()
+    return ds
+
+
+class ZarrDatacube(object):
+    """
+    Description:
+      Datacube stand-in loading the products rechunked with zarr_rechunk from their zarr store,
+      and the other products (and the acquisitions newer than the store) from dc.
+      It can be given to load_multi_clean (or any function calling dc.load) instead of dc:
+        dsc, cm = load_multi_clean(dc = ZarrDatacube(dc, {'s2_l2a_10m_swiss': '/datacube/zarr/s2.zarr'}), ...)
+    -----
+    Input:
+      dc:     datacube.api.core.Datacube
+      stores: dictionary of product: zarr store path
+    """
+    def __init__(self, dc, stores):
+        self.dc = dc
+        self.stores = stores
+
+    def __getattr__(self, name):
+        # list_products, find_datasets, ...
+        return getattr(self.dc, name)
+
+    def load(self, product = None, time = None, lon = None, lat = None, measurements = None,
+             dask_chunks = None, **kwargs):
+        if product not in self.stores:
+            return self.dc.load(product = product, time = time, lon = lon, lat = lat, measurements = measurements,
+                                dask_chunks = dask_chunks, **kwargs)
+        ds = load_zarr(self.stores[product], time = time, lon = lon, lat = lat, measurements = measurements,
+                       dask_chunks = dask_chunks)
+        if self.dc is None:
+            return ds
+        # Acquisitions ingested since the last zarr_rechunk
+        last = xr.open_zarr(str(self.stores[product])).time.values[-1]
+        end = np.datetime64('now', 'ns') if time is None else np.datetime64(max(_time_bounds(time)), 'ns')
+        if end <= last:
+            return ds
+        newer = self.dc.load(product = product, time = (str(last + np.timedelta64(1, 'ns')), str(end)),
+                             lon = lon, lat = lat, measurements = measurements or list(ds.data_vars),
+                             dask_chunks = dask_chunks, **kwargs)
+        if len(newer.variables) == 0 or newer.sizes.get('time', 0) == 0:
+            return ds
+        return xr.concat([ds, newer[list(ds.data_vars)]], dim = 'time')
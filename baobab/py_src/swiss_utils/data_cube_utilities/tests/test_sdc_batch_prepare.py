@@ -0,0 +1,111 @@
+import uuid
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+yaml = pytest.importorskip('yaml')
+from swiss_utils.data_cube_utilities.sdc_batch_prepare import prepare_tree, load_manifest, MANIFEST_NAME
+
+'''
+prepare_tree is run repeatedly on a temporary tree of scene folders with a dummy prepare_datasets, whose document
+is the content of the band file of a scene (and a new id every time, as the prepare scripts).
+'''
+
+YAML_NAME = 'datacube-metadata.yaml'
+
+
+def prepare_datasets(path):
+    # Module level: sent to the worker processes
+    with open(str(path.joinpath('band.tif'))) as f:
+        content = f.read()
+    if content == 'corrupt':
+        raise ValueError("Corrupt scene")
+    return {'id': str(uuid.uuid4()), 'label': path.name, 'band': content}, path
+
+
+def is_scene(path):
+    return path.joinpath('band.tif').exists()
+
+
+def _write_band(scene, content, mtime_ns):
+    band = scene.joinpath('band.tif')
+    band.write_text(content)
+    os.utime(str(band), ns=(mtime_ns, mtime_ns))
+
+
+def _documents(scenes):
+    documents = {}
+    for name, scene in scenes.items():
+        with open(str(scene.joinpath(YAML_NAME))) as f:
+            documents[name] = yaml.safe_load(f)
+    return documents
+
+
+def _yaml_mtimes(scenes):
+    return {name: os.stat(str(scene.joinpath(YAML_NAME))).st_mtime_ns for name, scene in scenes.items()}
+
+
+@pytest.fixture
+def scenes(tmp_path):
+    scenes = {}
+    for index, name in enumerate(['LC08_A', 'LC08_B', 'LC08_C']):
+        scenes[name] = tmp_path / 'ls8' / str(2019 + index) / name
+        scenes[name].mkdir(parents=True)
+        _write_band(scenes[name], name.lower(), 10 ** 18)
+    return scenes
+
+
+def _prepare(tmp_path, **kwargs):
+    return prepare_tree([tmp_path / 'ls8'], prepare_datasets, is_scene, YAML_NAME, workers=2, **kwargs)
+
+
+def test_unchanged_scenes_are_skipped(scenes, tmp_path):
+    assert _prepare(tmp_path) == {'prepared': 3, 'written': 3, 'skipped': 0, 'failed': 0}
+    manifest = load_manifest(str(tmp_path / 'ls8' / MANIFEST_NAME))
+    assert sorted(manifest) == sorted(str(scene.resolve()) for scene in scenes.values())
+    documents, mtimes = _documents(scenes), _yaml_mtimes(scenes)
+    assert {name: document['band'] for name, document in documents.items()} == \
+        {name: name.lower() for name in scenes}
+
+    assert _prepare(tmp_path) == {'prepared': 0, 'written': 0, 'skipped': 3, 'failed': 0}
+    assert _documents(scenes) == documents
+    assert _yaml_mtimes(scenes) == mtimes
+
+    # Forced: prepared again, with the same documents and ids, so nothing is written
+    assert _prepare(tmp_path, force=True) == {'prepared': 3, 'written': 0, 'skipped': 0, 'failed': 0}
+    assert _yaml_mtimes(scenes) == mtimes
+
+    # A deleted YAML is written again, with its id
+    scenes['LC08_B'].joinpath(YAML_NAME).unlink()
+    assert _prepare(tmp_path) == {'prepared': 1, 'written': 1, 'skipped': 2, 'failed': 0}
+    assert _documents(scenes) == documents
+
+
+def test_changed_scenes_are_prepared_again(scenes, tmp_path):
+    _prepare(tmp_path)
+    documents, mtimes = _documents(scenes), _yaml_mtimes(scenes)
+
+    # A newer file with the same document: prepared, the YAML is not rewritten
+    _write_band(scenes['LC08_A'], 'lc08_a', 2 * 10 ** 18)
+    assert _prepare(tmp_path) == {'prepared': 1, 'written': 0, 'skipped': 2, 'failed': 0}
+    assert _yaml_mtimes(scenes) == mtimes
+
+    # A changed document: the YAML is rewritten, with the id of the scene
+    _write_band(scenes['LC08_B'], 'reprocessed', 10 ** 18)
+    assert _prepare(tmp_path) == {'prepared': 1, 'written': 1, 'skipped': 2, 'failed': 0}
+    updated = _documents(scenes)
+    assert updated['LC08_B'] == dict(documents['LC08_B'], band='reprocessed')
+    assert updated['LC08_A'] == documents['LC08_A']
+    assert _prepare(tmp_path)['skipped'] == 3
+
+    # A failed scene is counted; its manifest entry is not updated, so it is retried
+    _write_band(scenes['LC08_C'], 'corrupt', 3 * 10 ** 18)
+    assert _prepare(tmp_path) == {'prepared': 0, 'written': 0, 'skipped': 2, 'failed': 1}
+    assert _prepare(tmp_path)['failed'] == 1
+    _write_band(scenes['LC08_C'], 'lc08_c', 3 * 10 ** 18)
+    assert _prepare(tmp_path) == {'prepared': 1, 'written': 0, 'skipped': 2, 'failed': 0}
+    assert _documents(scenes)['LC08_C'] == documents['LC08_C']
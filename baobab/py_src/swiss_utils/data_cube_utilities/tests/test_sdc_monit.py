@@ -0,0 +1,87 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('psutil')
+pytest.importorskip('IPython')
+from swiss_utils.data_cube_utilities.sdc_monit import ResourceSampler
+
+'''
+ResourceSampler is run for short periods at a high rate, without dask (client=False): its thread, ring buffer and
+exports are checked, not the sampled values themselves.
+'''
+
+COLUMNS = ['rss_mb', 'pss_mb', 'cpu_pc', 'read_mb', 'write_mb', 'processes']
+
+
+def _wait_for(condition, timeout_s = 10):
+    end = time.monotonic() + timeout_s
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_start_stop():
+    sampler = ResourceSampler(interval_s = 0.01, client = False)
+    assert sampler.start() is sampler
+    thread = sampler._thread
+    assert thread.daemon and thread.is_alive()
+    # Starting again keeps the running thread
+    assert sampler.start()._thread is thread
+    _wait_for(lambda: len(sampler.samples) >= 3)
+    assert sampler.stop() is sampler
+    assert not thread.is_alive() and sampler._thread is None
+    count = len(sampler.samples)
+    time.sleep(0.05)
+    assert len(sampler.samples) == count
+
+    # Restarted, the samples are added to the previous ones
+    sampler.start()
+    _wait_for(lambda: len(sampler.samples) > count)
+    sampler.stop()
+    times = [sample['time'] for sample in sampler.samples]
+    assert times == sorted(times)
+
+
+def test_context_manager_and_ring_buffer():
+    with ResourceSampler(interval_s = 0.005, size = 5, client = False) as sampler:
+        assert sampler._thread.is_alive()
+        _wait_for(lambda: len(sampler.samples) == 5)
+        first = sampler.samples[0]['time']
+        _wait_for(lambda: sampler.samples[0]['time'] > first)
+        sampler.mark('step')
+    assert sampler._thread is None
+    assert len(sampler.samples) == sampler.samples.maxlen == 5
+    assert [label for _, label in sampler.marks] == ['step']
+    for sample in sampler.samples:
+        assert sample['processes'] >= 1
+        assert sample['rss_mb'] > 0 and sample['pss_mb'] > 0
+        assert not any(column.startswith('dask') for column in sample)
+
+    # Stopped by an exception too
+    with pytest.raises(KeyError):
+        with ResourceSampler(interval_s = 0.01, client = False) as sampler:
+            raise KeyError
+    assert sampler._thread is None
+
+
+def test_to_csv_round_trip(tmp_path):
+    sampler = ResourceSampler(interval_s = 0.01, client = False)
+    assert sampler.to_dataframe().empty
+    with sampler:
+        _wait_for(lambda: len(sampler.samples) >= 3)
+    df = sampler.to_dataframe()
+    assert df.index.name == 'time' and list(df.columns) == COLUMNS
+    path = str(tmp_path / 'resources.csv')
+    sampler.to_csv(path)
+    read = pd.read_csv(path, index_col = 'time', parse_dates = ['time'])
+    assert list(read.columns) == COLUMNS
+    np.testing.assert_array_equal(read.index.values, df.index.values)
+    np.testing.assert_allclose(read.values.astype(np.float64), df.values.astype(np.float64))
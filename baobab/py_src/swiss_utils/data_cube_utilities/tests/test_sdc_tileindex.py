@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('netCDF4')
+yaml = pytest.importorskip('yaml')
+from swiss_utils.data_cube_utilities import sdc_tileindex
+from swiss_utils.data_cube_utilities.sdc_tileindex import build_tile_index, TileIndexDatacube
+
+equal = np.testing.assert_array_equal
+
+'''
+A product is split into NetCDF tiles by 2 x 2 spatial tiles and years, as an ingestion would write it. The tiles
+loaded through the index are compared with the source arrays, nodata where a tile is missing.
+'''
+
+NODATA = -9999
+MEASUREMENTS = ['red', 'nir']
+
+
+@pytest.fixture
+def product():
+    rng = np.random.default_rng(0)
+    times = (pd.to_datetime(['2019-12-22', '2019-12-27', '2020-01-01', '2020-01-06', '2020-01-11'])
+             + pd.Timedelta(hours = 10)).values.astype('datetime64[ns]')
+    dims = ('time', 'latitude', 'longitude')
+    shape = (len(times), 20, 30)
+    return xr.Dataset({name: (dims, rng.integers(0, 5000, shape).astype(np.int16), {'nodata': NODATA})
+                       for name in MEASUREMENTS},
+                      coords = dict(time = times, latitude = 46.5 - 0.001 * np.arange(20),
+                                    longitude = 7. + 0.001 * np.arange(30)))
+
+
+@pytest.fixture
+def ingested(product, tmp_path):
+    """The ingestion configuration and the paths of the tiles; the north east tile of 2020 is missing"""
+    location = tmp_path / 'data'
+    os.makedirs(str(location / 'ls8'))
+    paths = {}
+    for y, lats in enumerate([slice(0, 10), slice(10, 20)]):
+        for x, lons in enumerate([slice(0, 15), slice(15, 30)]):
+            for year in ['2019', '2020']:
+                if (y, x, year) == (0, 1, '2020'):
+                    continue
+                tile = product.isel(latitude = lats, longitude = lons).sel(time = year)
+                paths[y, x, year] = str(location / 'ls8' / 'ls8_{}_{}_{}.nc'.format(x, y, year))
+                tile.to_netcdf(paths[y, x, year])
+    config = dict(output_type = 'ls8_test', location = str(location),
+                  file_path_template = 'ls8/ls8_{tile_index[0]}_{tile_index[1]}_{start_time}.nc',
+                  global_attributes = dict(platform = 'landsat-8'), storage = dict(crs = 'EPSG:4326'),
+                  measurements = [dict(name = name, dtype = 'int16', nodata = NODATA) for name in MEASUREMENTS])
+    config_path = str(tmp_path / 'ls8_test.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return config_path, paths
+
+
+def test_load_across_tiles_and_time(product, ingested, tmp_path):
+    config_path, paths = ingested
+    index_path = str(tmp_path / 'index.db')
+    assert build_tile_index(index_path, config_path) == {'ls8_test': 7}
+    dc = TileIndexDatacube(index_path, workers = 3)
+    products = dc.list_products()
+    assert products.name.tolist() == ['ls8_test']
+    assert products.platform.tolist() == ['LANDSAT_8']
+
+    lon, lat, time = (7.005, 7.02), (46.485, 46.495), ('2019-12-27', '2020-01-06')
+    loaded = dc.load(product = 'ls8_test', time = time, lon = lon, lat = lat)
+    expected = product.sel(time = slice(*time), latitude = slice(max(lat), min(lat)),
+                           longitude = slice(*lon)).copy(deep = True)
+    # No tile of 2020 covers the north east pixels
+    north_east = (expected.latitude > product.latitude[10]) & (expected.longitude >= product.longitude[15])
+    expected = expected.where(~((expected.time.dt.year == 2020) & north_east), NODATA).astype(np.int16)
+    equal(loaded.time.values, expected.time.values)
+    equal(loaded.latitude.values, expected.latitude.values)
+    equal(loaded.longitude.values, expected.longitude.values)
+    for name in MEASUREMENTS:
+        assert loaded[name].dtype == np.int16
+        equal(loaded[name].values, expected[name].values)
+    assert (loaded.red.sel(time = '2020').values[:, north_east.values] == NODATA).all()
+
+    assert dc.load(product = 'ls8_test', measurements = ['nir'], time = '2020-01').data_vars.keys() == {'nir'}
+    assert not dc.load(product = 'ls8_test', time = '2021').data_vars
+    with pytest.raises(ValueError):
+        dc.load(product = 'unknown')
+
+
+def test_reindex(ingested, tmp_path, monkeypatch):
+    config_path, paths = ingested
+    index_path = str(tmp_path / 'index.db')
+    build_tile_index(index_path, config_path)
+
+    opened = []
+    netcdf_extent = sdc_tileindex._netcdf_extent
+    monkeypatch.setattr(sdc_tileindex, '_netcdf_extent', lambda path: opened.append(path) or netcdf_extent(path))
+    # Unchanged files are not opened again
+    assert build_tile_index(index_path, config_path) == {'ls8_test': 7}
+    assert opened == []
+
+    # Deleted files are removed from the index, changed files are read again
+    os.remove(paths[1, 1, '2019'])
+    with xr.open_dataset(paths[0, 0, '2019']) as ds:
+        changed = ds.isel(time = slice(0, 1)).load()
+    changed['red'][:] = 1
+    changed.to_netcdf(paths[0, 0, '2019'] + '.new')
+    os.replace(paths[0, 0, '2019'] + '.new', paths[0, 0, '2019'])
+    assert build_tile_index(index_path, config_path) == {'ls8_test': 6}
+    assert opened == [paths[0, 0, '2019']]
+
+    dc = TileIndexDatacube(index_path)
+    assert paths[1, 1, '2019'] not in dc.find_files('ls8_test')
+    # The time removed from the changed file is no longer found
+    assert dc.find_files('ls8_test', time = '2019-12-27', lon = (7., 7.005), lat = (46.495, 46.5)) == []
+    loaded = dc.load(product = 'ls8_test', time = '2019')
+    assert loaded.sizes['time'] == 2
+    equal(loaded.red.values[0, :10, :15], 1)
+    # The pixels of the deleted file and of the time removed from the changed file are nodata
+    assert (loaded.red.values[:, 10:, 15:] == NODATA).all()
+    assert (loaded.red.values[1, :10, :15] == NODATA).all()
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('zarr')
+pytest.importorskip('dask')
+from swiss_utils.data_cube_utilities import sdc_zarr
+from swiss_utils.data_cube_utilities.sdc_tileindex import _time_bounds
+
+equal = np.testing.assert_array_equal
+
+'''
+zarr_rechunk (creation, append and resume of an interrupted copy), load_zarr and ZarrDatacube are compared with
+a fake Datacube serving an in memory product as dc.load would (partial dates covering their whole period).
+'''
+
+LON = (7., 7.011)
+LAT = (46.489, 46.5)
+
+
+class _FakeDatacube(object):
+    def __init__(self, product):
+        self.product = product
+
+    def load(self, product = None, time = None, lon = None, lat = None, measurements = None, dask_chunks = None,
+             **kwargs):
+        ds = self.product if measurements is None else self.product[list(measurements)]
+        if time is not None:
+            low, high = _time_bounds(time)
+            ds = ds.sel(time = slice(np.datetime64(low, 'ns'), np.datetime64(high, 'ns')))
+        if lon is not None:
+            ds = ds.sel(longitude = slice(min(lon), max(lon)))
+        if lat is not None:
+            ds = ds.sel(latitude = slice(max(lat), min(lat)))
+        if dask_chunks is not None:
+            ds = ds.chunk({dim: size for dim, size in dask_chunks.items() if dim in ds.dims})
+        return ds
+
+
+@pytest.fixture
+def dc():
+    rng = np.random.default_rng(0)
+    # Acquisitions at 10:00, every 5 days
+    times = (pd.date_range('2020-01-01', periods = 20, freq = '5D') + pd.Timedelta(hours = 10)).values
+    dims = ('time', 'latitude', 'longitude')
+    shape = (len(times), 12, 12)
+    product = xr.Dataset({'red': (dims, rng.integers(0, 3000, shape).astype(np.int16)),
+                          'nir': (dims, rng.integers(0, 5000, shape).astype(np.int16))},
+                         coords = dict(time = times.astype('datetime64[ns]'),
+                                       latitude = 46.5 - 0.001 * np.arange(12),
+                                       longitude = 7. + 0.001 * np.arange(12)))
+    return _FakeDatacube(product)
+
+
+def _rechunk(dc, store, **kwargs):
+    return sdc_zarr.zarr_rechunk(dc, 'ls8', store, lon = LON, lat = LAT, chunk_size = 4, time_chunk = 3,
+                                 budget = 1, **kwargs)
+
+
+def _check_store(store, expected):
+    stored = sdc_zarr.load_zarr(store)
+    equal(stored.time.values, expected.time.values)
+    for name in expected.data_vars:
+        equal(stored[name].values, expected[name].values)
+    assert not os.path.exists(os.path.join(store, sdc_zarr.ZARR_PROGRESS))
+
+
+def test_end_date_covers_the_whole_day(dc, tmp_path):
+    store = str(tmp_path / 'ls8.zarr')
+    _rechunk(dc, store)
+    expected = dc.load(time = ('2020-01-01', '2020-01-16'))
+    assert expected.sizes['time'] == 4
+    loaded = sdc_zarr.ZarrDatacube(None, {'ls8': store}).load(product = 'ls8', time = ('2020-01-01', '2020-01-16'))
+    equal(loaded.time.values, expected.time.values)
+    equal(sdc_zarr.load_zarr(store, time = ('2020-01', '2020-01')).time.values,
+          dc.load(time = ('2020-01', '2020-01')).time.values)
+
+
+def test_newer_acquisitions_from_dc(dc, tmp_path):
+    store = str(tmp_path / 'ls8.zarr')
+    assert _rechunk(dc, store, time = ('2020-01-01', '2020-01-11')) == 3
+    # The acquisition of the last day is loaded from dc
+    loaded = sdc_zarr.ZarrDatacube(dc, {'ls8': store}).load(product = 'ls8', time = ('2020-01-01', '2020-01-16'))
+    expected = dc.load(time = ('2020-01-01', '2020-01-16'))
+    equal(loaded.time.values, expected.time.values)
+    equal(loaded.red.values, expected.red.values)
+
+
+def test_append(dc, tmp_path):
+    store = str(tmp_path / 'ls8.zarr')
+    assert _rechunk(dc, store, time = ('2020-01-01', '2020-02-10')) == 9
+    # A second call appends the newer acquisitions, completing the partial time chunk first
+    assert _rechunk(dc, store) == 11
+    assert _rechunk(dc, store) == 0
+    _check_store(store, dc.load(lon = LON, lat = LAT))
+
+
+def test_resume(dc, tmp_path, monkeypatch):
+    store = str(tmp_path / 'ls8.zarr')
+    write_progress = sdc_zarr._write_progress
+
+    def interrupted(store, progress):
+        # Interrupted in the middle of the blocks of the second batch
+        if progress is not None and progress['time_start'] == 3 and progress['blocks_done'] == 4:
+            raise KeyboardInterrupt
+        write_progress(store, progress)
+
+    monkeypatch.setattr(sdc_zarr, '_write_progress', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _rechunk(dc, store)
+    monkeypatch.setattr(sdc_zarr, '_write_progress', write_progress)
+    progress = sdc_zarr._read_progress(store)
+    assert (progress['time_start'], progress['time_stop'], progress['blocks_done']) == (3, 6, 3)
+
+    assert _rechunk(dc, store) == 17
+    _check_store(store, dc.load(lon = LON, lat = LAT))
@@ -32,6 +32,8 @@ def xr_scale_res(dataset, x_coord='longitude', y_coord='latitude',
     """
     Scales the resolution of an `xarray.Dataset` or `xarray.DataArray`
     to a fraction of its original resolution or an absolute resolution.
+    Pixels are selected by nearest neighbors. To reduce the resolution by aggregating
+    blocks of pixels, see `xr_coarsen_2x()` and `xr_pyramid()`.
 
     Parameters
     ----------
@@ -167,4 +169,198 @@ def xr_interp(dataset, interp_config):
     elif isinstance(dataset, xr.Dataset):
         for data_var_name in interp_data.data_vars:
             interp_data[data_var_name] = interp_data[data_var_name].astype(dataset[data_var_name].dtype)
-    return interp_data
\ No newline at end of file
+    return interp_data
+
+## Pyramids ##
+
+# Block aggregation methods of `xr_coarsen_2x` and `xr_pyramid`.
+pyramid_methods = ['mean', 'median', 'mode', 'any', 'all']
+
+
+def _block_mode(values, axis):
+    """
+    Returns the most frequent value of the blocks of `values` along `axis`
+    (the first one in case of a tie). NaN values (padding) are never counted.
+    Works on NumPy and Dask arrays.
+    """
+    values = np.moveaxis(values, axis, tuple(range(-len(axis), 0)))
+    values = values.reshape(values.shape[:-len(axis)] + (-1,))
+    candidates = [values[..., i] for i in range(values.shape[-1])]
+    mode, mode_count = None, None
+    for candidate in candidates:
+        count = sum((candidate == other).astype(np.int8) for other in candidates)
+        if mode is None:
+            mode, mode_count = candidate, count
+        else:
+            more_frequent = count > mode_count
+            mode = np.where(more_frequent, candidate, mode)
+            mode_count = np.where(more_frequent, count, mode_count)
+    return mode
+
+
+def _coarsen_2x_data_array(data_array, method, x_coord, y_coord):
+    """Aggregates 2x2 blocks of the x and y dimensions of an `xarray.DataArray` with `method`."""
+    if method not in pyramid_methods:
+        raise ValueError("method must be one of {}".format(pyramid_methods))
+    dims = {dim: 2 for dim in (x_coord, y_coord) if dim in data_array.dims}
+    if not dims:
+        return data_array
+    dtype = data_array.dtype
+    # Odd sizes are padded with NaN, which none of the methods take into account.
+    if method in ('mode', 'any', 'all') and not np.issubdtype(dtype, np.floating):
+        data_array = data_array.astype(np.float32 if dtype.itemsize <= 2 else np.float64)
+    coarsened = data_array.coarsen(dims, boundary='pad')
+    if method == 'mode':
+        return coarsened.reduce(_block_mode).astype(dtype)
+    if method in ('any', 'all'):
+        data_array = coarsened.max() if method == 'any' else coarsened.min()
+        return data_array.astype(bool)
+    return getattr(coarsened, method)()
+
+
+def xr_coarsen_2x(dataset, method='mean', x_coord='longitude', y_coord='latitude'):
+    """
+    Halves the resolution of an `xarray.Dataset` or `xarray.DataArray` by aggregating
+    blocks of 2x2 pixels, unlike `xr_scale_res()`, which selects pixels.
+    Works on NumPy and Dask arrays (lazily).
+
+    Parameters
+    ----------
+    dataset: xarray.Dataset or xarray.DataArray
+        The Dataset or DataArray to reduce the resolution of.
+    method: str or dict
+        The aggregation method. Can be any of ['mean', 'median', 'mode', 'any', 'all'].
+        'mode' suits categorical data (e.g. classifications) and keeps the dtype.
+        'any' and 'all' suit masks and return booleans.
+        For a Dataset, a dict mapping names of data variables to methods can be given,
+        the data variables not in it being aggregated with 'mean'.
+    x_coord, y_coord: str
+        Names of the x and y coordinates in `dataset` to scale.
+        The coordinates of the blocks are the means of the coordinates of their pixels.
+
+    Returns
+    -------
+    dataset_scaled: xarray.Dataset or xarray.DataArray
+        The result of aggregating `dataset`. Dimensions of odd sizes are rounded up.
+    """
+    if isinstance(dataset, xr.DataArray):
+        return _coarsen_2x_data_array(dataset, method, x_coord, y_coord)
+    methods = method if isinstance(method, dict) else {}
+    default_method = 'mean' if isinstance(method, dict) else method
+    return xr.Dataset({name: _coarsen_2x_data_array(dataset[name], methods.get(name, default_method),
+                                                    x_coord, y_coord)
+                       for name in dataset.data_vars}, attrs=dataset.attrs)
+
+
+def xr_pyramid(dataset, method='mean', x_coord='longitude', y_coord='latitude', min_size=256, num_levels=None):
+    """
+    Builds a pyramid of successive 2x block aggregations of an `xarray.Dataset` or `xarray.DataArray`.
+    Every level is aggregated from the previous one with `xr_coarsen_2x()`, so for Dask
+    arrays the whole pyramid is lazy and no level requires the full-resolution array in memory.
+
+    Parameters
+    ----------
+    dataset: xarray.Dataset or xarray.DataArray
+        The full resolution Dataset or DataArray (level 0).
+    method: str or dict
+        The aggregation method (see `xr_coarsen_2x()`).
+        Note that the median and mode of a level are those of the blocks of the previous level.
+    x_coord, y_coord: str
+        Names of the x and y coordinates in `dataset`.
+    min_size: int
+        Levels are added until both the x and y sizes are at most `min_size`.
+    num_levels: int
+        The number of levels, including level 0. Overrides `min_size` if specified.
+
+    Returns
+    -------
+    levels: list of xarray.Dataset or xarray.DataArray
+        The levels, from the full resolution to the coarsest one.
+    """
+    levels = [dataset]
+    while True:
+        size = max(levels[-1].sizes[x_coord], levels[-1].sizes[y_coord])
+        complete = len(levels) >= num_levels if num_levels is not None else size <= min_size
+        if complete or size == 1:
+            return levels
+        levels.append(xr_coarsen_2x(levels[-1], method, x_coord, y_coord))
+
+
+def xr_select_pyramid_level(levels, display_size, x_coord='longitude', y_coord='latitude'):
+    """
+    Selects the coarsest level of a pyramid that has at least as many pixels as a display.
+
+    Parameters
+    ----------
+    levels: list of xarray.Dataset or xarray.DataArray
+        The levels of a pyramid, from the full resolution to the coarsest one (see `xr_pyramid()`).
+    display_size: list-like
+        The number of pixels of the display along x and y, respectively.
+    x_coord, y_coord: str
+        Names of the x and y coordinates in the levels.
+
+    Returns
+    -------
+    level: xarray.Dataset or xarray.DataArray
+        The selected level, or the full resolution one if no level is large enough.
+    """
+    width, height = display_size
+    for level in reversed(levels):
+        if level.sizes[x_coord] >= width and level.sizes[y_coord] >= height:
+            return level
+    return levels[0]
+
+
+def write_pyramid_to_zarr(levels, path, method=None, mode='w'):
+    """
+    Writes the levels of a pyramid to a multiscale Zarr group. Level `i` is written to the
+    subgroup `str(i)` and the group attributes list the levels under 'multiscales',
+    following the convention of multiscale Zarr readers.
+
+    Parameters
+    ----------
+    levels: list of xarray.Dataset or xarray.DataArray
+        The levels of a pyramid, from the full resolution to the coarsest one (see `xr_pyramid()`).
+        Dask backed levels are computed one chunk at a time.
+    path: str
+        The path of the Zarr group.
+    method: str or dict
+        The aggregation method of the levels, recorded in the group attributes.
+    mode: str
+        'w' to overwrite an existing group or 'w-' to fail if it exists.
+    """
+    import zarr
+
+    for index, level in enumerate(levels):
+        if isinstance(level, xr.DataArray):
+            level = level.to_dataset(name=level.name if level.name is not None else 'data')
+        level.to_zarr(path, group=str(index), mode=mode if index == 0 else 'w')
+    group = zarr.open_group(path, mode='a')
+    group.attrs['multiscales'] = [{
+        'version': '0.4',
+        'datasets': [{'path': str(index)} for index in range(len(levels))],
+        'type': 'reduce',
+        'metadata': {'method': method}
+    }]
+
+
+def open_zarr_pyramid(path):
+    """
+    Opens the levels of a multiscale Zarr group written by `write_pyramid_to_zarr()` lazily.
+
+    Parameters
+    ----------
+    path: str
+        The path of the Zarr group.
+
+    Returns
+    -------
+    levels: list of xarray.Dataset
+        The levels, from the full resolution to the coarsest one.
+    """
+    import zarr
+
+    multiscales = zarr.open_group(path, mode='r').attrs['multiscales'][0]
+    return [xr.open_zarr(path, group=level['path']) for level in multiscales['datasets']]
+
+## End Pyramids ##
@@ -1,4 +1,5 @@
 import numpy as np
+import xarray as xr
 from numpy import fft
 
 from .plotter_utils_consts import n_pts_smooth, default_fourier_n_harm
@@ -184,4 +185,171 @@ def fourier_fit(x, y, n_predict=0, x_smooth=None, n_pts=n_pts_smooth,
             n_predict_smooth_fourier)
     x_smooth_fourier = np.concatenate((x_smooth_fourier, x_predict_smooth_fourier))
     y_smooth = np.interp(x_smooth, x_smooth_fourier, y_smooth_fourier)
-    return x_smooth, y_smooth
\ No newline at end of file
+    return x_smooth, y_smooth
+
+## Harmonic regression of whole cubes ##
+
+# Maximum number of (pixel, time, coefficient) elements of the weighted design matrices
+# built at once by `harmonic_fit_array`. Pixels are fitted in blocks of that size.
+harmonic_fit_budget = 2 ** 22
+
+
+def harmonic_design_matrix(t, n_harm=2, period=365.25, trend=True):
+    """
+    Builds the design matrix of a harmonic regression once for all pixels.
+
+    Parameters
+    ----------
+    t: numpy.ndarray
+        1D NumPy array of the times of the acquisitions (e.g. days since the first acquisition).
+    n_harm: int
+        The number of harmonics. Harmonic k has a period of `period / k`.
+    period: float
+        The period of the first harmonic, in the unit of `t`.
+    trend: bool
+        Whether to include a linear trend column.
+
+    Returns
+    -------
+    design: numpy.ndarray
+        Array of shape (len(t), n_coefs) with the columns
+        1, [t,] cos(2 pi t / period), sin(2 pi t / period), ..., cos(2 pi n_harm t / period), sin(2 pi n_harm t / period).
+    """
+    t = np.asarray(t, dtype=np.float64)
+    columns = [np.ones_like(t)] + ([t] if trend else [])
+    for k in range(1, n_harm + 1):
+        angle = 2 * np.pi * k * t / period
+        columns += [np.cos(angle), np.sin(angle)]
+    return np.stack(columns, axis=1)
+
+
+def _solve_normal_equations(gram, moment):
+    """
+    Solves a stack of normal equations, with the pseudo-inverse for the singular ones.
+    """
+    try:
+        return np.linalg.solve(gram, moment[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return (np.linalg.pinv(gram) @ moment[..., None])[..., 0]
+
+
+def harmonic_fit_array(y, design, weights=None):
+    """
+    Fits a harmonic regression to every time series of an array at once by weighted least squares.
+    Missing (NaN) values get a weight of 0, so every pixel is fitted to its own valid acquisitions
+    with batched normal equations and no per-pixel loop.
+
+    Parameters
+    ----------
+    y: numpy.ndarray
+        Array whose last axis is time. NaN for missing values.
+    design: numpy.ndarray
+        The design matrix of the acquisitions, from `harmonic_design_matrix`.
+    weights: numpy.ndarray, optional
+        Non-negative weights broadcastable to `y` (e.g. a quality score). Defaults to 1.
+
+    Returns
+    -------
+    coefs: numpy.ndarray
+        Array of shape y.shape[:-1] + (n_coefs,) of fitted coefficients.
+        NaN for the pixels with fewer valid acquisitions than coefficients.
+    fitted: numpy.ndarray
+        The fitted series, with the shape of `y`.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    shape, n_times = y.shape[:-1], y.shape[-1]
+    n_coefs = design.shape[1]
+    weights = np.ones_like(y) if weights is None else np.broadcast_to(weights, y.shape)
+
+    pixels = y.reshape(-1, n_times)
+    weights = weights.reshape(-1, n_times)
+    coefs = np.empty((pixels.shape[0], n_coefs))
+    block_size = max(1, harmonic_fit_budget // (n_times * n_coefs))
+    for start in range(0, pixels.shape[0], block_size):
+        block = pixels[start:start + block_size]
+        valid = ~np.isnan(block)
+        block_weights = np.where(valid, weights[start:start + block_size], 0)
+        weighted_design = block_weights[:, :, None] * design  # (pixel, time, coef)
+        gram = np.swapaxes(weighted_design, 1, 2) @ design
+        moment = np.einsum('ptc,pt->pc', weighted_design, np.where(valid, block, 0))
+        under_determined = (block_weights > 0).sum(axis=1) < n_coefs
+        gram[under_determined] = np.eye(n_coefs)
+        block_coefs = _solve_normal_equations(gram, moment)
+        block_coefs[under_determined] = np.nan
+        coefs[start:start + block_size] = block_coefs
+
+    fitted = coefs @ design.T
+    return coefs.reshape(shape + (n_coefs,)), fitted.reshape(y.shape)
+
+
+def harmonic_fit(data_arr, n_harm=2, period=365.25, trend=True, weights=None, time_dim='time'):
+    """
+    Fits a harmonic regression (intercept, linear trend and `n_harm` harmonics) to every pixel
+    of a cube. The design matrix is built once for the acquisition dates and all the pixels are
+    solved at once by `harmonic_fit_array`, so gaps in the series need no special handling.
+    Dask arrays are fitted chunk by chunk.
+
+    Parameters
+    ----------
+    data_arr: xarray.DataArray
+        The data to fit (e.g. NDVI), with a `time_dim` dimension. NaN for missing values.
+    n_harm: int
+        The number of harmonics. Harmonic k has a period of `period / k`.
+    period: float
+        The period of the first harmonic, in days for datetime coordinates
+        (in the unit of the `time_dim` coordinate otherwise).
+    trend: bool
+        Whether to fit a linear trend.
+    weights: xarray.DataArray, optional
+        Non-negative weights of the observations, broadcastable against `data_arr`.
+    time_dim: str
+        The name of the time dimension.
+
+    Returns
+    -------
+    dataset_out: xarray.Dataset
+        Dataset with the variables
+        'intercept' - the value of the fit at the first acquisition, without its harmonics,
+        'trend' - the slope of the linear trend, per day for datetime coordinates (only if `trend`),
+        'amplitude', 'phase' - with a 'harmonic' dimension: the amplitude and the phase (radians) of
+        every harmonic, such that harmonic k is amplitude * cos(2 pi k t / period - phase),
+        'fitted' - the fitted series at the acquisition dates,
+        'gap_filled' - `data_arr` with its NaN values replaced by the fitted values.
+    """
+    times = data_arr[time_dim].values
+    if np.issubdtype(times.dtype, np.datetime64):
+        t = (times - times[0]) / np.timedelta64(1, 'D')
+    else:
+        t = times - times[0]
+    design = harmonic_design_matrix(t, n_harm=n_harm, period=period, trend=trend)
+    n_coefs = design.shape[1]
+
+    def fit(y, w):
+        return harmonic_fit_array(y, design, w)
+
+    if data_arr.chunks is not None:
+        data_arr = data_arr.chunk({time_dim: -1})
+    if weights is None:
+        weights = xr.ones_like(data_arr, dtype=np.float64)
+    weights = weights.broadcast_like(data_arr)
+    if weights.chunks is not None:
+        weights = weights.chunk({time_dim: -1})
+    coefs, fitted = xr.apply_ufunc(fit, data_arr, weights,
+                                   input_core_dims=[[time_dim], [time_dim]],
+                                   output_core_dims=[['coef'], [time_dim]],
+                                   dask='parallelized', output_dtypes=[np.float64, np.float64],
+                                   dask_gufunc_kwargs=dict(output_sizes={'coef': n_coefs}))
+    fitted = fitted.transpose(*data_arr.dims)
+
+    first_harmonic = 2 if trend else 1
+    cosines = coefs.isel(coef=slice(first_harmonic, None, 2)).rename(coef='harmonic')
+    sines = coefs.isel(coef=slice(first_harmonic + 1, None, 2)).rename(coef='harmonic')
+    harmonics = np.arange(1, n_harm + 1)
+    dataset_out = xr.Dataset(dict(intercept=coefs.isel(coef=0, drop=True)))
+    if trend:
+        dataset_out['trend'] = coefs.isel(coef=1, drop=True)
+    dataset_out['amplitude'] = np.hypot(cosines, sines).assign_coords(harmonic=harmonics)
+    dataset_out['phase'] = np.arctan2(sines, cosines).assign_coords(harmonic=harmonics)
+    dataset_out['fitted'] = fitted
+    dataset_out['gap_filled'] = data_arr.where(~np.isnan(data_arr), fitted)
+    return dataset_out
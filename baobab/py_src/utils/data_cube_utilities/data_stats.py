@@ -1,11 +1,153 @@
+import warnings
+import numpy as np
 import xarray as xr
 
 ## Data Availability ##
 
-def find_gaps(data_arr, aggregation_method):
+# Maximum number of (pixel, time) elements processed at once by `gap_statistics`.
+gap_statistics_budget = 2 ** 22
+
+gap_statistics_variables = ['count', 'min', 'mean', 'median', 'max']
+
+
+def _gap_median_bin_edges(time, median_bins):
+    """
+    Returns logarithmically spaced bin edges covering every possible time gap of `time`,
+    from the smallest positive difference between acquisitions to the full time span.
+    """
+    diffs = np.diff(time)
+    diffs = diffs[diffs > 0]
+    if diffs.size == 0:
+        return np.array([1., 2.])
+    return np.geomspace(diffs.min(), time[-1] - time[0], median_bins + 1)
+
+
+def _gap_statistics_block(mask, time, median_bins=None):
+    """
+    Computes the gap statistics of a block of pixels in a single pass along time.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray of bool
+        Array of shape (time, pixel). True for desired elements.
+    time: numpy.ndarray of float64
+        The times of the acquisitions in seconds.
+    median_bins: int, optional
+        The number of bins of the approximate median. The median is exact if None.
+
+    Returns
+    -------
+    statistics: list of numpy.ndarray
+        The count, min, mean, median and max of the gaps of every pixel (NaN where there is no gap).
+    """
+    n_times, n_pixels = mask.shape
+    last_time = np.full(n_pixels, np.nan)
+    count = np.zeros(n_pixels, dtype=np.int64)
+    gap_min = np.full(n_pixels, np.inf)
+    gap_max = np.full(n_pixels, -np.inf)
+    gap_sum = np.zeros(n_pixels)
+    if median_bins is None:
+        gaps = np.full((max(n_times - 1, 1), n_pixels), np.nan)
+    else:
+        edges = _gap_median_bin_edges(time, median_bins)
+        histogram = np.zeros((len(edges) - 1, n_pixels), dtype=np.int64)
+
+    for t in range(n_times):
+        desired = np.flatnonzero(mask[t])
+        gap = time[t] - last_time[desired]
+        # Repeated acquisition times yield gaps of 0, which are not gaps.
+        has_gap = gap > 0
+        pixels, gap = desired[has_gap], gap[has_gap]
+        count[pixels] += 1
+        gap_sum[pixels] += gap
+        gap_min[pixels] = np.minimum(gap_min[pixels], gap)
+        gap_max[pixels] = np.maximum(gap_max[pixels], gap)
+        if median_bins is None:
+            gaps[t - 1, pixels] = gap
+        else:
+            bins = np.clip(np.searchsorted(edges, gap, side='right') - 1, 0, len(edges) - 2)
+            histogram[bins, pixels] += 1
+        last_time[desired] = time[t]
+
+    no_gap = count == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap_mean = gap_sum / count
+    if median_bins is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN slices of the pixels without gaps
+            gap_median = np.nanmedian(gaps, axis=0)
+    else:
+        # Mean of the geometric centers of the bins holding the middle gaps, clipped to the range of the gaps.
+        centers = np.sqrt(edges[:-1] * edges[1:])
+        cumulative = histogram.cumsum(axis=0)
+        lower_bin = (cumulative >= (count + 1) // 2).argmax(axis=0)
+        upper_bin = (cumulative >= count // 2 + 1).argmax(axis=0)
+        gap_median = np.clip((centers[lower_bin] + centers[upper_bin]) / 2, gap_min, gap_max)
+    for statistic in (gap_min, gap_mean, gap_median, gap_max):
+        statistic[no_gap] = np.nan
+    return [count, gap_min, gap_mean, gap_median, gap_max]
+
+
+def _gap_statistics_array(mask, time, median_bins=None):
+    """
+    Computes the gap statistics of an array of bool whose last axis is time, a block of pixels at a time.
+    """
+    shape, n_times = mask.shape[:-1], mask.shape[-1]
+    pixels = mask.reshape(-1, n_times)
+    statistics = [np.empty(pixels.shape[0], dtype=np.int64)] + \
+                 [np.empty(pixels.shape[0]) for _ in gap_statistics_variables[1:]]
+    block_size = max(1, gap_statistics_budget // max(1, n_times))
+    for start in range(0, pixels.shape[0], block_size):
+        block = np.ascontiguousarray(pixels[start:start + block_size].T)
+        for statistic, values in zip(statistics, _gap_statistics_block(block, time, median_bins)):
+            statistic[start:start + block_size] = values
+    return tuple(statistic.reshape(shape) for statistic in statistics)
+
+
+def gap_statistics(data_arr, median_bins=None):
+    """
+    Finds the number, minimum, mean, median and maximum of the time differences between True values
+    in a boolean xarray.DataArray at once.
+
+    Each block of pixels is processed in a single pass along time, keeping the time of the last
+    True value and the running count, minimum, maximum and sum of the gaps of every pixel, so no
+    full-size float64 cube is created. Dask arrays are processed chunk by chunk.
+
+    Parameters
+    ----------
+    data_arr: xarray.DataArray of bool
+        DataArray of boolean values denoting which elements are desired.
+        Examples of desired elements include clear views (or "non-cloud pixels").
+        This DataArray must have a 'time' dimension.
+    median_bins: int, optional
+        If given, the median is approximated with a per-pixel histogram of `median_bins`
+        logarithmically spaced bins instead of keeping every gap of a block of pixels.
+
+    Returns
+    -------
+    gaps: xarray.Dataset
+        Dataset with the variables 'count' (number of gaps) and 'min', 'mean', 'median', 'max'
+        (float64 time gaps in seconds, NaN where there is no gap).
+    """
+    from .dc_time import _n64_datetime_to_scalar
+
+    time = np.asarray(_n64_datetime_to_scalar(data_arr.time.values), dtype=np.float64)
+    mask = data_arr == 1
+    if mask.chunks is not None:
+        mask = mask.chunk({'time': -1})
+    statistics = xr.apply_ufunc(_gap_statistics_array, mask,
+                                kwargs=dict(time=time, median_bins=median_bins),
+                                input_core_dims=[['time']],
+                                output_core_dims=[[] for _ in gap_statistics_variables],
+                                dask='parallelized',
+                                output_dtypes=[np.int64] + [np.float64] * (len(gap_statistics_variables) - 1))
+    return xr.Dataset(dict(zip(gap_statistics_variables, statistics)))
+
+
+def find_gaps(data_arr, aggregation_method, median_bins=None):
     """
     Finds the minimum, mean, median, or maximum time difference between True values
-    in a boolean xarray.DataArray. This should be a faster implementation.
+    in a boolean xarray.DataArray. See `gap_statistics` to obtain all of them at once.
 
     Parameters
     ----------
@@ -15,6 +157,8 @@ def find_gaps(data_arr, aggregation_method):
         This DataArray must have a 'time' dimension.
     aggregation_method: str
         The aggregation method to use. Can be any of ['min', 'mean', 'median', 'max'].
+    median_bins: int, optional
+        If given, the median is approximated with `median_bins` bins (see `gap_statistics`).
 
     Returns
     -------
@@ -22,22 +166,8 @@ def find_gaps(data_arr, aggregation_method):
         The time gaps between True values in `data_arr`. Due to limitations of the numpy.datetime64 data type,
         the time differences are in seconds, stored as np.float64.
     """
-    from .dc_time import _n64_datetime_to_scalar
+    if aggregation_method not in gap_statistics_variables[1:]:
+        raise ValueError("aggregation_method must be one of {}".format(gap_statistics_variables[1:]))
+    return gap_statistics(data_arr, median_bins=median_bins)[aggregation_method]
 
-    # 1. Convert time from numpy.datetime64 to scalars and broadcast along latitude and longitude.
-    time = _n64_datetime_to_scalar(data_arr.time)
-    time, _, _ = xr.broadcast(time, data_arr.latitude, data_arr.longitude)
-    # 2. Fill each undesired point with its previous desired point's time and find the time differences.
-    mask = data_arr == 1
-    time = time.where(mask)
-    time = time.ffill(dim='time')
-    time_diff = time.diff('time')
-    # A time difference is only 0 because of differencing after the forward fill.
-    time_diff = time_diff.where(time_diff != 0)
-    # 3. Calculate the desired statistic for the time differences.
-    if aggregation_method == 'min':    return time_diff.min('time')
-    if aggregation_method == 'mean':   return time_diff.mean('time')
-    if aggregation_method == 'median': return time_diff.median('time')
-    if aggregation_method == 'max':    return time_diff.max('time')
-
-## End Data Availability ##
\ No newline at end of file
+## End Data Availability ##
@@ -1,34 +1,20 @@
 import numpy as np
 import xarray
-import xarray.core.ops as ops
 import xarray as xr
-from itertools import islice
-
-
-def _window(seq, n=2):
-    """Returns a sliding _window (of width n) over data from the iterable"
-    "   s -> (s0,s1,...s[n-1]), (s1,s2,...,sn), ...                   """
-    it = iter(seq)
-    result = tuple(islice(it, n))
-    if len(result) == n:
-        yield result
-    for elem in it:
-        result = result[1:] + (elem,)
-        yield result
 
 
 def _composite_of_first(arrays, reverse=False, name_suffix="_composite"):
-    #In memory of Rube Goldberg
-    narrays = arrays.copy(deep=True)
-    narrays.values = narrays.values[::-1] if reverse else narrays.values
-    notnulls = [ops.notnull(array) for array in narrays]
-    first_notnull = ops.argmax(ops.stack(notnulls), axis=0)
-    composite = np.choose(first_notnull, narrays)
+    # Works on a (reversed) view of the values: the input is not copied.
+    values = arrays.transpose('time', 'latitude', 'longitude').values
+    values = values[::-1] if reverse else values
+    notnulls = ~np.isnan(values) if np.issubdtype(values.dtype, np.floating) else np.ones(values.shape, dtype=bool)
+    first_notnull = np.argmax(notnulls, axis=0)
+    composite = np.take_along_axis(values, first_notnull[np.newaxis], axis=0)[0]
     return xr.DataArray(
         composite,
-        coords=[narrays.latitude, narrays.longitude],
+        coords=[arrays.latitude, arrays.longitude],
         dims=['latitude', 'longitude'],
-        name="{band}{suffix}".format(band=narrays.name, suffix=name_suffix))
+        name="{band}{suffix}".format(band=arrays.name, suffix=name_suffix))
 
 
 def _mosaic(dataset, most_recent_first=False, custom_label="_composite"):
@@ -43,17 +29,60 @@ def _composite_by_average(dataset, custom_label="_composite"):
     return composite
 
 
+def _rolling_average_baseline(data_array, composite_size):
+    """
+    Mean of the `composite_size` previous time slices of every time slice from `composite_size` on,
+    NaN values being skipped. Running sums and counts are computed once with a cumulative sum along time
+    and every window is the difference of two of them, so the cost does not depend on `composite_size`.
+    Works on numpy and dask backed arrays.
+    """
+    n_times = data_array.sizes['time']
+    valid = data_array.notnull()
+    sums = data_array.where(valid, 0).astype(np.float64).cumsum('time')
+    counts = valid.astype(np.int64).cumsum('time')
+
+    def window_totals(running):
+        # Prepend a 0 so that running[i] is the total of the first i time slices.
+        running = xr.concat([xr.zeros_like(running.isel(time=[0])), running], dim='time')
+        return running.isel(time=slice(composite_size, n_times)).data - \
+            running.isel(time=slice(0, n_times - composite_size)).data
+
+    window_sums, window_counts = window_totals(sums), window_totals(counts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        baseline = window_sums / np.where(window_counts > 0, window_counts, np.nan)
+    if np.issubdtype(data_array.dtype, np.floating):
+        baseline = baseline.astype(data_array.dtype)
+    template = data_array.isel(time=slice(composite_size, None))
+    return xr.DataArray(baseline, dims=template.dims, coords=template.coords,
+                        name=data_array.name, attrs=data_array.attrs)
+
+
+def _rolling_composite_baseline(data_array, composite_size, custom_label=""):
+    """
+    Most recent non-NaN value among the `composite_size` previous time slices of every time slice
+    from `composite_size` on. The last valid value is carried forward along time at most
+    `composite_size - 1` slices, so a single pass gives every window. Works on numpy and dask backed arrays.
+    """
+    n_times = data_array.sizes['time']
+    filled = data_array if composite_size == 1 else data_array.ffill('time', limit=composite_size - 1)
+    baseline = filled.isel(time=slice(composite_size - 1, n_times - 1))
+    baseline = baseline.assign_coords(time=data_array.time.values[composite_size:])
+    return baseline.rename("{band}{suffix}".format(band=data_array.name, suffix=custom_label))
+
+
 ## This should be the the only method called from dc baseline
 def generate_baseline(dataset, composite_size=5, mode="average", custom_label=""):
-    ranges = _window(range(len(dataset.time)), n=composite_size + 1)
-    reffs = (dataset.isel(time=list(frame)[:-1]) for frame in ranges)
-
-    baselines = None
+    """
+    Computes, for every time slice after the first `composite_size` ones, a baseline of the
+    `composite_size` previous time slices: their mean ("average" mode) or their most recent
+    non-NaN value ("composite" mode). Both modes take a single pass along time and support dask.
+    """
     if mode == "average":
-        baselines = (_composite_by_average(ref, custom_label=custom_label) for ref in reffs)
+        baselines = [_rolling_average_baseline(dataset[variable], composite_size)
+                     for variable in dataset.data_vars]
     elif mode == "composite":
-        baselines = (_mosaic(ref, most_recent_first=True, custom_label=custom_label) for ref in reffs)
-
-    baseline = xr.concat(baselines, dim='time')
-    baseline['time'] = dataset.time[composite_size:]
-    return baseline
+        baselines = [_rolling_composite_baseline(dataset[variable], composite_size, custom_label=custom_label)
+                     for variable in dataset.data_vars]
+    else:
+        raise ValueError("mode must be 'average' or 'composite'")
+    return xr.merge(baselines)
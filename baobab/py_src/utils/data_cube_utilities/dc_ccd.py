@@ -1,11 +1,12 @@
 import ccd
 from datetime import datetime, timedelta
-from functools import reduce, partial
-import itertools as it
+from functools import partial
+import hashlib
 import logging
 import multiprocessing
 import numpy as np
-from operator import is_not
+import os
+import pandas as pd
 
 import warnings
 import xarray
@@ -29,34 +30,6 @@ def _scalar_to_n64_datetime(scalar):
 
 
 
-###### POST PROCESSING FUNCTIONS ######################
-
-def _identity_transform(x):
-    return x
-
-def _extract_time_coordinate_and_treat_as_value(da, f = _identity_transform):    
-    value = [[f(da.time.values)]] #dummy value for time scalar 
-    coords = [[da.latitude.values],[da.longitude.values]]
-    dims=['latitude', 'longitude']
-    
-    return xarray.DataArray(value, coords, dims)
-
-
-def _nth_occurence_in_ccd_matrix(ds, n, f = _identity_transform):
-    xr_pixel_drop_nan         = lambda da: da.where(~np.isnan(da), drop = True)
-    xr_pixel_has_n_values     = lambda da: len(da.values) >= n + 1
-    xr_get_nth_time           = lambda da: da.isel(time = n)  
-    
-    time_per_coord_stream = map(
-        partial(_extract_time_coordinate_and_treat_as_value, f = f), map(
-            xr_get_nth_time, filter(
-                xr_pixel_has_n_values, map(
-                    xr_pixel_drop_nan ,_pixel_iterator_from_xarray(ds)))))
-    
-    return reduce(lambda x, y: x.combine_first(y), time_per_coord_stream)
-
-
-
 ###### Per Pixel FUNCTIONS ############################
 
 
@@ -95,33 +68,6 @@ def _run_ccd_on_pixel(ds):
     return ccd.detect(*params)
 
 
-def _convert_ccd_results_into_dataset(results=None, model_dataset=None):
-    """Converts the result returned by ccd into a usable xArray dataset
-
-    Creates and returns an intermediate product that stores a 1 in lat,lon,time index if change has occured there. Lat Lon values indices are extracted from a 1x1xt model_dataset.
-
-    Args:
-        results: The results of the CCD operation
-        model_dataset: A dataset with the dimensions that were used to create the ccd result
-
-    Returns:
-        An xarray dataset with a 1 in all indices where change was detected by ccd.
-    """
-    start_times = [datetime.fromordinal(model.start_day) for model in results['change_models']]
-
-    intermediate_product = model_dataset.sel(time=start_times, method='nearest')
-
-    new_dataset = xarray.DataArray(
-        np.ones((intermediate_product.dims['time'], 1, 1)).astype(np.int16),
-        coords=[
-            intermediate_product.time.values, [intermediate_product.latitude.values],
-            [intermediate_product.longitude.values]
-        ],
-        dims=['time', 'latitude', 'longitude'])
-
-    return new_dataset.rename("continuous_change")
-
-
 def _is_pixel(ds):
     """checks if dataset has the size of a pixel
 
@@ -293,11 +239,15 @@ def enable_logger(function):
 ##### THREAD OPS #################################################
 
 
-def generate_thread_pool():
+def generate_thread_pool(initializer=None, initargs=()):
     """Returns a thread pool utilizing all possible cores
 
     Creates a thread pool using cpu_count to count possible cores
 
+    Args:
+        initializer: optional callable run once by every worker process on startup
+        initargs: arguments passed to initializer
+
     Returns:
         A multiprocessing Pool with n processes
 
@@ -307,7 +257,7 @@ def generate_thread_pool():
         cpus = multiprocessing.cpu_count()
     except NotImplementedError:
         cpus = 2
-    return multiprocessing.Pool(processes=(cpus))
+    return multiprocessing.Pool(processes=(cpus), initializer=initializer, initargs=initargs)
 
 
 def destroy_thread_pool(pool):
@@ -324,90 +274,297 @@ def destroy_thread_pool(pool):
     pool.join()
 
 
-###### ITERATOR FUNCTIONS ##########################################
+###### ARRAY FUNCTIONS #############################################
 
+_ccd_bands = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2', 'thermal']
+_ordinal_epoch = datetime(1970, 1, 1).toordinal()
 
-def _pixel_iterator_from_xarray(ds):
-    """Accepts an xarray. Creates an iterator of 1x1xt xarray dataset `pixels`
+# Numpy views of the shared pixel arrays, attached once per process by _init_ccd_worker.
+_ccd_shared = {}
 
-    Creates an iterable from dataset pixels usable with multiprocessing pool distribution
 
-    Args:
-        ds: An xArray with the dimensions of latitude, longitude, and time
+def _silence_ccd_logging():
+    """Turn off lcmap-pyccd's verbose logging in the current process"""
+    logging.getLogger("ccd").setLevel(logging.WARNING)
+    logging.getLogger("lcmap-pyccd").setLevel(logging.WARNING)
+
+
+def _change_model_day(model, day):
+    """Reads `day` (e.g. 'start_day') from a ccd change model. lcmap-pyccd returns namedtuples in older releases and dicts in newer ones."""
+    return model[day] if isinstance(model, dict) else getattr(model, day)
 
-    Returns:
-        An iterable consisting of xArray datasets with a single latitude/longitude dim with n time dimensions
 
+def _ordinal_dates_from_xarray(ds):
+    """Converts the time coordinate of ds to the proleptic Gregorian ordinals expected by ccd.detect"""
+    return ds.time.values.astype('datetime64[D]').astype(np.int64) + _ordinal_epoch
+
+
+def _shared_array(shape, dtype):
+    """Allocates a numpy array backed by shared memory.
+
+    Returns:
+        A (buffer, dtype, shape) description that can be handed to worker processes and the numpy view of the buffer.
     """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = multiprocessing.RawArray('b', max(size * dtype.itemsize, 1))
+    return (buffer, dtype, shape), np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
 
-    lat_size = len(ds.latitude)
-    lon_size = len(ds.longitude)
-    cartesian = it.product(range(lat_size), range(lon_size))
-    return map(lambda x: ds.isel(latitude=x[0], longitude=x[1]), cartesian)
+def _attach_shared_array(description):
+    """Returns the numpy view of a shared array described by _shared_array"""
+    buffer, dtype, shape = description
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
 
 
-def _ccd_product_from_pixel(pixel):
-    """Creates a ccd-product for a given pixel
+def _pixel_arrays_from_xarray(ds):
+    """Extracts the CCD inputs of every pixel of an xarray once, as contiguous arrays in shared memory.
 
-    Runs the ccd operation on a pixel and converts the results into a dataset
+    The bands are copied one at a time into a single (band, pixel, time) block so that the time series of a pixel
+    is contiguous and workers can read it without any xarray indexing.
 
     Args:
-        pixel: An xArray dataset with dimensions latitude, longitude, and time with dims of 1x1xt
+        ds: An xArray with the dimensions of latitude, longitude, and time. pixel_qa is required.
 
     Returns:
-        An xArray dataset with the same dimensions as pixel - the output of the _convert_ccd_results_into_dataset func
+        A dict usable with _attached_pixel_arrays holding the shared spectra and qa arrays, the names of the available
+        bands, the ordinal acquisition dates, the acquisition times in seconds since epoch and the time index used
+        to map CCD model dates back to acquisitions.
     """
+    bands = [band for band in _ccd_bands if band in ds.data_vars]
+    pixel_shape = (len(ds.latitude), len(ds.longitude), len(ds.time))
+    n_pixels = pixel_shape[0] * pixel_shape[1]
+
+    spectra_dtype = np.result_type(*[ds[band].dtype for band in bands]) if bands else np.float64
+    spectra, spectra_view = _shared_array((len(bands), n_pixels, len(ds.time)), spectra_dtype)
+    for index, band in enumerate(bands):
+        spectra_view[index].reshape(pixel_shape)[:] = ds[band].transpose('latitude', 'longitude', 'time').values
+
+    qa, qa_view = _shared_array((n_pixels, len(ds.time)), ds.pixel_qa.dtype)
+    qa_view.reshape(pixel_shape)[:] = ds.pixel_qa.transpose('latitude', 'longitude', 'time').values
+
+    return dict(spectra=spectra, qa=qa, bands=bands,
+                n_longitude=len(ds.longitude),
+                latitude=ds.latitude.values, longitude=ds.longitude.values,
+                dates=_ordinal_dates_from_xarray(ds),
+                time_scalars=_n64_datetime_to_scalar(ds.time.values),
+                time_index=pd.DatetimeIndex(ds.time.values))
+
+
+def _attached_pixel_arrays(shared):
+    """Returns a copy of a dict built by _pixel_arrays_from_xarray with numpy views in place of the shared buffers"""
+    return dict(shared, spectra=_attach_shared_array(shared['spectra']), qa=_attach_shared_array(shared['qa']))
+
+
+def _init_ccd_worker(shared):
+    """Attaches the shared pixel arrays built by _pixel_arrays_from_xarray to the current process"""
+    global _ccd_shared
+    _silence_ccd_logging()
+    _ccd_shared = _attached_pixel_arrays(shared)
 
-    try:
-        ccd_results = _run_ccd_on_pixel(pixel)
-        ccd_product = _convert_ccd_results_into_dataset(results=ccd_results, model_dataset=pixel)
-        return ccd_product
-    except np.linalg.LinAlgError:
-        # This is used to combat matrix inversion issues for Singular matrices.
-        return None
 
+def _run_ccd_on_pixel_arrays(pixel, arrays):
+    """Performs CCD on one pixel of the pixel arrays. Mirrors _run_ccd_on_pixel, missing bands are replaced by ones."""
+    scene_count = len(arrays['dates'])
+    spectra = []
+    for band in _ccd_bands:
+        if band in arrays['bands']:
+            spectra.append(arrays['spectra'][arrays['bands'].index(band), pixel])
+        elif band == 'thermal':
+            spectra.append(np.ones(scene_count) * (273.15) * 10)
+        else:
+            spectra.append(np.ones(scene_count))
+    return ccd.detect(arrays['dates'], *spectra, arrays['qa'][pixel])
 
-def _ccd_product_iterator_from_pixels(pixels, distributed=False):
-    """Creates an iterator of ccd-products from a iterator of pixels. This function handles the distributed processing of CCD.
 
-    Creates an iterator of ccd products from a pixel iterator generated with _pixel_iterator_from_xarray. Distributes with multiprocessing if distributed.
+def _change_indices_from_ccd_results(results, time_index):
+    """Returns the sorted indices of the acquisitions nearest to the start of every CCD change model"""
+    start_times = pd.DatetimeIndex([datetime.fromordinal(_change_model_day(model, 'start_day'))
+                                    for model in results['change_models']])
+    return np.unique(time_index.get_indexer(start_times, method='nearest'))
+
+
+def _ccd_on_pixel_range(pixels, arrays):
+    """Runs CCD on a range of pixels of the pixel arrays
 
     Args:
-        pixels: iterator of pixel datasets each with dimensions latitude, longitude, and time with dims of 1x1xt
-        distributed: Boolean value signifying whether or not the multiprocessing module should be used to distribute accross all cores
+        pixels: (start, stop) range of flattened pixel indices
+        arrays: pixel arrays, as returned by _attached_pixel_arrays
 
     Returns:
-        An iterator of xArray dataset ccd product pixels with the same dimensions as pixels
+        The changes, change_count and first_change arrays (see _generate_change_arrays) of the pixels in the range.
     """
-
-    if distributed == True:
-        pool = generate_thread_pool()
-        ccd_product_pixels = None
+    start, stop = pixels
+    changes = np.zeros((len(arrays['dates']), stop - start), dtype=bool)
+    change_count = np.full(stop - start, np.nan, dtype=np.float32)
+    first_change = np.full(stop - start, np.nan)
+    for offset, pixel in enumerate(range(start, stop)):
         try:
-            ccd_product_pixels = pool.imap_unordered(_ccd_product_from_pixel, pixels)
-            destroy_thread_pool(pool)
-            return ccd_product_pixels
-        except:
-            destroy_thread_pool(pool)
-            raise
-    else:
-        ccd_product_pixels = map(_ccd_product_from_pixel, pixels)
-        return ccd_product_pixels
+            ccd_results = _run_ccd_on_pixel_arrays(pixel, arrays)
+        except np.linalg.LinAlgError:
+            # This is used to combat matrix inversion issues for Singular matrices.
+            continue
+        indices = _change_indices_from_ccd_results(ccd_results, arrays['time_index'])
+        changes[indices, offset] = True
+        change_count[offset] = len(indices) - 1
+        if len(indices) > 1:
+            first_change[offset] = arrays['time_scalars'][indices[1]]
+    return changes, change_count, first_change
 
 
-def _rebuild_xarray_from_pixels(pixels):
-    """Combines pixel sized ccd-products into a larger xarray object.
+###### ROW BLOCK FUNCTIONS #########################################
 
-    Used to combine single pixels with latitude, longitude, time back into a single xArray dataset instance
 
-    Args:
-        pixels: iterable of xArray datasets that can be combined using combine_first
+def _row_blocks(n_rows, rows_per_block):
+    """Splits n_rows latitude rows into consecutive (start, stop) blocks of at most rows_per_block rows"""
+    return [(start, min(start + rows_per_block, n_rows)) for start in range(0, n_rows, rows_per_block)]
+
+
+def _ccd_checkpoint_path(checkpoint_dir, rows):
+    """Returns the path of the checkpoint file of a row block"""
+    return os.path.join(checkpoint_dir, 'ccd_rows_{:06d}_{:06d}.npz'.format(*rows))
+
+
+def _ccd_checkpoint_signature(latitude, longitude, bands, time_scalars):
+    """Returns a hash of the coordinates and bands of a row block, which identifies the data its checkpoint holds"""
+    signature = hashlib.sha1()
+    for values in (latitude, longitude, time_scalars):
+        signature.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    signature.update(','.join(bands).encode())
+    return signature.hexdigest()
+
+
+def _save_ccd_checkpoint(checkpoint_dir, rows, block, signature):
+    """Writes the results of a row block to its checkpoint file. The file is renamed into place once complete."""
+    path = _ccd_checkpoint_path(checkpoint_dir, rows)
+    with open(path + '.part', 'wb') as checkpoint:
+        np.savez(checkpoint, changes=block[0], change_count=block[1], first_change=block[2],
+                 signature=np.array(signature))
+    os.replace(path + '.part', path)
+
+
+def _load_ccd_checkpoint(checkpoint_dir, rows, signature):
+    """Reads the results of a row block from its checkpoint file
 
     Returns:
-        An xArray dataset with the dimensions of pixels
+        The changes, change_count and first_change arrays of the block, or None if the block has no checkpoint.
+
+    Raises:
+        ValueError if the checkpoint was computed on other coordinates, dates or bands.
+    """
+    path = _ccd_checkpoint_path(checkpoint_dir, rows)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as checkpoint:
+        if 'signature' not in checkpoint.files or str(checkpoint['signature']) != signature:
+            raise ValueError("The checkpoint {} was computed on a different dataset.".format(path))
+        block = checkpoint['changes'], checkpoint['change_count'], checkpoint['first_change']
+    return block
+
+
+def _ccd_on_row_block(rows, pixels, arrays, checkpoint_dir=None):
+    """Runs CCD on the pixels of a row block and checkpoints the results if checkpoint_dir is set"""
+    block = _ccd_on_pixel_range(pixels, arrays)
+    if checkpoint_dir is not None:
+        n_longitude = arrays['n_longitude']
+        latitude = arrays['latitude'][pixels[0] // n_longitude:pixels[1] // n_longitude]
+        signature = _ccd_checkpoint_signature(latitude, arrays['longitude'], arrays['bands'],
+                                              arrays['time_scalars'])
+        _save_ccd_checkpoint(checkpoint_dir, rows, block, signature)
+    return rows, block
+
+
+def _ccd_on_shared_row_block(rows, checkpoint_dir=None):
+    """Runs CCD on a row block of the shared arrays attached with _init_ccd_worker"""
+    n_longitude = _ccd_shared['n_longitude']
+    pixels = (rows[0] * n_longitude, rows[1] * n_longitude)
+    return _ccd_on_row_block(rows, pixels, _ccd_shared, checkpoint_dir)
+
+
+def _ccd_on_dataset_row_block(block_ds, rows, checkpoint_dir=None):
+    """Runs CCD on a dataset holding only the rows of one row block (loaded by the worker if dask-backed)"""
+    _silence_ccd_logging()
+    arrays = _attached_pixel_arrays(_pixel_arrays_from_xarray(block_ds))
+    pixels = (0, len(block_ds.latitude) * len(block_ds.longitude))
+    return _ccd_on_row_block(rows, pixels, arrays, checkpoint_dir)
+
+
+def _ccd_row_block_iterator_serial(ds, blocks, checkpoint_dir=None):
+    """Yields the (rows, results) of every row block, computed in the current process"""
+    global _ccd_shared
+    _init_ccd_worker(_pixel_arrays_from_xarray(ds))
+    try:
+        for rows in blocks:
+            yield _ccd_on_shared_row_block(rows, checkpoint_dir)
+    finally:
+        _ccd_shared = {}
+
 
+def _ccd_row_block_iterator_multiprocessing(ds, blocks, checkpoint_dir=None):
+    """Yields the (rows, results) of every row block as they complete on a multiprocessing pool
+
+    The bands are extracted once into shared memory that every worker maps, only row ranges and results are pickled.
+    The pool is kept alive until every result has been consumed.
+    """
+    pool = generate_thread_pool(initializer=_init_ccd_worker, initargs=(_pixel_arrays_from_xarray(ds),))
+    try:
+        for result in pool.imap_unordered(partial(_ccd_on_shared_row_block, checkpoint_dir=checkpoint_dir), blocks):
+            yield result
+    except:
+        pool.terminate()
+        raise
+    finally:
+        destroy_thread_pool(pool)
+
+
+def _ccd_row_block_iterator_dask(ds, blocks, checkpoint_dir=None):
+    """Yields the (rows, results) of every row block computed with dask, as they complete
+
+    Every row block is a task that loads only its own rows, so dask-backed datasets are never fully loaded.
+    The tasks run on the dask.distributed client when one is active (e.g. from create_local_dask_cluster),
+    otherwise on a local process pool with at most two pending blocks per process.
     """
-    return reduce(lambda x, y: x.combine_first(y), pixels)
+    try:
+        from distributed import get_client, as_completed
+        client = get_client()
+    except (ImportError, ValueError):
+        client = None
+
+    if client is not None:
+        import dask
+        tasks = [dask.delayed(_ccd_on_dataset_row_block)(ds.isel(latitude=slice(*rows)), rows, checkpoint_dir)
+                 for rows in blocks]
+        for future in as_completed(client.compute(tasks)):
+            yield future.result()
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    workers = os.cpu_count() or 2
+    pending_blocks = iter(blocks)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        try:
+            while True:
+                for rows in pending_blocks:
+                    pending.add(executor.submit(_ccd_on_dataset_row_block, ds.isel(latitude=slice(*rows)), rows,
+                                                checkpoint_dir))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        except:
+            for future in pending:
+                future.cancel()
+            raise
+
+
+_ccd_backends = {
+    'multiprocessing': _ccd_row_block_iterator_multiprocessing,
+    'dask': _ccd_row_block_iterator_dask
+}
 
 
 ###################################################################
@@ -416,48 +573,127 @@ def _rebuild_xarray_from_pixels(pixels):
 
 
 @disable_logger
-def _generate_change_matrix(ds, distributed= False):
+def _generate_change_arrays(ds, distributed=False, backend='multiprocessing', rows_per_block=1,
+                            checkpoint_dir=None, progress=None):
     """Runs CCD on an xarray datastructure
 
-    Computes CCD calculations on every pixel within an xarray dataset.
+    Computes CCD calculations on every pixel within an xarray dataset. Work is split in blocks of latitude rows.
+    No per-pixel xarray object is ever built: each block reads its pixels from contiguous numpy arrays and its
+    results are copied into preallocated output arrays.
 
     Args:
         ds: (xarray) An xarray dataset containing landsat bands.
             The following bands are used in computing CCD [red, green, blue, nir,swir1,swir2,thermal, qa]
             Missing bands are masked with an array of ones.
         distributed: (Boolean) toggles full utilization of all processing cores for distributed computation of CCD
+        backend: (string) parallel backend used when distributed, 'multiprocessing' or 'dask'
+        rows_per_block: (int) number of latitude rows handed to a worker at once
+        checkpoint_dir: (string) directory where the results of every row block are saved as it completes.
+            Blocks already saved there by an interrupted run on the same dataset are loaded instead of recomputed.
+            A checkpoint of other coordinates, dates or bands raises a ValueError.
+        progress: (callable) called with the number of completed and total row blocks as every block completes
 
     Returns:
-        An Xarray detailing per-pixel 'change_volume'. Change volume is the number changes detected given the extents provided.
+        changes: (time, pixel) boolean array, True at the acquisition nearest to the start of every CCD model
+        change_count: (pixel) array with the number of changes detected, NaN where CCD failed
+        first_change: (pixel) array with the date of the first change in seconds since epoch, NaN if there is none
     """
+    if distributed == True and backend not in _ccd_backends:
+        raise ValueError("Unknown backend '{}'. Available backends are {}.".format(backend, list(_ccd_backends)))
+
+    n_longitude = len(ds.longitude)
+    n_pixels = len(ds.latitude) * n_longitude
+    time_scalars = _n64_datetime_to_scalar(ds.time.values)
+
+    changes = np.zeros((len(ds.time), n_pixels), dtype=bool)
+    change_count = np.full(n_pixels, np.nan, dtype=np.float32)
+    first_change = np.full(n_pixels, np.nan)
+
+    blocks = _row_blocks(len(ds.latitude), rows_per_block)
+    completed = 0
+
+    def store(rows, block):
+        nonlocal completed
+        pixels = slice(rows[0] * n_longitude, rows[1] * n_longitude)
+        changes[:, pixels], change_count[pixels], first_change[pixels] = block
+        completed += 1
+        if progress is not None:
+            progress(completed, len(blocks))
+
+    remaining = blocks
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        bands = [band for band in _ccd_bands if band in ds.data_vars]
+        remaining = []
+        for rows in blocks:
+            signature = _ccd_checkpoint_signature(ds.latitude.values[rows[0]:rows[1]], ds.longitude.values, bands,
+                                                  time_scalars)
+            block = _load_ccd_checkpoint(checkpoint_dir, rows, signature)
+            if block is None:
+                remaining.append(rows)
+            else:
+                store(rows, block)
+
+    if remaining:
+        iterate_row_blocks = _ccd_backends[backend] if distributed == True else _ccd_row_block_iterator_serial
+        for rows, block in iterate_row_blocks(ds, remaining, checkpoint_dir):
+            store(rows, block)
+
+    return changes, change_count, first_change
+
+
+def process_xarray(ds, distributed=False, process = "change_count", backend='multiprocessing', rows_per_block=1,
+                   checkpoint_dir=None, progress=None):
+    """Runs CCD on an xarray and returns one of its products
 
-    pixels = _pixel_iterator_from_xarray(ds)
-    ccd_products = _ccd_product_iterator_from_pixels(pixels, distributed=distributed)
-    ccd_products = filter(partial(is_not, None), ccd_products)
-    ccd_change_count_xarray = _rebuild_xarray_from_pixels(ccd_products) # Change matrix
-    return ccd_change_count_xarray
+    Args:
+        ds: (xarray) An xarray dataset containing landsat bands, see _generate_change_arrays.
+        distributed: (Boolean) toggles full utilization of all processing cores for distributed computation of CCD
+        process: (string) the product to return:
+            'change_count': number of changes detected per pixel ('change_volume')
+            'first': date of the first change per pixel, in seconds since epoch
+            'matrix': (time, latitude, longitude) array with a 1 where a CCD model starts ('continuous_change')
+        backend: (string) parallel backend used when distributed, 'multiprocessing' or 'dask'
+        rows_per_block: (int) number of latitude rows handed to a worker at once
+        checkpoint_dir: (string) directory used to save per row block results and resume interrupted runs
+        progress: (callable) called with the number of completed and total row blocks,
+            e.g. lambda completed, total: print(completed, '/', total)
+    """
 
-def process_xarray(ds, distributed=False, process = "change_count"):
-    
     ### Instead of using an `if process = "moving_avg"` if ladder to add and remove
-    ### processing options, we use a dictionary to look up our processing options. 
-    
-    ### Declare several processing outputs. 
+    ### processing options, we use a dictionary to look up our processing options.
+
+    spatial_shape = (len(ds.latitude), len(ds.longitude))
+    spatial_coords = [ds.latitude.values, ds.longitude.values]
+
+    ### Declare several processing outputs.
+    def generate_arrays():
+        return _generate_change_arrays(ds, distributed = distributed, backend = backend,
+                                       rows_per_block = rows_per_block, checkpoint_dir = checkpoint_dir,
+                                       progress = progress)
     def generate_matrix():
-        return _generate_change_matrix(ds, distributed = distributed)
+        changes, _, _ = generate_arrays()
+        changed_times = changes.any(axis=1)
+        matrix = np.where(changes[changed_times], 1, np.nan).astype(np.float32)
+        return xarray.DataArray(matrix.reshape((-1,) + spatial_shape),
+                                coords=[ds.time.values[changed_times]] + spatial_coords,
+                                dims=['time', 'latitude', 'longitude'],
+                                name='continuous_change')
     def change_count():
-        return (generate_matrix().sum(dim='time') - 1).rename('change_volume')
+        _, count, _ = generate_arrays()
+        return xarray.DataArray(count.reshape(spatial_shape), coords=spatial_coords,
+                                dims=['latitude', 'longitude'], name='change_volume')
     def first_change():
-        return _nth_occurence_in_ccd_matrix(generate_matrix(),
-                                            1,
-                                            f = _n64_datetime_to_scalar)
-    
+        _, _, first = generate_arrays()
+        return xarray.DataArray(first.reshape(spatial_shape), coords=spatial_coords,
+                                dims=['latitude', 'longitude'])
+
     processing_options = {
         "change_count": change_count,
         "first":  first_change,
         "matrix": generate_matrix
     }
-    
+
     return processing_options[process]()
 
 
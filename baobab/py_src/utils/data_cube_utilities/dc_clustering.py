@@ -58,9 +58,85 @@ def clustering_post_processing(classified, dataset_in, bands, no_nan_mask):
     return dataset_out
 
 
-def kmeans_cluster_dataset(dataset_in, bands, n_clusters=4):
+# Number of pixels read, fitted with `partial_fit` or predicted at once by `cluster_dataset`.
+cluster_block_size = 2 ** 18
+
+
+def _cluster_feature_blocks(dataset_in, bands, block_size):
     """
-    Clusters a dataset with Kmeans clustering.
+    Yields the features of `dataset_in` one block of rows (along its first dimension) at a time.
+    Only the rows of a block are loaded, so dask backed datasets are never computed as a whole.
+
+    Yields
+    ------
+    start: int
+        The index of the first pixel of the block in the flattened output.
+    valid: np.ndarray of bool
+        The pixels of the block which have no NaN value in `bands`.
+    features: np.ndarray of np.float64
+        A (number of valid pixels, number of bands) array.
+    """
+    dims = dataset_in[bands[0]].dims
+    shape = dataset_in[bands[0]].shape
+    row_size = int(np.prod(shape[1:]))
+    rows_per_block = max(1, block_size // max(row_size, 1))
+    for row in range(0, shape[0], rows_per_block):
+        block = dataset_in[bands].isel({dims[0]: slice(row, row + rows_per_block)})
+        values = np.stack([np.asarray(block[band].transpose(*dims).values, dtype=np.float64).ravel()
+                           for band in bands], axis=1)
+        valid = ~np.isnan(values).any(axis=1)
+        yield row * row_size, valid, values[valid]
+
+
+def _fit_on_sample(estimator, dataset_in, bands, n_samples, block_size, random_state):
+    """
+    Fits `estimator` on a sample of at most `n_samples` valid pixels,
+    stratified over the blocks of `_cluster_feature_blocks`.
+    """
+    rng = np.random.RandomState(random_state)
+    n_pixels = dataset_in[bands[0]].size
+    rate = min(1., n_samples / max(n_pixels, 1))
+    sample = []
+    for start, valid, features in _cluster_feature_blocks(dataset_in, bands, block_size):
+        n_block_samples = min(len(features), int(round(rate * len(valid))))
+        sample.append(features[rng.choice(len(features), n_block_samples, replace=False)])
+    return estimator.fit(np.concatenate(sample))
+
+
+def _fit_incrementally(estimator, dataset_in, bands, block_size):
+    """
+    Fits `estimator` with `partial_fit` over the blocks of `_cluster_feature_blocks`.
+    Blocks with fewer valid pixels than clusters are merged with the next ones.
+    For Birch, the global clustering is done once, after the last block.
+    """
+    from sklearn.cluster import Birch
+
+    n_clusters = getattr(estimator, 'n_clusters', None)
+    birch = isinstance(estimator, Birch)
+    if birch:
+        estimator.set_params(n_clusters=None)
+    min_batch = n_clusters if isinstance(n_clusters, int) else 1
+    pending = []
+    for start, valid, features in _cluster_feature_blocks(dataset_in, bands, block_size):
+        pending.append(features)
+        if sum(len(features) for features in pending) >= min_batch:
+            estimator.partial_fit(np.concatenate(pending))
+            pending = []
+    if sum(len(features) for features in pending) > 0:
+        estimator.partial_fit(np.concatenate(pending))
+    if birch:
+        estimator.set_params(n_clusters=n_clusters)
+        estimator.partial_fit()
+    return estimator
+
+
+def cluster_dataset(dataset_in, bands, estimator, fit='sample', n_samples=100000,
+                    block_size=None, random_state=None):
+    """
+    Clusters a dataset out of core: `estimator` is fitted on a stratified sample of the pixels
+    or incrementally with `partial_fit`, then labels are predicted block by block straight into
+    a preallocated output. Only one block of pixels is loaded at a time, so this also works on
+    dask backed datasets larger than memory.
 
     Parameters
     ----------
@@ -68,35 +144,105 @@ def kmeans_cluster_dataset(dataset_in, bands, n_clusters=4):
         A Dataset containing the bands listed in `bands`.
     bands: list of str
         A list of names of the bands in `dataset_in` to cluster with.
+    estimator: sklearn.base.ClusterMixin
+        An unfitted clustering estimator with a `predict` method (e.g. KMeans, MiniBatchKMeans, Birch).
+    fit: str
+        'sample' fits on a sample of `n_samples` pixels stratified over blocks.
+        'partial_fit' fits with `estimator.partial_fit` block by block (e.g. MiniBatchKMeans, Birch).
+    n_samples: int
+        The number of pixels sampled when `fit == 'sample'`.
+    block_size: int
+        The number of pixels processed at once. Defaults to `cluster_block_size`.
+    random_state: int
+        Seed of the sample.
 
     Returns
     -------
-    clustered: xarray.Dataset
-        A Dataset of the same shape as `dataset_in`, containing a single data variable
-        called "classification", which are the numeric class labels in range [0, n_clusters-1].
+    clustered: xarray.DataArray
+        A DataArray of the shape of the bands, containing the numeric class labels.
+        Pixels with a NaN value in any of `bands` are labelled -1.
+    """
+    block_size = cluster_block_size if block_size is None else block_size
+    if fit == 'sample':
+        _fit_on_sample(estimator, dataset_in, bands, n_samples, block_size, random_state)
+    elif fit == 'partial_fit':
+        _fit_incrementally(estimator, dataset_in, bands, block_size)
+    else:
+        raise ValueError("fit must be 'sample' or 'partial_fit'")
+
+    template = dataset_in[bands[0]]
+    classification = np.full(template.shape, -1, dtype=np.int64)
+    flat_classification = classification.reshape(-1)
+    for start, valid, features in _cluster_feature_blocks(dataset_in, bands, block_size):
+        if len(features) > 0:
+            flat_classification[start:start + len(valid)][valid] = estimator.predict(features)
 
+    coords = {dim: template[dim] for dim in template.dims if dim in template.coords}
+    return xr.DataArray(classification, coords=coords, dims=template.dims)
+
+
+def kmeans_cluster_dataset(dataset_in, bands, n_clusters=4, fit='all', n_samples=100000,
+                           block_size=None, random_state=None):
+    """
+    Clusters a dataset with Kmeans clustering.
+
+    Parameters
+    ----------
+    dataset_in: xarray.Dataset
+        A Dataset containing the bands listed in `bands`.
+    bands: list of str
+        A list of names of the bands in `dataset_in` to cluster with.
+    n_clusters: int
+        The number of clusters.
+    fit: str
+        'all' fits KMeans on every pixel at once.
+        'sample' fits KMeans on a stratified sample of `n_samples` pixels and
+        'partial_fit' fits MiniBatchKMeans block by block, both with blocked prediction.
+        See `cluster_dataset`.
+    n_samples, block_size, random_state:
+        See `cluster_dataset`.
+
+    Returns
+    -------
     clustered: xarray.DataArray
         A DataArrau of the same shape as `dataset_in`, containing the numberic class labels in range [0, n_clusters-1].
     """
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    if fit != 'all':
+        estimator = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state) \
+            if fit == 'partial_fit' else KMeans(n_clusters=n_clusters, random_state=random_state)
+        return cluster_dataset(dataset_in, bands, estimator, fit=fit, n_samples=n_samples,
+                               block_size=block_size, random_state=random_state)
+
     features, no_nan_mask = clustering_pre_processing(dataset_in, bands)
     """
     classified = AgglomerativeClustering(n_clusters=n_clusters).fit(np_array)
     classified = Birch(n_clusters=n_clusters).fit(np_array)
     classified = DBSCAN(eps=0.005, min_samples=5).fit(np_array)
     """
-    from sklearn.cluster import KMeans
     classified = KMeans(n_clusters=n_clusters).fit(features)
     return clustering_post_processing(classified, dataset_in, bands, no_nan_mask)
 
-def birch_cluster_dataset(dataset_in, bands, n_clusters=4):
+def birch_cluster_dataset(dataset_in, bands, n_clusters=4, fit='all', n_samples=100000,
+                          block_size=None, random_state=None, threshold=0.00001):
+    """
+    Clusters a dataset with Birch clustering. The parameters are the same as for
+    `kmeans_cluster_dataset`; with 'partial_fit', the Birch tree is built block by block.
+    `threshold` is the Birch subcluster radius; raise it to bound the size of the tree on large scenes.
+    """
+    from sklearn.cluster import Birch
+    if fit != 'all':
+        return cluster_dataset(dataset_in, bands, Birch(n_clusters=n_clusters, threshold=threshold),
+                               fit=fit, n_samples=n_samples, block_size=block_size,
+                               random_state=random_state)
+
     features, no_nan_mask = clustering_pre_processing(dataset_in, bands)
     """
     classified = AgglomerativeClustering(n_clusters=n_clusters).fit(np_array)
     classified = DBSCAN(eps=0.005, min_samples=5).fit(np_array)
     classified = KMeans(n_clusters=n_clusters).fit(np_array)
     """
-    from sklearn.cluster import Birch
-    classified = Birch(n_clusters=n_clusters, threshold=0.00001).fit(features)
+    classified = Birch(n_clusters=n_clusters, threshold=threshold).fit(features)
     return clustering_post_processing(classified, dataset_in, bands, no_nan_mask)
 
 def plot_kmeans_next_to_mosaic(da_a, da_b):  
@@ -1,17 +1,20 @@
 import numpy as np
 import xarray as xr
-import scipy.optimize as opt
 
 import datacube
 
 from .dc_utilities import create_default_clean_mask, convert_range
 from . import dc_utilities as utilities
+from .dc_timing import timed_stage
 
 # Command line tool imports
 import argparse
 import os
 import collections
+import functools
+import itertools
 import gdal
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Author: KMF
@@ -19,9 +22,141 @@ from datetime import datetime
 
 csv_file_path = os.path.join(os.path.dirname(__file__), 'endmembers_landsat.csv')
 
+# Number of pixels unmixed at once by a worker of `frac_coverage_classify`.
+# Memory use scales with this block size rather than with the size of the scene.
+frac_coverage_block_size = 2 ** 16
 
+
+@functools.lru_cache(maxsize=None)
+def _load_end_members():
+    """
+    Returns the 64 x 3 endmember matrix: the 63 feature rows of `csv_file_path`
+    and the sum to one constraint row. Read once per process.
+    """
+    end_members = np.loadtxt(csv_file_path, delimiter=',')  # Creates a 63 x 3 matrix
+
+    SumToOneWeight = 0.02
+    ones = np.ones(end_members.shape[1]) * SumToOneWeight
+    ones = ones.reshape(1, end_members.shape[1])
+    end_members = np.concatenate((end_members, ones), axis=0).astype(np.float32)
+    end_members.setflags(write=False)
+    return end_members
+
+
+@functools.lru_cache(maxsize=None)
+def _nnls_passive_set_solvers():
+    """
+    Factorises the non-negative least squares (NNLS) unmixing problem once per process.
+
+    With 3 endmembers, the NNLS solution of a pixel is the unconstrained least squares
+    solution restricted to one of the 7 non-empty subsets of endmembers, or 0.
+    The inverse of the Gram matrix of every subset is computed here so that the candidate
+    solutions of a whole block of pixels are obtained with small matrix products.
+
+    Returns
+    -------
+    end_members: np.ndarray
+        The 64 x 3 endmember matrix as float64.
+    gram: np.ndarray
+        The 3 x 3 Gram matrix of the endmembers.
+    solvers: list of (list of int, np.ndarray)
+        The endmember columns of every subset and the inverse of its Gram matrix.
+    """
+    end_members = _load_end_members().astype(np.float64)
+    gram = end_members.T @ end_members
+    n_end_members = end_members.shape[1]
+    solvers = []
+    for size in range(1, n_end_members + 1):
+        for columns in itertools.combinations(range(n_end_members), size):
+            columns = list(columns)
+            solvers.append((columns, np.linalg.inv(gram[np.ix_(columns, columns)])))
+    return end_members, gram, solvers
+
+
+def _frac_coverage_features(bands, features):
+    """
+    Computes the unmixing features of a block of pixels straight into `features`.
+
+    Parameters
+    ----------
+    bands: list of np.ndarray
+        The blue, green, red, nir, swir1 and swir2 values of the pixels.
+    features: np.ndarray
+        Preallocated float32 array of shape (64, number of pixels), filled in place with the
+        6 reflectances, their 6 logarithms, the 6 reflectance * logarithm products, the 15
+        pairwise reflectance products, the 15 pairwise logarithm products, the 15 pairwise
+        normalized differences and a row of ones.
+    """
+    reflectance = features[0:6]
+    for b, band in enumerate(bands):
+        np.multiply(band, np.float32(0.0001), out=reflectance[b], casting='unsafe')
+    log_reflectance = features[6:12]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.log(reflectance, out=log_reflectance)
+        np.multiply(reflectance, log_reflectance, out=features[12:18])
+        row = 18
+        for b in range(6):
+            for b2 in range(b + 1, 6):
+                np.multiply(reflectance[b], reflectance[b2], out=features[row])
+                np.multiply(log_reflectance[b], log_reflectance[b2], out=features[row + 15])
+                np.subtract(reflectance[b2], reflectance[b], out=features[row + 30])
+                features[row + 30] /= reflectance[b2] + reflectance[b]
+                row += 1
+    np.nan_to_num(features[:63], copy=False)
+    features[63] = 1
+
+
+def _nnls_unmix(features):
+    """
+    Solves the NNLS unmixing of a block of pixels at once.
+
+    All the candidate solutions given by `_nnls_passive_set_solvers` are computed for every
+    pixel. The feasible (non-negative) candidate with the smallest residual is the NNLS
+    solution, as returned by `scipy.optimize.nnls`.
+
+    Parameters
+    ----------
+    features: np.ndarray
+        Array of shape (64, number of pixels) filled by `_frac_coverage_features`.
+
+    Returns
+    -------
+    fractions: np.ndarray
+        Array of shape (number of pixels, 3).
+    """
+    end_members, gram, solvers = _nnls_passive_set_solvers()
+    projection = (end_members.T @ features).T  # A^T b of every pixel
+
+    # |Ax - b|^2 - |b|^2 = x^T A^T A x - 2 x^T A^T b, which is 0 for x = 0.
+    fractions = np.zeros(projection.shape)
+    best_residual = np.zeros(projection.shape[0])
+    for columns, gram_inverse in solvers:
+        candidate = np.zeros(projection.shape)
+        candidate[:, columns] = projection[:, columns] @ gram_inverse
+        residual = np.einsum('ij,jk,ik->i', candidate, gram, candidate) - \
+            2 * np.einsum('ij,ij->i', candidate, projection)
+        better = (candidate[:, columns] >= 0).all(axis=1) & (residual < best_residual)
+        fractions[better] = candidate[better]
+        best_residual[better] = residual[better]
+    return fractions
+
+
+def _frac_coverage_block(bands, clean_mask, result, start, stop):
+    """
+    Unmixes the clean pixels of the flattened pixel range [start, stop) into `result`.
+    """
+    pixels = start + np.flatnonzero(clean_mask[start:stop])
+    if pixels.size == 0:
+        return
+    features = np.empty((64, pixels.size), dtype=np.float32)
+    _frac_coverage_features([band[pixels] for band in bands], features)
+    result[pixels] = (_nnls_unmix(features).clip(0, 2.54) * 100).astype(np.int16)
+
+
+@timed_stage()
 def frac_coverage_classify(dataset_in, clean_mask=None, no_data=-9999,
-                           platform='LANDSAT_8', collection='c1'):
+                           platform='LANDSAT_8', collection='c1',
+                           block_size=None, n_workers=None):
     """
     Performs fractional coverage algorithm on given dataset.
     For Landsat, level 2 (surface reflectance) data must be used.
@@ -31,6 +166,8 @@ def frac_coverage_classify(dataset_in, clean_mask=None, no_data=-9999,
     The implemented algorithm is defined for Landsat 5/Landsat 7; for
     Landsat 8, the bands should be adjusted to match Landsat 7 value ranges.
 
+    Pixels are unmixed in blocks of `block_size` pixels by a pool of `n_workers` threads.
+
     References:
       - Guerschman, Juan P., et al. "Assessing the effects of site heterogeneity and soil
         properties when unmixing photosynthetic vegetation, non-photosynthetic vegetation
@@ -49,17 +186,23 @@ def frac_coverage_classify(dataset_in, clean_mask=None, no_data=-9999,
         If none is provided, one will be created which considers all values to be clean.
         If user does not provide a clean_mask,
         `dataset_in` must also include the cf_mask variable.
+    no_data: int or float
+        The value of the pixels which are not clean (-9999 by default).
     platform: str
         A string denoting the platform to be used. Can be "LANDSAT_5", "LANDSAT_7", or
         "LANDSAT_8", which are for Level 2 (surface reflectance) data.
     collection: string
         The Landsat collection of the data.
         Can be any of ['c1', 'c2'] for Collection 1 or 2, respectively.
+    block_size: int (optional)
+        Number of pixels unmixed at once by a worker. Defaults to `frac_coverage_block_size`.
+    n_workers: int (optional)
+        Number of worker threads. Defaults to the number of CPUs.
 
     Returns
     -------
     dataset_out: xarray.Dataset
-        Fractional coverage results with no_data = -9999; containing
+        Fractional coverage results, `no_data` where the pixels are not clean; containing
           coordinates: latitude, longitude
           variables: bs, pv, npv
         where bs -> bare soil, pv -> photosynthetic vegetation, npv -> non-photosynthetic vegetation
@@ -84,61 +227,22 @@ def frac_coverage_classify(dataset_in, clean_mask=None, no_data=-9999,
     if clean_mask is None:
         clean_mask = create_default_clean_mask(dataset_in)
 
-    band_stack = []
-
-    mosaic_clean_mask = clean_mask.flatten()
-
-    for band in [
-            dataset_in.blue.values, dataset_in.green.values, dataset_in.red.values, dataset_in.nir.values,
-            dataset_in.swir1.values, dataset_in.swir2.values
-    ]:
-        band = band.astype(np.float32)
-        band = band * 0.0001
-        band = band.flatten()
-        band_clean = np.full(band.shape, np.nan)
-        band_clean[mosaic_clean_mask] = band[mosaic_clean_mask]
-        band_stack.append(band_clean)
-
-    band_stack = np.array(band_stack).transpose()
-
-    for b in range(6):
-        band_stack = np.hstack((band_stack, np.expand_dims(np.log(band_stack[:, b]), axis=1)))
-    for b in range(6):
-        band_stack = np.hstack(
-            (band_stack, np.expand_dims(np.multiply(band_stack[:, b], band_stack[:, b + 6]), axis=1)))
-    for b in range(6):
-        for b2 in range(b + 1, 6):
-            band_stack = np.hstack(
-                (band_stack, np.expand_dims(np.multiply(band_stack[:, b], band_stack[:, b2]), axis=1)))
-    for b in range(6):
-        for b2 in range(b + 1, 6):
-            band_stack = np.hstack(
-                (band_stack, np.expand_dims(np.multiply(band_stack[:, b + 6], band_stack[:, b2 + 6]), axis=1)))
-    for b in range(6):
-        for b2 in range(b + 1, 6):
-            band_stack = np.hstack((band_stack, np.expand_dims(
-                np.divide(band_stack[:, b2] - band_stack[:, b], band_stack[:, b2] + band_stack[:, b]), axis=1)))
-
-    band_stack = np.nan_to_num(band_stack)  # Now a n x 63 matrix (assuming one acquisition)
-
-    ones = np.ones(band_stack.shape[0])
-    ones = ones.reshape(ones.shape[0], 1)
-    band_stack = np.concatenate((band_stack, ones), axis=1)  # Now a n x 64 matrix (assuming one acquisition)
-
-    end_members = np.loadtxt(csv_file_path, delimiter=',')  # Creates a 64 x 3 matrix
+    block_size = frac_coverage_block_size if block_size is None else block_size
 
-    SumToOneWeight = 0.02
-    ones = np.ones(end_members.shape[1]) * SumToOneWeight
-    ones = ones.reshape(1, end_members.shape[1])
-    end_members = np.concatenate((end_members, ones), axis=0).astype(np.float32)
+    mosaic_clean_mask = np.asarray(clean_mask, dtype=bool).ravel()
+    bands = [np.asarray(dataset_in[band].values).ravel()
+             for band in ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']]
 
-    result = np.zeros((band_stack.shape[0], end_members.shape[1]), dtype=np.float32)  # Creates an n x 3 matrix
+    n_pixels = mosaic_clean_mask.size
+    result = np.full((n_pixels, 3), no_data, dtype=np.float32)  # Creates an n x 3 matrix, no data by default
 
-    for i in range(band_stack.shape[0]):
-        if mosaic_clean_mask[i]:
-            result[i, :] = (opt.nnls(end_members, band_stack[i, :])[0].clip(0, 2.54) * 100).astype(np.int16)
-        else:
-            result[i, :] = np.ones((end_members.shape[1]), dtype=np.int16) * (-9999)  # Set as no data
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        blocks = [executor.submit(_frac_coverage_block, bands, mosaic_clean_mask, result,
+                                  start, min(start + block_size, n_pixels))
+                  for start in range(0, n_pixels, block_size)]
+        for block in blocks:
+            block.result()
 
     latitude = dataset_in.latitude
     longitude = dataset_in.longitude
@@ -149,13 +253,6 @@ def frac_coverage_classify(dataset_in, clean_mask=None, no_data=-9999,
     npv_band = result[:, :, 1]
     bs_band = result[:, :, 2]
 
-    pv_clean = np.full(pv_band.shape, -9999)
-    npv_clean = np.full(npv_band.shape, -9999)
-    bs_clean = np.full(bs_band.shape, -9999)
-    pv_clean[clean_mask] = pv_band[clean_mask]
-    npv_clean[clean_mask] = npv_band[clean_mask]
-    bs_clean[clean_mask] = bs_band[clean_mask]
-
     rapp_bands = collections.OrderedDict([('bs', (['latitude', 'longitude'], bs_band)),
                                           ('pv', (['latitude', 'longitude'], pv_band)),
                                           ('npv', (['latitude', 'longitude'], npv_band))])
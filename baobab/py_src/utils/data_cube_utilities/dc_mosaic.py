@@ -28,12 +28,14 @@ from collections import OrderedDict
 
 from . import dc_utilities as utilities
 from .dc_utilities import create_default_clean_mask
+from .dc_timing import timed_stage
 
 
 """
 Compositing Functions
 """
 
+@timed_stage()
 def create_min_max_var_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, 
                               var=None, min_max=None):
     """
@@ -114,6 +116,7 @@ def create_min_max_var_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=
     dataset_out = restore_or_convert_dtypes(dtype, dataset_in_dtypes, dataset_out, no_data)
     return dataset_out
 
+@timed_stage()
 def create_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, 
                   intermediate_product=None, reverse_time=False):
     """
@@ -184,6 +187,7 @@ def create_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None,
     dataset_out = restore_or_convert_dtypes(dtype, dataset_in_dtypes, dataset_out, no_data)
     return dataset_out
 
+@timed_stage()
 def create_mean_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, **kwargs):
     """
     Method for calculating the mean pixel value for a given dataset.
@@ -231,6 +235,7 @@ def create_mean_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, *
     return dataset_out
 
 
+@timed_stage()
 def create_median_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, **kwargs):
     """
     Method for calculating the median pixel value for a given dataset.
@@ -283,6 +288,7 @@ def create_median_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None,
     return dataset_out
 
 
+@timed_stage()
 def create_max_ndvi_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, intermediate_product=None, **kwargs):
     """
     Method for calculating the pixel value for the max ndvi value.
@@ -352,6 +358,7 @@ def create_max_ndvi_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=Non
     return dataset_out
 
 
+@timed_stage()
 def create_min_ndvi_mosaic(dataset_in, clean_mask=None, no_data=-9999, dtype=None, intermediate_product=None, **kwargs):
     """
     Method for calculating the pixel value for the min ndvi value.
@@ -548,6 +555,7 @@ def ls5_unpack_qa( data_array , cover_type):
     return unpack_bits(land_cover_endcoding, data_array, cover_type)
 
 
+@timed_stage()
 def create_hdmedians_multiple_band_mosaic(dataset_in,
                                           clean_mask=None,
                                           no_data=-9999,
@@ -1,3 +1,6 @@
+import os
+import re
+import hashlib
 import xarray as xr
 import numpy as np
 # This import is only for
@@ -25,40 +28,35 @@ def NDVI(*args, **kwargs):
     return _NDVI_orig(*args, **kwargs)
 
 
-def compute_ndvi_anomaly(baseline_data,
-                         scene_data,
-                         baseline_clear_mask=None,
-                         selected_scene_clear_mask=None,
-                         no_data=-9999):
-    """Compute the scene+baseline median ndvi values and the difference
+# Statistics of the baselines computed by `NdviBaselineStore`.
+ndvi_baseline_statistics = ['median', 'mean', 'std', 'count']
 
-    Args:
-        basleine_data: xarray dataset with dims lat, lon, t
-        scene_data: xarray dataset with dims lat, lon - should be mosaicked already.
-        baseline_clear_mask: boolean mask signifying clear pixels for the baseline data
-        selected_scene_clear_mask: boolean mask signifying lcear pixels for the baseline data
-        no_data: nodata value for the datasets
+# Datetime components the baselines can be grouped by.
+ndvi_baseline_seasons = ['month', 'season']
 
-    Returns:
-        xarray dataset with scene_ndvi, baseline_ndvi(median), ndvi_difference, and ndvi_percentage_change.
-    """
-    from .dc_water_classifier import wofs_classify
+# Meteorological season of every month.
+_month_seasons = {12: 'DJF', 1: 'DJF', 2: 'DJF', 3: 'MAM', 4: 'MAM', 5: 'MAM',
+                  6: 'JJA', 7: 'JJA', 8: 'JJA', 9: 'SON', 10: 'SON', 11: 'SON'}
 
-    assert selected_scene_clear_mask is not None and baseline_clear_mask is not None, "Both the selected scene and baseline data must have associated clear mask data."
 
-    #cloud filter + nan out all nodata.
-    baseline_data = baseline_data.where((baseline_data != no_data) & baseline_clear_mask)
+def _clean_ndvi(dataset, clean_mask, no_data=-9999):
+    """Computes the ndvi of the clear pixels of a dataset with red and nir bands, nan elsewhere."""
+    dataset = dataset[['red', 'nir']]
+    dataset = dataset.where((dataset != no_data) & clean_mask)
+    return (dataset.nir - dataset.red) / (dataset.nir + dataset.red)
 
-    baseline_ndvi = (baseline_data.nir - baseline_data.red) / (baseline_data.nir + baseline_data.red)
-    median_ndvi = baseline_ndvi.median('time')
+
+def _ndvi_anomaly(baseline_ndvi, scene_data, selected_scene_clear_mask, no_data=-9999):
+    """Computes the scene ndvi and its difference to a baseline ndvi. See compute_ndvi_anomaly."""
+    from .dc_water_classifier import wofs_classify
 
     #scene should already be mosaicked.
     water_class = wofs_classify(scene_data, clean_mask=selected_scene_clear_mask, mosaic=True).wofs
-    scene_cleaned = scene_data.copy(deep=True).where((scene_data != no_data) & (water_class == 0))
+    scene_cleaned = scene_data.where((scene_data != no_data) & (water_class == 0))
     scene_ndvi = (scene_cleaned.nir - scene_cleaned.red) / (scene_cleaned.nir + scene_cleaned.red)
 
-    ndvi_difference = scene_ndvi - median_ndvi
-    ndvi_percentage_change = (scene_ndvi - median_ndvi) / median_ndvi
+    ndvi_difference = scene_ndvi - baseline_ndvi
+    ndvi_percentage_change = (scene_ndvi - baseline_ndvi) / baseline_ndvi
 
     #convert to conventional nodata vals.
     scene_ndvi.values[~np.isfinite(scene_ndvi.values)] = no_data
@@ -68,7 +66,7 @@ def compute_ndvi_anomaly(baseline_data,
     scene_ndvi_dataset = xr.Dataset(
         {
             'scene_ndvi': scene_ndvi,
-            'baseline_ndvi': median_ndvi,
+            'baseline_ndvi': baseline_ndvi,
             'ndvi_difference': ndvi_difference,
             'ndvi_percentage_change': ndvi_percentage_change
         },
@@ -76,3 +74,271 @@ def compute_ndvi_anomaly(baseline_data,
                 'longitude': scene_data.longitude})
 
     return scene_ndvi_dataset
+
+
+def compute_ndvi_anomaly(baseline_data,
+                         scene_data,
+                         baseline_clear_mask=None,
+                         selected_scene_clear_mask=None,
+                         no_data=-9999):
+    """Compute the scene+baseline median ndvi values and the difference
+
+    When many scenes are compared to the same baseline, see NdviBaselineStore and
+    compute_ndvi_anomaly_from_baseline, which compute the baseline statistics only once.
+
+    Args:
+        basleine_data: xarray dataset with dims lat, lon, t
+        scene_data: xarray dataset with dims lat, lon - should be mosaicked already.
+        baseline_clear_mask: boolean mask signifying clear pixels for the baseline data
+        selected_scene_clear_mask: boolean mask signifying lcear pixels for the baseline data
+        no_data: nodata value for the datasets
+
+    Returns:
+        xarray dataset with scene_ndvi, baseline_ndvi(median), ndvi_difference, and ndvi_percentage_change.
+    """
+    assert selected_scene_clear_mask is not None and baseline_clear_mask is not None, "Both the selected scene and baseline data must have associated clear mask data."
+
+    #cloud filter + nan out all nodata.
+    baseline_ndvi = _clean_ndvi(baseline_data, baseline_clear_mask, no_data=no_data)
+    median_ndvi = baseline_ndvi.median('time')
+
+    return _ndvi_anomaly(median_ndvi, scene_data, selected_scene_clear_mask, no_data=no_data)
+
+
+def compute_ndvi_anomaly_from_baseline(baseline,
+                                       scene_data,
+                                       selected_scene_clear_mask=None,
+                                       season=None,
+                                       statistic='median',
+                                       no_data=-9999):
+    """Compute the scene ndvi values and their difference to precomputed baseline statistics
+
+    Only the scene is processed: the baseline comes from NdviBaselineStore.baseline.
+
+    Args:
+        baseline: xarray dataset returned by NdviBaselineStore.baseline
+        scene_data: xarray dataset with dims lat, lon - should be mosaicked already.
+        selected_scene_clear_mask: boolean mask signifying clear pixels for the scene data
+        season: the season of the scene (e.g. the month 7, or 'JJA'), required if the baseline has a season dim.
+        statistic: the baseline statistic the scene is compared to, 'median' or 'mean'.
+        no_data: nodata value for the datasets
+
+    Returns:
+        xarray dataset with scene_ndvi, baseline_ndvi, ndvi_difference, and ndvi_percentage_change.
+    """
+    assert selected_scene_clear_mask is not None, "The selected scene must have associated clear mask data."
+
+    baseline_ndvi = baseline[statistic]
+    if 'season' in baseline_ndvi.dims:
+        if season is None:
+            raise ValueError("The baseline is seasonal: the season of the scene must be given.")
+        baseline_ndvi = baseline_ndvi.sel(season=season, drop=True)
+
+    return _ndvi_anomaly(baseline_ndvi, scene_data, selected_scene_clear_mask, no_data=no_data)
+
+
+def _store_key(value):
+    """Returns a directory name for an AOI or product: strings are kept readable, other values are hashed."""
+    if isinstance(value, str):
+        return re.sub(r'[^A-Za-z0-9.-]+', '_', value)
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:16]
+
+
+class NdviBaselineStore:
+    """
+    Persistent per-pixel ndvi baselines, computed once per (AOI, product, season, baseline years).
+
+    The clear ndvi observations of every month of every baseline year are stored per AOI and product
+    (float32, compressed, 4 bytes per pixel and scene). They are updated incrementally: the scenes of a
+    month already stored are skipped, new scenes are added to the month. Baseline statistics (median,
+    mean, std and count of every month or season) are computed from the stored observations of the
+    baseline years, `block_rows` rows of pixels at a time, and cached. Updating a year only invalidates
+    the cached baselines that include it.
+
+    The statistics are those of compute_ndvi_anomaly (the exact median), up to the float32 rounding of
+    the stored observations.
+
+    Layout of the store:
+        <path>/<product>/<aoi>/ndvi_<year>_<month>.nc: the ndvi of the scenes of a month
+        <path>/<product>/<aoi>/baseline_<season>_<years>.nc: cached baseline statistics
+
+    Example:
+        store = NdviBaselineStore('/data/ndvi_baselines')
+        store.update(baseline_data, baseline_clear_mask, aoi='lake_geneva', product='ls8_lasrc_swiss')
+        baseline = store.baseline('lake_geneva', 'ls8_lasrc_swiss', years=range(2015, 2020), season='month')
+        for scene_data, clear_mask, month in scenes:
+            anomaly = compute_ndvi_anomaly_from_baseline(baseline, scene_data, clear_mask, season=month)
+    """
+
+    def __init__(self, path, block_rows=64):
+        """
+        Args:
+            path: root directory of the store. It is created by the first update.
+            block_rows: number of rows of pixels of the blocks the baselines are computed by (and of the
+                NetCDF chunks of the months). A block of all the observations of a season is held in memory:
+                8 * block_rows * width * observations bytes.
+        """
+        self.path = path
+        self.block_rows = block_rows
+
+    def _directory(self, aoi, product):
+        return os.path.join(self.path, _store_key(product), _store_key(aoi))
+
+    @staticmethod
+    def _write(dataset, path, encoding=None):
+        """Writes a dataset to NetCDF. The file is renamed into place once complete."""
+        dataset.to_netcdf(path + '.part', encoding=encoding, format='NETCDF4')
+        os.replace(path + '.part', path)
+
+    @staticmethod
+    def _baseline_years(file_name):
+        """Returns the years of a cached baseline file name."""
+        return [int(year) for year in os.path.splitext(file_name)[0].split('_')[-1].split('-')]
+
+    def _months(self, aoi, product):
+        """Returns the sorted (year, month) pairs stored for an AOI and a product."""
+        directory = self._directory(aoi, product)
+        if not os.path.isdir(directory):
+            return []
+        return sorted((int(match.group(1)), int(match.group(2))) for match in
+                      (re.fullmatch(r'ndvi_(\d+)_(\d+)\.nc', name) for name in os.listdir(directory)) if match)
+
+    @staticmethod
+    def _open_month(directory, year, month):
+        """Returns the (lazily loaded) ndvi of a stored month, None if it is not stored. Close it after use."""
+        path = os.path.join(directory, 'ndvi_{}_{}.nc'.format(year, month))
+        if not os.path.exists(path):
+            return None
+        dataset = xr.open_dataset(path)
+        if 'ndvi' not in dataset:
+            dataset.close()
+            raise ValueError("{} is not a month of ndvi observations: the stores of ndvi histograms must be "
+                             "rebuilt.".format(path))
+        return dataset
+
+    def years(self, aoi, product):
+        """
+        Returns:
+            The sorted list of the years stored for an AOI and a product.
+        """
+        return sorted(set(year for year, _ in self._months(aoi, product)))
+
+    def update(self, baseline_data, baseline_clear_mask, aoi, product, no_data=-9999):
+        """
+        Adds baseline data to the store. The scenes (acquisition times) already stored are skipped,
+        so overlapping or repeated loads can be added safely.
+
+        Args:
+            baseline_data: xarray dataset with dims lat, lon, t and the red and nir bands.
+            baseline_clear_mask: boolean mask signifying clear pixels for the baseline data
+            aoi: name of the area of interest (a string, or any value with a stable repr, such as coordinate ranges)
+            product: name of the Data Cube product of the baseline data
+            no_data: nodata value for the dataset
+
+        Returns:
+            The sorted list of the years updated.
+        """
+        directory = self._directory(aoi, product)
+        os.makedirs(directory, exist_ok=True)
+        times = baseline_data.time.values
+        years, months = baseline_data.time.dt.year.values, baseline_data.time.dt.month.values
+        ndvi = None
+        updated = set()
+        for year, month in sorted(set(zip(years.tolist(), months.tolist()))):
+            stored = self._open_month(directory, year, month)
+            scene_times = np.array([], dtype='datetime64[ns]') if stored is None else stored.time.values
+            new = np.flatnonzero((years == year) & (months == month) & ~np.isin(times, scene_times))
+            # The same scene may also appear twice in the data (e.g. from overlapping loads).
+            new = new[np.unique(times[new], return_index=True)[1]]
+            if len(new) == 0:
+                if stored is not None:
+                    stored.close()
+                continue
+            if ndvi is None:
+                ndvi = _clean_ndvi(baseline_data, baseline_clear_mask, no_data=no_data)
+            month_ndvi = ndvi.isel(time=new).transpose('time', 'latitude', 'longitude').astype(np.float32)
+            month_ndvi = month_ndvi.drop_vars([name for name in month_ndvi.coords if name not in month_ndvi.dims])
+            if stored is not None:
+                with stored:
+                    month_ndvi = xr.concat([stored.ndvi.load(), month_ndvi], dim='time').sortby('time')
+            chunks = (1, min(self.block_rows, month_ndvi.sizes['latitude']), month_ndvi.sizes['longitude'])
+            self._write(month_ndvi.to_dataset(name='ndvi'), os.path.join(directory, 'ndvi_{}_{}.nc'.format(year, month)),
+                        encoding={'ndvi': {'zlib': True, 'complevel': 4, 'chunksizes': chunks}})
+            updated.add(year)
+
+        # The cached baselines including an updated year are outdated.
+        for name in os.listdir(directory):
+            if name.startswith('baseline_') and name.endswith('.nc') and set(self._baseline_years(name)) & updated:
+                os.remove(os.path.join(directory, name))
+        return sorted(updated)
+
+    def baseline(self, aoi, product, years=None, season='month'):
+        """
+        Returns the baseline statistics of an AOI and a product, computed if they are not cached yet.
+
+        Args:
+            aoi: name of the area of interest, as given to update.
+            product: name of the Data Cube product, as given to update.
+            years: the baseline years. Defaults to all the stored years.
+            season: 'month' or 'season' (DJF, MAM, JJA, SON) to compute a baseline per month or season,
+                None for a single baseline of all the observations.
+
+        Returns:
+            xarray dataset with dims (season,) lat, lon and the variables median, mean, std and count.
+        """
+        if season is not None and season not in ndvi_baseline_seasons:
+            raise ValueError("season must be one of {} or None".format(ndvi_baseline_seasons))
+        stored = self.years(aoi, product)
+        years = stored if years is None else sorted(set(int(year) for year in years))
+        missing = sorted(set(years) - set(stored))
+        if not years or missing:
+            raise ValueError("The years {} are not in the store, see NdviBaselineStore.update."
+                             .format(missing or years))
+
+        directory = self._directory(aoi, product)
+        path = os.path.join(directory, 'baseline_{}_{}.nc'.format(
+            season or 'all', '-'.join(str(year) for year in years)))
+        if os.path.exists(path):
+            with xr.open_dataset(path) as cached:
+                return cached.load()
+
+        baseline = self._compute_baseline(directory, [(year, month) for year, month in self._months(aoi, product)
+                                                      if year in years], season)
+        self._write(baseline, path)
+        return baseline
+
+    def _compute_baseline(self, directory, months, season):
+        """Computes the statistics of the stored observations of every season (all of them if season is None)."""
+        import warnings
+
+        def key(month):
+            return None if season is None else month if season == 'month' else _month_seasons[month]
+
+        keys = [None] if season is None else sorted(set(key(month) for _, month in months))
+        stored = [(key(month), self._open_month(directory, year, month)) for year, month in months]
+        try:
+            template = stored[0][1].ndvi.isel(time=0, drop=True)
+            shape = (len(keys),) + template.shape
+            statistics = {name: np.empty(shape, dtype=np.int64 if name == 'count' else np.float64)
+                          for name in ndvi_baseline_statistics}
+            for row in range(0, shape[1], self.block_rows):
+                rows = slice(row, row + self.block_rows)
+                for index, season_key in enumerate(keys):
+                    values = np.concatenate([dataset.ndvi[:, rows].values for month_key, dataset in stored
+                                             if month_key == season_key]).astype(np.float64)
+                    with warnings.catch_warnings():
+                        # All-NaN pixels
+                        warnings.simplefilter('ignore', RuntimeWarning)
+                        statistics['median'][index, rows] = np.nanmedian(values, axis=0)
+                        statistics['mean'][index, rows] = np.nanmean(values, axis=0)
+                        statistics['std'][index, rows] = np.nanstd(values, axis=0)
+                    statistics['count'][index, rows] = np.isfinite(values).sum(axis=0)
+        finally:
+            for _, dataset in stored:
+                dataset.close()
+
+        dims, coords = template.dims, {name: template[name] for name in template.dims}
+        if season is None:
+            return xr.Dataset({name: (dims, values[0]) for name, values in statistics.items()}, coords=coords)
+        return xr.Dataset({name: (('season',) + dims, values) for name, values in statistics.items()},
+                          coords=dict(coords, season=keys))
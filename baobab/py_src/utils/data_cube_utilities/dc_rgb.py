@@ -14,10 +14,12 @@ def rgb(dataset, time_index=0, x_coord='longitude', y_coord='latitude',
 
     Parameters
     ----------
-    dataset: xarray.Dataset
+    dataset: xarray.Dataset or list of xarray.Dataset
         A Dataset containing at least latitude and longitude coordinates and optionally time.
         The coordinate order should be time, latitude, and finally longitude.
         Must contain the data variables specified in the `bands` parameter.
+        It can also be the levels of a pyramid (see `aggregate.xr_pyramid()`), in which case
+        the coarsest level with at least as many pixels as the axes is shown.
     time_index:
         The time index to show data for if `dataset` is not 2D.
     x_coord, y_coord, time_coord: str
@@ -52,8 +54,14 @@ def rgb(dataset, time_index=0, x_coord='longitude', y_coord='latitude',
     fig, ax: matplotlib.figure.Figure, matplotlib.axes.Axes
         The figure and axes used for the plot.
     """
-    from .plotter_utils import figure_ratio, \
+    from .plotter_utils import figure_ratio, get_ax_size, \
         xarray_set_axes_labels, retrieve_or_create_fig_ax
+    from .aggregate import xr_select_pyramid_level
+
+    if isinstance(dataset, (list, tuple)):
+        fig, ax = retrieve_or_create_fig_ax(fig, ax, figsize=figure_ratio(dataset[0], x_coord, y_coord,
+                                                                          fixed_width=width))
+        dataset = xr_select_pyramid_level(dataset, np.array(get_ax_size(fig, ax)) * fig.dpi, x_coord, y_coord)
 
     imshow_kwargs = {} if imshow_kwargs is None else imshow_kwargs
     vmin = imshow_kwargs.pop('vmin', None)
@@ -0,0 +1,193 @@
+"""
+Timing of the stages (loading, compositing, classification...) of an analysis.
+
+Stages are timed with `timed_stage`, as a context manager or a decorator, once timing has been enabled:
+
+    enable_stage_timing('stages.jsonl')
+    with timed_stage('mosaic') as stage:
+        mosaic = create_mosaic(dataset, clean_mask)
+        stage.add_bytes(mosaic)
+    print(stage_summary())
+
+Every stage writes a JSON line (stage, parent stage, start, wall_s, cpu_s, peak_rss_delta_mb, bytes) to the
+log and is kept for `stage_summary`. When timing is disabled (the default) a stage costs one test of a flag.
+The CPU time and peak RSS are the ones of the current process (all of its threads): the work done in dask
+distributed workers is only seen as wall time.
+"""
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from datetime import datetime
+
+# Timing state: enabled, log path, run identifier, verbosity and the records of the run.
+_timing = dict(enabled=False, path=None, run=None, verbose=False, records=[])
+_stack = threading.local()
+_log_lock = threading.Lock()
+
+
+def enable_stage_timing(path=None, verbose=False, reset=False):
+    """
+    Enables the timing of the stages, for a new run.
+
+    Parameters
+    ----------
+    path: str
+        The JSON lines file the stages are appended to (only kept in memory if None).
+    verbose: bool
+        Whether to print every stage as it ends.
+    reset: bool
+        Whether to empty the file first.
+    """
+    if reset and path is not None:
+        open(path, 'w').close()
+    _timing.update(enabled=True, path=path, verbose=verbose, records=[],
+                   run=datetime.now().strftime('%Y%m%dT%H%M%S.%f'))
+
+
+def disable_stage_timing():
+    """Disables the timing of the stages. The records of the last run are kept for `stage_summary`."""
+    _timing['enabled'] = False
+
+
+def _peak_rss():
+    """Returns the peak resident memory of the process in bytes (ru_maxrss is in kilobytes on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _nbytes(value):
+    """Returns the size of an array, a Dataset or a sequence of them (0 if unknown)."""
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(element) for element in value)
+    return int(getattr(value, 'nbytes', 0))
+
+
+def _write_record(record):
+    _timing['records'].append(record)
+    if _timing['path'] is not None:
+        with _log_lock, open(_timing['path'], 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+    if _timing['verbose']:
+        print('%s | %s%s (done in %.3f s, cpu %.3f s, peak rss +%.1f MB, %.1f MB)' %
+              (datetime.now(), '  ' * record['depth'], record['stage'], record['wall_s'], record['cpu_s'],
+               record['peak_rss_delta_mb'], record['bytes'] / 2 ** 20))
+
+
+class timed_stage(object):
+    """
+    Times a stage: wall time, CPU time of the process, growth of its peak resident memory and bytes
+    loaded or produced. Used as a context manager (`stage.add_bytes` records the size of what the
+    stage loaded), or as a decorator which records the size of the returned value.
+
+    Parameters
+    ----------
+    name: str
+        The name of the stage (the qualified name of the decorated function if None).
+    **info:
+        JSON serializable values added to the record (e.g. the product).
+    """
+    def __init__(self, name=None, **info):
+        self.name = name
+        self.info = info
+        self.bytes = 0
+        self._start = None
+
+    def add_bytes(self, value):
+        """Adds the bytes of `value` (an array, a Dataset, a sequence of them or a number) to the stage."""
+        if self._start is not None:
+            self.bytes += value if isinstance(value, int) else _nbytes(value)
+        return value
+
+    def __enter__(self):
+        if not _timing['enabled']:
+            return self
+        stack = getattr(_stack, 'stages', None)
+        if stack is None:
+            stack = _stack.stages = []
+        self._parent = stack[-1].name if stack else None
+        self._depth = len(stack)
+        stack.append(self)
+        self._started = datetime.now()
+        self._peak_rss = _peak_rss()
+        self._cpu = time.process_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start is None:
+            return False
+        wall = time.perf_counter() - self._start
+        cpu = time.process_time() - self._cpu
+        _stack.stages.pop()
+        record = dict(run=_timing['run'], stage=self.name, parent=self._parent, depth=self._depth,
+                      start=self._started.isoformat(), wall_s=wall, cpu_s=cpu,
+                      peak_rss_delta_mb=(_peak_rss() - self._peak_rss) / 2 ** 20, bytes=self.bytes,
+                      pid=os.getpid(), **self.info)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        self._start = None
+        _write_record(record)
+        return False
+
+    def __call__(self, function):
+        name = self.name or function.__qualname__
+        info = self.info
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _timing['enabled']:
+                return function(*args, **kwargs)
+            with timed_stage(name, **info) as stage:
+                return stage.add_bytes(function(*args, **kwargs))
+        return wrapper
+
+
+def stage_records():
+    """Returns the records of the current (or last) run."""
+    return list(_timing['records'])
+
+
+def read_stage_log(path):
+    """Returns the records of a JSON lines stage log."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def stage_summary(records=None, run=None):
+    """
+    Summarizes the stages of a run by name.
+
+    Parameters
+    ----------
+    records: list of dict
+        The records (e.g. from `read_stage_log`). Those of the current (or last) run if None.
+    run: str
+        The run to summarize among the records (the last one if None).
+
+    Returns
+    -------
+    summary: pandas.DataFrame
+        Indexed by stage (in order of first appearance): calls, total, mean and max wall time,
+        CPU time and its ratio to the wall time (> 1 for multithreaded stages), max peak RSS growth,
+        total MB and MB/s.
+    """
+    import pandas as pd
+
+    records = _timing['records'] if records is None else records
+    if run is None and records:
+        run = records[-1].get('run')
+    frame = pd.DataFrame([record for record in records if record.get('run') == run],
+                         columns=['stage', 'wall_s', 'cpu_s', 'peak_rss_delta_mb', 'bytes'])
+    grouped = frame.groupby('stage', sort=False)
+    summary = pd.DataFrame({'calls': grouped.size(),
+                            'wall_s': grouped.wall_s.sum(),
+                            'wall_mean_s': grouped.wall_s.mean(),
+                            'wall_max_s': grouped.wall_s.max(),
+                            'cpu_s': grouped.cpu_s.sum(),
+                            'peak_rss_delta_mb': grouped.peak_rss_delta_mb.max(),
+                            'mb': grouped.bytes.sum() / 2 ** 20})
+    summary.insert(5, 'cpu_ratio', summary.cpu_s / summary.wall_s.where(summary.wall_s > 0))
+    summary['mb_per_s'] = summary.mb / summary.wall_s.where(summary.wall_s > 0)
+    return summary
@@ -241,41 +241,248 @@ def perform_timeseries_analysis(dataset_in, band_name, intermediate_product=None
 
     assert operation in ['mean', 'max', 'min'], "Please enter a valid operation."
 
-    data = dataset_in[band_name]
-    data = data.where(data != no_data)
-
-    processed_data_sum = data.sum('time')
-
-    clean_data = data.notnull()
-
-    clean_data_sum = clean_data.astype('bool').sum('time')
+    chunk = TimeseriesAccumulator(no_data=no_data).update(dataset_in[band_name]).finalize()
 
     dataset_out = None
     if intermediate_product is None:
-        processed_data_normalized = processed_data_sum / clean_data_sum
         dataset_out = xr.Dataset(
             {
-                'normalized_data': processed_data_normalized,
-                'min': data.min(dim='time'),
-                'max': data.max(dim='time'),
-                'total_data': processed_data_sum,
-                'total_clean': clean_data_sum
+                'normalized_data': chunk['mean'],
+                'min': chunk['min'],
+                'max': chunk['max'],
+                'total_data': chunk['sum'],
+                'total_clean': chunk['count']
             },
             coords={'latitude': dataset_in.latitude,
                     'longitude': dataset_in.longitude})
     else:
         dataset_out = intermediate_product
-        dataset_out['total_data'] += processed_data_sum
-        dataset_out['total_clean'] += clean_data_sum
+        dataset_out['total_data'] += chunk['sum']
+        dataset_out['total_clean'] += chunk['count']
         dataset_out['normalized_data'] = dataset_out['total_data'] / dataset_out['total_clean']
-        dataset_out['min'] = xr.concat([dataset_out['min'], data.min(dim='time')], dim='time').min(dim='time')
-        dataset_out['max'] = xr.concat([dataset_out['max'], data.max(dim='time')], dim='time').max(dim='time')
+        dataset_out['min'] = np.fmin(dataset_out['min'], chunk['min'])
+        dataset_out['max'] = np.fmax(dataset_out['max'], chunk['max'])
 
     dataset_out.where(dataset_out != np.nan, 0)
 
     return dataset_out
 
 
+class TimeseriesAccumulator:
+    """
+    Mergeable per-pixel statistics of a timeseries, accumulated one time chunk at a time.
+
+    Keeps the count, sum, mean and sum of squared deviations (Welford / Chan et al. updates),
+    minimum, maximum and optionally (`bins`) a fixed-bin histogram of every pixel, so decades of data
+    can be streamed in time chunks, possibly by several workers whose accumulators are merged.
+
+    Example:
+        accumulator = TimeseriesAccumulator(histogram_range=(-1, 1), bins=200)
+        for year in years:
+            accumulator.update(ndvi.sel(time=year))
+        stats = accumulator.finalize(percentiles=[10, 50, 90])
+    """
+
+    def __init__(self, no_data=-9999, histogram_range=None, bins=None, dim='time'):
+        """
+        Args:
+            no_data: value treated as missing, in addition to NaN.
+            histogram_range: (min, max) range of the per-pixel histogram used for percentiles.
+                Values outside of the range fall in the first or last bin.
+            bins: number of bins of the histogram (uint32 counts, i.e. 4 * bins bytes per pixel).
+                No histogram is kept if None.
+            dim: name of the time dimension of the chunks.
+        """
+        if bins is not None and histogram_range is None:
+            raise ValueError("A histogram requires a histogram_range.")
+        self.no_data = no_data
+        self.histogram_range = histogram_range
+        self.bins = bins
+        self.dim = dim
+        self.template = None
+        self.count = self.sum = self.mean = self.m2 = self.min = self.max = self.histogram = None
+
+    def _initialize(self, template):
+        shape = template.shape
+        self.template = template
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        if self.bins is not None:
+            self.histogram = np.zeros(shape + (self.bins,), dtype=np.uint32)
+
+    def _combine(self, count, total, mean, m2, minimum, maximum, histogram):
+        """Merges the statistics of another set of observations of the same pixels (Chan et al.)."""
+        new_count = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(count > 0, self.mean + delta * np.where(new_count > 0, count / new_count, 0), self.mean)
+            self.m2 = np.where(count > 0, self.m2 + m2 + delta ** 2 * np.where(new_count > 0, self.count * count / new_count, 0), self.m2)
+        self.count = new_count
+        self.sum += total
+        np.fmin(self.min, minimum, out=self.min)
+        np.fmax(self.max, maximum, out=self.max)
+        if self.histogram is not None:
+            self.histogram += histogram
+
+    def update(self, chunk):
+        """
+        Adds a time chunk of observations.
+
+        Args:
+            chunk: xarray.DataArray with the `dim` dimension (numpy or dask backed; it is loaded once).
+
+        Returns:
+            The accumulator, to allow chaining.
+        """
+        chunk = chunk.transpose(self.dim, *[dim for dim in chunk.dims if dim != self.dim])
+        if self.template is None:
+            self._initialize(chunk.isel({self.dim: 0}, drop=True))
+        values = np.asarray(chunk.values, dtype=np.float64)
+        values = np.where(values == self.no_data, np.nan, values)
+        valid = ~np.isnan(values)
+
+        count = valid.sum(axis=0)
+        total = np.where(valid, values, 0).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, total / count, 0)
+        m2 = np.where(valid, (values - mean) ** 2, 0).sum(axis=0)
+        minimum = np.where(valid, values, np.inf).min(axis=0)
+        maximum = np.where(valid, values, -np.inf).max(axis=0)
+
+        histogram = None
+        if self.histogram is not None:
+            low, high = self.histogram_range
+            bins = np.clip(((values - low) / (high - low) * self.bins), 0, self.bins - 1)
+            bins = np.where(valid, bins, 0).astype(np.int64)
+            histogram = np.zeros(self.histogram.shape, dtype=np.uint32)
+            pixels = np.arange(int(np.prod(count.shape))).reshape(count.shape)
+            flat_histogram = histogram.reshape(-1)
+            for time_bins, time_valid in zip(bins, valid):
+                flat_histogram[(pixels * self.bins + time_bins)[time_valid]] += 1
+
+        self._combine(count, total, mean, m2, minimum, maximum, histogram)
+        return self
+
+    def merge(self, other):
+        """
+        Merges the statistics accumulated by another accumulator over the same pixels.
+
+        Args:
+            other: TimeseriesAccumulator with the same histogram configuration.
+
+        Returns:
+            The accumulator, to allow chaining.
+        """
+        if other.template is None:
+            return self
+        if (other.histogram_range, other.bins) != (self.histogram_range, self.bins):
+            raise ValueError("Accumulators with different histograms cannot be merged.")
+        if self.template is None:
+            self._initialize(other.template)
+        elif self.count.shape != other.count.shape:
+            raise ValueError("Accumulators of different pixels cannot be merged.")
+        self._combine(other.count, other.sum, other.mean, other.m2, other.min, other.max, other.histogram)
+        return self
+
+    def to_dataset(self):
+        """
+        Returns the state of the accumulator, e.g. to persist it between updates (see from_dataset).
+
+        Returns:
+            xarray.Dataset with the variables count, sum, mean, m2, min, max and histogram (with a bin dimension).
+        """
+        if self.template is None:
+            raise ValueError("No data was accumulated.")
+        dims = self.template.dims
+        state = {name: (dims, getattr(self, name)) for name in ['count', 'sum', 'mean', 'm2', 'min', 'max']}
+        attrs = dict(dim=self.dim)
+        if self.no_data is not None:
+            attrs['no_data'] = self.no_data
+        if self.histogram is not None:
+            state['histogram'] = (dims + ('bin',), self.histogram)
+            attrs.update(histogram_range=list(self.histogram_range), bins=self.bins)
+        return xr.Dataset(state, coords=self.template.coords, attrs=attrs)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """
+        Restores an accumulator from its state.
+
+        Args:
+            dataset: xarray.Dataset returned by to_dataset.
+
+        Returns:
+            A TimeseriesAccumulator, which can be updated or merged further.
+        """
+        histogram_range = dataset.attrs.get('histogram_range')
+        accumulator = cls(no_data=dataset.attrs.get('no_data'),
+                          histogram_range=None if histogram_range is None else tuple(histogram_range),
+                          bins=dataset.attrs.get('bins'), dim=dataset.attrs.get('dim', 'time'))
+        accumulator.template = dataset['count']
+        for name in ['count', 'sum', 'mean', 'm2', 'min', 'max']:
+            setattr(accumulator, name, np.array(dataset[name].values))
+        if accumulator.bins is not None:
+            accumulator.histogram = np.array(dataset['histogram'].values, dtype=np.uint32)
+        return accumulator
+
+    def _percentiles(self, percentiles, block_size=65536):
+        """Approximates percentiles by linear interpolation within the histogram bins, `block_size` pixels at a time."""
+        low, high = self.histogram_range
+        width = (high - low) / self.bins
+        histogram = self.histogram.reshape(-1, self.bins)
+        count, minimum, maximum = self.count.reshape(-1), self.min.reshape(-1), self.max.reshape(-1)
+        results = np.empty((len(percentiles), count.size))
+        for start in range(0, count.size, block_size):
+            block = slice(start, start + block_size)
+            # the cumulative counts of a block only
+            cumulative = histogram[block].cumsum(axis=-1)
+            for index, percentile in enumerate(percentiles):
+                target = percentile / 100 * count[block]
+                bin_index = np.minimum((cumulative < target[:, None]).sum(axis=-1), self.bins - 1)[:, None]
+                in_bin = np.take_along_axis(histogram[block], bin_index, axis=-1)[:, 0]
+                before = np.take_along_axis(cumulative, bin_index, axis=-1)[:, 0] - in_bin
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    fraction = np.where(in_bin > 0, (target - before) / in_bin, 0)
+                results[index, block] = np.clip(low + (bin_index[:, 0] + fraction) * width, minimum[block], maximum[block])
+        return results.reshape((len(percentiles),) + self.count.shape)
+
+    def finalize(self, percentiles=None, ddof=0):
+        """
+        Computes the statistics accumulated so far.
+
+        Args:
+            percentiles: list of percentiles in [0, 100], approximated from the histogram.
+                Requires a histogram (`bins`).
+            ddof: delta degrees of freedom of the variance.
+
+        Returns:
+            xarray.Dataset with the variables count, sum, mean, variance, std, min, max
+            (NaN where there is no observation) and, if requested, percentiles (with a percentile dimension).
+        """
+        if self.template is None:
+            raise ValueError("No data was accumulated.")
+        no_data = self.count == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+        statistics = dict(count=self.count, sum=self.sum, mean=np.where(no_data, np.nan, self.mean),
+                          variance=variance, std=np.sqrt(variance),
+                          min=np.where(no_data, np.nan, self.min), max=np.where(no_data, np.nan, self.max))
+
+        dims, coords = self.template.dims, self.template.coords
+        dataset_out = xr.Dataset({name: (dims, values) for name, values in statistics.items()}, coords=coords)
+        if percentiles is not None:
+            if self.histogram is None:
+                raise ValueError("Percentiles require a histogram (bins).")
+            values = np.where(no_data, np.nan, self._percentiles(percentiles))
+            dataset_out['percentiles'] = xr.DataArray(values, dims=('percentile',) + dims,
+                                                      coords={'percentile': list(percentiles)})
+        return dataset_out
+
+
 def clear_attrs(dataset):
     """Clear out all attributes on an xarray dataset to write to disk."""
     from collections import OrderedDict
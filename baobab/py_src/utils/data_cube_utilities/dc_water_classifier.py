@@ -23,7 +23,6 @@ import os
 # old_cwd = os.getcwd()
 # os.chdir(os.path.dirname(__file__))
 
-import gc
 import numpy as np
 import xarray as xr
 import dask
@@ -39,6 +38,7 @@ from datetime import datetime
 
 from . import dc_utilities as utilities
 from .dc_utilities import create_default_clean_mask
+from .dc_timing import timed_stage
 
 # os.chdir(old_cwd)
 
@@ -86,6 +86,151 @@ def NDWI(data, normalize=False, band_pair=0):
             ndwi = (ndwi - np.nanmin(ndwi))/(np.nanmax(ndwi) - np.nanmin(ndwi))
     return ndwi
 
+# Maximum number of pixels classified at once by `_wofs_classify_block`.
+# Bounds the size of the temporaries of the regression tree regardless of the size of the input.
+_wofs_block_size = 2 ** 20
+
+
+def _wofs_band_ratio(a, b):
+    """
+    Calculates a normalized ratio index
+    """
+    return (a - b) / (a + b)
+
+
+def _wofs_water_numpy(band1, band2, band3, band4, band5, band7):
+    """
+    Evaluates the WOfS regression tree on NumPy arrays with a single boolean expression.
+    Every comparison is written as `<=` (negated where needed) so NaN ratios take the same
+    branches as in the original node by node implementation.
+
+    Returns
+    -------
+    water: numpy.ndarray of bool
+        True for the pixels classified as water.
+    """
+    ndi_52 = _wofs_band_ratio(band5, band2)
+    ndi_43 = _wofs_band_ratio(band4, band3)
+    ndi_72 = _wofs_band_ratio(band7, band2)
+
+    b1_129 = band1 <= 129.5
+    b3_364 = band3 <= 364.5
+
+    # Left branch (nodes 3 to 20)
+    left = (ndi_52 <= -0.01) & (band1 <= 2083.5)
+    b7_323 = band7 <= 323.5
+    b1_1400 = band1 <= 1400.5
+    ndi_72_023 = ndi_72 <= -0.23
+    left &= (b7_323 & (ndi_43 <= 0.61)) | \
+            (~b7_323 & ~b1_1400 & (ndi_43 <= -0.01)) | \
+            (~b7_323 & b1_1400 & ~ndi_72_023 & (band1 <= 379)) | \
+            (~b7_323 & b1_1400 & ndi_72_023 & ((ndi_43 <= 0.22) | (band1 <= 473)))
+    del b7_323, b1_1400, ndi_72_023
+
+    # Right branch (nodes 23 to 45)
+    right = ~(ndi_52 <= -0.01)
+    ndi_52_023 = ndi_52 <= 0.23
+    ndi_52_012 = ndi_52 <= 0.12
+    right &= (ndi_52_023 & (band1 <= 334.5) & (ndi_43 <= 0.54) &
+              (ndi_52_012 | (~ndi_52_012 & ((b3_364 & b1_129) | (~b3_364 & (band1 <= 300.5)))))) | \
+             (~ndi_52_023 & (ndi_52 <= 0.34) & (band1 <= 249.5) & (ndi_43 <= 0.45) & b3_364 & b1_129)
+
+    return left | right
+
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    @numba.njit(nogil=True, error_model='numpy')
+    def _wrap_integer(value, bits):
+        """
+        Wraps an integer to a signed integer of `bits` bits, like NumPy arithmetic on that dtype.
+        """
+        if bits >= 64:
+            return value
+        value &= (1 << bits) - 1
+        if value >= 1 << (bits - 1):
+            value -= 1 << bits
+        return value
+
+    @numba.njit(nogil=True, error_model='numpy')
+    def _wofs_water_kernel(band1, band2, band3, band4, band5, band7, bits, out):
+        """
+        Fused WOfS kernel: evaluates the regression tree one pixel at a time in a single pass over
+        flat signed integer bands of `bits` bits, without any full-size temporary.
+        """
+        for i in range(band1.shape[0]):
+            b1, b2, b3, b4, b5, b7 = band1[i], band2[i], band3[i], band4[i], band5[i], band7[i]
+            ndi_52 = _wrap_integer(b5 - b2, bits) / _wrap_integer(b5 + b2, bits)
+            ndi_43 = _wrap_integer(b4 - b3, bits) / _wrap_integer(b4 + b3, bits)
+            ndi_72 = _wrap_integer(b7 - b2, bits) / _wrap_integer(b7 + b2, bits)
+
+            water = False
+            if ndi_52 <= -0.01:
+                if b1 <= 2083.5:
+                    if b7 <= 323.5:
+                        water = ndi_43 <= 0.61
+                    elif not b1 <= 1400.5:
+                        water = ndi_43 <= -0.01
+                    elif not ndi_72 <= -0.23:
+                        water = b1 <= 379
+                    else:
+                        water = ndi_43 <= 0.22 or b1 <= 473
+            elif ndi_52 <= 0.23:
+                if b1 <= 334.5 and ndi_43 <= 0.54:
+                    if ndi_52 <= 0.12:
+                        water = True
+                    elif b3 <= 364.5:
+                        water = b1 <= 129.5
+                    else:
+                        water = b1 <= 300.5
+            elif ndi_52 <= 0.34 and b1 <= 249.5 and ndi_43 <= 0.45 and b3 <= 364.5:
+                water = b1 <= 129.5
+            out[i] = water
+
+
+def _wofs_classify_block(band1, band2, band3, band4, band5, band7, block_size=None):
+    """
+    Classifies NumPy arrays of any shape with the WOfS regression tree, `block_size` pixels at a time.
+    Uses the fused numba kernel when numba is installed and the bands share a signed integer dtype
+    (as Landsat surface reflectance does), the NumPy row block implementation otherwise.
+    Suitable for `dask.array.map_blocks`.
+
+    Returns
+    -------
+    classified: numpy.ndarray of uint8
+        0 - not water; 1 - water, with the shape of the bands.
+    """
+    block_size = _wofs_block_size if block_size is None else block_size
+    bands = [np.asarray(band) for band in (band1, band2, band3, band4, band5, band7)]
+    shape = bands[0].shape
+    classified = np.empty(shape, dtype='uint8')
+    if classified.size == 0:
+        return classified
+
+    dtypes = set(band.dtype for band in bands)
+    use_kernel = numba is not None and len(dtypes) == 1 and np.issubdtype(bands[0].dtype, np.signedinteger)
+
+    # Split the flattened pixels into row blocks of at most `block_size` pixels.
+    row_size = shape[-1] if len(shape) > 0 and shape[-1] > 0 else 1
+    rows = [band.reshape(-1, row_size) for band in bands]
+    classified_rows = classified.reshape(-1, row_size)
+    rows_per_block = max(1, block_size // row_size)
+    for start in range(0, classified_rows.shape[0], rows_per_block):
+        block = [band[start:start + rows_per_block] for band in rows]
+        if use_kernel:
+            _wofs_water_kernel(*[np.ascontiguousarray(band).ravel() for band in block],
+                               bits=block[0].dtype.itemsize * 8,
+                               out=classified_rows[start:start + rows_per_block].ravel())
+        else:
+            classified_rows[start:start + rows_per_block] = _wofs_water_numpy(*block)
+    return classified
+
+
+@timed_stage()
 def wofs_classify(dataset_in, clean_mask=None, x_coord='longitude', y_coord='latitude',
                   time_coord='time', no_data=-9999, mosaic=False):
     """
@@ -117,140 +262,15 @@ def wofs_classify(dataset_in, clean_mask=None, x_coord='longitude', y_coord='lat
         ValueError - if dataset_in is an empty xarray.Dataset.
     """
 
-    def _band_ratio(a, b):
-        """
-        Calculates a normalized ratio index
-        """
-        return (a - b) / (a + b)
-
     def _run_regression(band1, band2, band3, band4, band5, band7):
         """
         Regression analysis based on Australia's training data
         TODO: Return type
         """
-
-        # Compute normalized ratio indices
-        ndi_52 = _band_ratio(band5, band2)
-        ndi_43 = _band_ratio(band4, band3)
-        ndi_72 = _band_ratio(band7, band2)
-
-        if isinstance(band1, np.ndarray):
-            classified = np.full_like(band1, no_data, dtype='uint8')
-        elif isinstance(band1, dask.array.core.Array):
-            classified = dask.array.full_like(band1, no_data, dtype='uint8',
-                                    chunks=band1.chunks)
-    
-        # Start with the tree's left branch, finishing nodes as needed
-
-        # Left branch
-        r1 = ndi_52 <= -0.01
-
-        r2 = band1 <= 2083.5
-        classified[r1 & ~r2] = 0  #Node 3
-
-        r3 = band7 <= 323.5
-        _tmp = r1 & r2
-        _tmp2 = _tmp & r3
-        _tmp &= ~r3
-
-        r4 = ndi_43 <= 0.61
-        classified[_tmp2 & r4] = 1  #Node 6
-        classified[_tmp2 & ~r4] = 0  #Node 7
-
-        r5 = band1 <= 1400.5
-        _tmp2 = _tmp & ~r5
-
-        r6 = ndi_43 <= -0.01
-        classified[_tmp2 & r6] = 1  #Node 10
-        classified[_tmp2 & ~r6] = 0  #Node 11
-
-        _tmp &= r5
-
-        r7 = ndi_72 <= -0.23
-        _tmp2 = _tmp & ~r7
-
-        r8 = band1 <= 379
-        classified[_tmp2 & r8] = 1  #Node 14
-        classified[_tmp2 & ~r8] = 0  #Node 15
-
-        _tmp &= r7
-
-        r9 = ndi_43 <= 0.22
-        classified[_tmp & r9] = 1  #Node 17
-        _tmp &= ~r9
-
-        r10 = band1 <= 473
-        classified[_tmp & r10] = 1  #Node 19
-        classified[_tmp & ~r10] = 0  #Node 20
-
-        # Left branch complete; cleanup
-        del r2, r3, r4, r5, r6, r7, r8, r9, r10
-        gc.collect()
-
-        # Right branch of regression tree
-        r1 = ~r1
-
-        r11 = ndi_52 <= 0.23
-        _tmp = r1 & r11
-
-        r12 = band1 <= 334.5
-        _tmp2 = _tmp & ~r12
-        classified[_tmp2] = 0  #Node 23
-
-        _tmp &= r12
-
-        r13 = ndi_43 <= 0.54
-        _tmp2 = _tmp & ~r13
-        classified[_tmp2] = 0  #Node 25
-
-        _tmp &= r13
-
-        r14 = ndi_52 <= 0.12
-        _tmp2 = _tmp & r14
-        classified[_tmp2] = 1  #Node 27
-
-        _tmp &= ~r14
-
-        r15 = band3 <= 364.5
-        _tmp2 = _tmp & r15
-
-        r16 = band1 <= 129.5
-        classified[_tmp2 & r16] = 1  #Node 31
-        classified[_tmp2 & ~r16] = 0  #Node 32
-
-        _tmp &= ~r15
-
-        r17 = band1 <= 300.5
-        _tmp2 = _tmp & ~r17
-        _tmp &= r17
-        classified[_tmp] = 1  #Node 33
-        classified[_tmp2] = 0  #Node 34
-
-        _tmp = r1 & ~r11
-
-        r18 = ndi_52 <= 0.34
-        classified[_tmp & ~r18] = 0  #Node 36
-        _tmp &= r18
-
-        r19 = band1 <= 249.5
-        classified[_tmp & ~r19] = 0  #Node 38
-        _tmp &= r19
-
-        r20 = ndi_43 <= 0.45
-        classified[_tmp & ~r20] = 0  #Node 40
-        _tmp &= r20
-
-        r21 = band3 <= 364.5
-        classified[_tmp & ~r21] = 0  #Node 42
-        _tmp &= r21
-
-        r22 = band1 <= 129.5
-        classified[_tmp & r22] = 1  #Node 44
-        classified[_tmp & ~r22] = 0  #Node 45
-
-        # Completed regression tree
-
-        return classified
+        if isinstance(band1, dask.array.core.Array):
+            return dask.array.map_blocks(_wofs_classify_block, band1, band2, band3, band4, band5, band7,
+                                         dtype='uint8')
+        return _wofs_classify_block(band1, band2, band3, band4, band5, band7)
 
     # Default to masking nothing.
     if clean_mask is None:
@@ -304,6 +324,120 @@ def wofs_classify(dataset_in, clean_mask=None, x_coord='longitude', y_coord='lat
     return dataset_out
 
 
+_wofs_bands = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+
+
+def _wofs_valid_mask(bands, no_data):
+    """
+    Returns the mask of the pixels which hold data (neither `no_data` nor NaN) in every band.
+    """
+    valid = np.ones(bands[0].shape, dtype=bool)
+    for band in bands:
+        valid &= band != no_data
+        if np.issubdtype(band.dtype, np.floating):
+            valid &= ~np.isnan(band)
+    return valid
+
+
+@timed_stage()
+def wofs_summary_counts(dataset_in, clean_mask=None, x_coord='longitude', y_coord='latitude',
+                        time_coord='time', no_data=-9999, time_chunk=16):
+    """
+    Description:
+      Runs WOfS on a dataset `time_chunk` acquisitions at a time and accumulates, per pixel,
+      the number of wet, clear and total observations. Only one time chunk is classified (and
+      loaded, for dask-backed datasets) at once, so memory does not grow with the time range.
+      The counts of different tiles or periods can be combined with `merge_wofs_summary_counts`
+      and turned into water frequencies with `wofs_summary_from_counts`.
+    -----
+    Inputs:
+      dataset_in (xarray.Dataset) - dataset retrieved from the Data Cube; should contain
+        coordinates: time, latitude, longitude
+        variables: blue, green, red, nir, swir1, swir2
+    x_coord, y_coord, time_coord: (str) - Names of DataArrays in `dataset_in` to use as x, y,
+        and time coordinates.
+    Optional Inputs:
+      clean_mask (nd numpy array, dask array or xarray.DataArray with dtype boolean) - true for
+        values user considers clean, with the same (time, y, x) shape as the bands; if user does
+        not provide a clean mask, all values with data will be considered clean
+      no_data (int/float) - no data pixel value; default: -9999
+      time_chunk (int) - number of acquisitions classified at once; default: 16
+    Output:
+      counts (xarray.Dataset) - uint32 variables 'wet_count' (clear water observations),
+        'clear_count' (clear observations) and 'total_count' (observations with data)
+    """
+    n_times = dataset_in.sizes[time_coord]
+    shape = (dataset_in.sizes[y_coord], dataset_in.sizes[x_coord])
+    wet_count = np.zeros(shape, dtype='uint32')
+    clear_count = np.zeros(shape, dtype='uint32')
+    total_count = np.zeros(shape, dtype='uint32')
+
+    for start in range(0, n_times, time_chunk):
+        chunk = dataset_in[_wofs_bands].isel({time_coord: slice(start, start + time_chunk)})
+        bands = [chunk[band].transpose(time_coord, y_coord, x_coord).values for band in _wofs_bands]
+
+        valid = _wofs_valid_mask(bands, no_data)
+        clear = valid if clean_mask is None else valid & np.asarray(clean_mask[start:start + time_chunk], dtype=bool)
+        water = _wofs_classify_block(*bands) == 1
+
+        total_count += valid.sum(axis=0, dtype='uint32')
+        clear_count += clear.sum(axis=0, dtype='uint32')
+        wet_count += (water & clear).sum(axis=0, dtype='uint32')
+
+    coords = {y_coord: dataset_in[y_coord], x_coord: dataset_in[x_coord]}
+    dims = [y_coord, x_coord]
+    return xr.Dataset({'wet_count': (dims, wet_count),
+                       'clear_count': (dims, clear_count),
+                       'total_count': (dims, total_count)}, coords=coords)
+
+
+def merge_wofs_summary_counts(*counts):
+    """
+    Description:
+      Merges partial WOfS counts produced by `wofs_summary_counts`. Counts of the same pixels
+      (e.g. different years of a tile) are added, counts of different pixels (e.g. neighbouring
+      tiles) are placed side by side.
+    -----
+    Inputs:
+      counts (xarray.Dataset) - any number of datasets returned by `wofs_summary_counts`
+        or `merge_wofs_summary_counts`
+    Output:
+      counts (xarray.Dataset) - the merged counts
+    """
+    aligned = xr.align(*counts, join='outer', fill_value=0)
+    return sum(aligned[1:], aligned[0])
+
+
+def wofs_summary_from_counts(counts, z=1.96):
+    """
+    Description:
+      Computes the WOfS summary product from (merged) WOfS counts.
+    -----
+    Inputs:
+      counts (xarray.Dataset) - dataset returned by `wofs_summary_counts` or `merge_wofs_summary_counts`
+    Optional Inputs:
+      z (float) - standard score of the Wilson confidence interval used for 'confidence'; default: 1.96 (95%)
+    Output:
+      dataset_out (xarray.Dataset) - with variables
+        'frequency' - clear water observations / clear observations; NaN where there is no clear observation
+        'confidence' - 1 minus the width of the Wilson score interval of 'frequency': close to 1 when the
+          frequency is backed by many clear observations, 0 where there is no clear observation
+        'wet_count', 'clear_count', 'total_count' - the observation counts
+    """
+    wet = counts.wet_count.astype('float64')
+    clear = counts.clear_count.astype('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequency = wet / clear
+        half_width = z * np.sqrt(frequency * (1 - frequency) / clear + z ** 2 / (4 * clear ** 2)) / (1 + z ** 2 / clear)
+    confidence = (1 - 2 * half_width).where(clear > 0, 0)
+
+    return xr.Dataset({'frequency': frequency.where(clear > 0).astype('float32'),
+                       'confidence': confidence.astype('float32'),
+                       'wet_count': counts.wet_count,
+                       'clear_count': counts.clear_count,
+                       'total_count': counts.total_count})
+
+
 def ledaps_classify(water_band, qa_bands, no_data=-9999):
     #TODO: refactor for input/output datasets
 
@@ -8,9 +8,65 @@ import rasterio
 
 ## Export ##
 
-def export_xarray_to_netcdf(data, path):
+# Default compression level of the NetCDF exports.
+netcdf_complevel = 4
+# Default spatial chunk (NetCDF, Zarr) and tile (GeoTIFF) size of the exports.
+export_block_size = 512
+
+
+def _sanitized_copy(data):
+    """
+    Returns a shallow copy of `data` (the arrays are not copied) whose attributes can be exported.
+
+    If present, the CRS object from the Data Cube is converted to a string.
+    String and numeric attributes are retained. All other attributes are removed.
+    The units of the time coordinate are moved from its attributes to its encoding.
+    `data` itself is not modified.
+    """
+    def sanitize(attrs):
+        sanitized = {}
+        for attr, value in attrs.items():
+            if attr == 'crs' and not isinstance(value, str):
+                sanitized[attr] = str(getattr(value, 'crs_str', value))
+            elif isinstance(value, (str, int, float)):
+                sanitized[attr] = value
+        return sanitized
+
+    data = data.copy(deep=False)
+    data.attrs = sanitize(data.attrs)
+    for variable in data.variables.values():
+        variable.attrs = sanitize(variable.attrs)
+        variable.encoding = dict(variable.encoding)
+    if 'time' in data.coords and 'units' in data.time.attrs:
+        time = data.variables['time']
+        time.encoding['units'] = time.attrs.pop('units')
+    return data
+
+
+def _default_chunks(data_arr):
+    """
+    Returns the chunk sizes to store `data_arr` with: its dask chunks if it has any,
+    otherwise one time slice and spatial blocks of at most `export_block_size`.
+    """
+    if data_arr.chunks is not None:
+        return tuple(chunks[0] for chunks in data_arr.chunks)
+    return tuple(1 if dim == 'time' else min(size, export_block_size)
+                 for dim, size in zip(data_arr.dims, data_arr.shape))
+
+
+def _as_dataset(data):
+    """Converts a DataArray to a Dataset the way `xarray.DataArray.to_netcdf()` does."""
+    if isinstance(data, xr.DataArray):
+        from xarray.backends.api import DATAARRAY_VARIABLE
+        return data.to_dataset(name=DATAARRAY_VARIABLE if data.name is None else data.name)
+    return data
+
+
+def export_xarray_to_netcdf(data, path, encoding=None, zlib=True, complevel=netcdf_complevel):
     """
     Exports an xarray object as a single NetCDF file.
+    Data variables are compressed and chunked by default, and dask arrays are written chunk by chunk
+    without loading everything. `data` is not modified.
 
     Parameters
     ----------
@@ -19,52 +75,67 @@ def export_xarray_to_netcdf(data, path):
     path: str
         The path to store the exported NetCDF file at.
         Must include the filename and ".nc" extension.
+    encoding: dict, optional
+        Per-variable NetCDF encoding (e.g. {'ndvi': {'zlib': True, 'complevel': 9, 'chunksizes': (1, 256, 256)}}),
+        merged over the defaults.
+    zlib: bool
+        Whether to compress the data variables by default.
+    complevel: int
+        The default compression level.
     """
-    # Record original attributes to restore after export.
-    orig_data_attrs = data.attrs.copy()
-    orig_data_var_attrs = {}
-    if isinstance(data, xr.Dataset):
-        for data_var in data.data_vars:
-            orig_data_var_attrs[data_var] = data[data_var].attrs.copy()
-
-    # If present, convert the CRS object from the Data Cube to a string.
-    # String and numeric attributes are retained.
-    # All other attributes are removed.
-    def handle_attr(data, attr):
-        if attr == 'crs' and not isinstance(data.attrs[attr], str):
-            data.attrs[attr] = data.crs.crs_str
-        elif not isinstance(data.attrs[attr], (str, int, float)):
-            del data.attrs[attr]
-
-    # To be able to call `xarray.Dataset.to_netcdf()`, convert the CRS
-    # object from the Data Cube to a string, retain string and numeric
-    # attributes, and remove all other attributes.
-    for attr in data.attrs:
-        handle_attr(data, attr)
-    if isinstance(data, xr.Dataset):
-        for data_var in data.data_vars:
-            for attr in list(data[data_var].attrs):
-                handle_attr(data[data_var], attr)
-    # Move units from the time coord attributes to its encoding.
-    if 'time' in data.coords:
-        orig_time_attrs = data.time.attrs.copy()
-        if 'units' in data.time.attrs:
-            time_units = data.time.attrs['units']
-            del data.time.attrs['units']
-            data.time.encoding['units'] = time_units
+    data = _sanitized_copy(_as_dataset(data))
+    encoding = {} if encoding is None else encoding
+    full_encoding = {}
+    for data_var in data.data_vars:
+        var_encoding = {}
+        if zlib and data[data_var].ndim > 0:
+            var_encoding = dict(zlib=True, complevel=complevel, chunksizes=_default_chunks(data[data_var]))
+        var_encoding.update(encoding.get(data_var, {}))
+        full_encoding[data_var] = var_encoding
+    for name, var_encoding in encoding.items():
+        full_encoding.setdefault(name, var_encoding)
     # Export to NetCDF.
-    data.to_netcdf(path)
-    # Restore original attributes.
-    data.attrs = orig_data_attrs
-    if 'time' in data.coords:
-        data.time.attrs = orig_time_attrs
-    if isinstance(data, xr.Dataset):
+    data.to_netcdf(path, encoding=full_encoding)
+
+
+def export_xarray_to_zarr(data, path, encoding=None, chunks=None, mode='w', append_dim=None):
+    """
+    Exports an xarray object as a Zarr store.
+    Dask arrays are written chunk by chunk without loading everything. `data` is not modified.
+
+    Parameters
+    ----------
+    data: xarray.Dataset or xarray.DataArray
+        The Dataset or DataArray to export.
+    path: str or MutableMapping
+        The path (or store) of the Zarr store.
+    encoding: dict, optional
+        Per-variable Zarr encoding (e.g. a compressor), merged over the default chunking.
+    chunks: dict, optional
+        Chunk sizes per dimension (e.g. {'time': 1, 'latitude': 512, 'longitude': 512}).
+        Dask arrays are rechunked to them. By default, dask chunks are kept and other arrays
+        are stored by time slice and spatial blocks of at most `export_block_size`.
+    mode: str
+        'w' to overwrite an existing store, 'w-' to fail if it exists, 'a' to append.
+    append_dim: str, optional
+        The dimension to append along (e.g. 'time') when adding to an existing store.
+    """
+    data = _sanitized_copy(_as_dataset(data))
+    if chunks is not None:
+        data = data.chunk(chunks)
+    encoding = {} if encoding is None else encoding
+    full_encoding = {}
+    if append_dim is None:
         for data_var in data.data_vars:
-            data[data_var].attrs = orig_data_var_attrs[data_var]
+            var_encoding = dict(chunks=_default_chunks(data[data_var])) if data[data_var].ndim > 0 else {}
+            var_encoding.update(encoding.get(data_var, {}))
+            full_encoding[data_var] = var_encoding
+    data.to_zarr(path, mode=mode, append_dim=append_dim, encoding=full_encoding or None)
 
-def export_slice_to_geotiff(ds, path, x_coord='longitude', y_coord='latitude'):
+
+def export_slice_to_geotiff(ds, path, x_coord='longitude', y_coord='latitude', **kwargs):
     """
-    Exports a single slice of an xarray.Dataset as a GeoTIFF.
+    Exports a single slice of an xarray.Dataset as a GeoTIFF, preserving its dtype.
 
     ds: xarray.Dataset
         The Dataset to export. Must have exactly 2 dimensions - 'latitude' and 'longitude'.
@@ -72,17 +143,21 @@ def export_slice_to_geotiff(ds, path, x_coord='longitude', y_coord='latitude'):
         Names of the x and y coordinates in `ds`.
     path: str
         The path to store the exported GeoTIFF.
+    kwargs:
+        Other arguments of `export_xarray_to_geotiff()` (e.g. `no_data`, `compress`).
     """
-    kwargs = dict(tif_path=path, data=ds.astype(np.float32), bands=list(ds.data_vars.keys()),
+    kwargs = dict(kwargs, data=ds, tif_path=path, bands=list(ds.data_vars.keys()),
                   x_coord=x_coord, y_coord=y_coord)
     if 'crs' in ds.attrs:
         kwargs['crs'] = str(ds.attrs['crs'])
-    dc_utilities.write_geotiff_from_xr(**kwargs)
+    export_xarray_to_geotiff(**kwargs)
 
 
-def export_xarray_to_multiple_geotiffs(ds, path, x_coord='longitude', y_coord='latitude'):
+def export_xarray_to_multiple_geotiffs(ds, path, x_coord='longitude', y_coord='latitude',
+                                       n_workers=None, **kwargs):
     """
     Exports an xarray.Dataset as individual time slices - one GeoTIFF per time slice.
+    The time slices are written in parallel by a pool of `n_workers` threads.
 
     Parameters
     ----------
@@ -94,44 +169,67 @@ def export_xarray_to_multiple_geotiffs(ds, path, x_coord='longitude', y_coord='l
         'mydata_2016_12_05_12_31_36.tif' within the 'geotiffs' folder.
     x_coord, y_coord: string
         Names of the x and y coordinates in `ds`.
+    n_workers: int, optional
+        The number of threads writing GeoTIFFs. Defaults to the number of CPUs.
+    kwargs:
+        Other arguments of `export_xarray_to_geotiff()` (e.g. `no_data`, `compress`).
+
+    Returns
+    -------
+    paths: list of str
+        The paths of the exported GeoTIFFs, in time order.
     """
+    from concurrent.futures import ThreadPoolExecutor
+
     def time_to_string(t):
-        return time.strftime("%Y_%m_%d_%H_%M_%S", time.gmtime(t.astype(int) / 1000000000))
+        return time.strftime("%Y_%m_%d_%H_%M_%S", time.gmtime(t.astype('datetime64[ns]').astype(np.int64) / 1000000000))
 
-    for t_ind, t in enumerate(ds.time):
-        time_slice_xarray = ds.isel(time=t_ind)
-        export_slice_to_geotiff(time_slice_xarray,
-                                path + "_" + time_to_string(t) + ".tif",
-                                x_coord=x_coord, y_coord=y_coord)
+    paths = [path + "_" + time_to_string(t) + ".tif" for t in ds.time.values]
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        exports = [executor.submit(export_slice_to_geotiff, ds.isel(time=t_ind), tif_path,
+                                   x_coord=x_coord, y_coord=y_coord, **kwargs)
+                   for t_ind, tif_path in enumerate(paths)]
+        for export in exports:
+            export.result()
+    return paths
 
 
 def export_xarray_to_geotiff(data, tif_path, bands=None, no_data=-9999, crs="EPSG:4326",
-                             x_coord='longitude', y_coord='latitude'):
+                             x_coord='longitude', y_coord='latitude', compress='deflate',
+                             block_size=export_block_size):
     """
     Export a GeoTIFF from a 2D `xarray.Dataset`.
+    The GeoTIFF is tiled and compressed, and written one row of tiles at a time,
+    so dask arrays are never loaded as a whole.
 
     Parameters
     ----------
     data: xarray.Dataset or xarray.DataArray
         An xarray with 2 dimensions to be exported as a GeoTIFF.
-        If the dtype is `bool`, convert to dtype `numpy.uint8`.
+        The dtype is preserved, except `bool` which is converted to `numpy.uint8`.
     tif_path: string
         The path to write the GeoTIFF file to. You should include the file extension.
     bands: list of string
         The bands to write - in the order they should be written.
         Ignored if `data` is an `xarray.DataArray`.
     no_data: int
-        The nodata value.
+        The nodata value, or None to write no nodata tag. A value that cannot be represented in
+        the integer dtype of the data (e.g. the default -9999 for `numpy.uint8` or `bool` data)
+        is replaced by the maximum of unsigned dtypes and the minimum of signed dtypes.
     crs: string
         The CRS of the output.
     x_coord, y_coord: string
         The string names of the x and y dimensions.
+    compress: string or None
+        The GeoTIFF compression (e.g. 'deflate', 'lzw', 'zstd'). None for no compression.
+    block_size: int
+        The size of the GeoTIFF tiles, a multiple of 16.
     """
+    from rasterio.windows import Window
     from .dc_utilities import _get_transform_from_xr
 
     if isinstance(data, xr.DataArray):
-        height, width = data.sizes[y_coord], data.sizes[x_coord]
-        count, dtype = 1, data.dtype
+        arrays = [data]
     else:
         if bands is None:
             bands = list(data.data_vars.keys())
@@ -139,24 +237,28 @@ def export_xarray_to_geotiff(data, tif_path, bands=None, no_data=-9999, crs="EPS
             assrt_msg_begin = "The `data` parameter is an `xarray.Dataset`. "
             assert isinstance(bands, list), assrt_msg_begin + "Bands must be a list of strings."
             assert len(bands) > 0 and isinstance(bands[0], str), assrt_msg_begin + "You must supply at least one band."
-        height, width = data.dims[y_coord], data.dims[x_coord]
-        count, dtype = len(bands), data[bands[0]].dtype
-    with rasterio.open(
-            tif_path,
-            'w',
-            driver='GTiff',
-            height=height,
-            width=width,
-            count=count,
-            dtype=dtype,
-            crs=crs,
-            transform=_get_transform_from_xr(data, x_coord=x_coord, y_coord=y_coord),
-            nodata=no_data) as dst:
-        if isinstance(data, xr.DataArray):
-            dst.write(data.values, 1)
-        else:
-            for index, band in enumerate(bands):
-                dst.write(data[band].values.astype(dtype), index + 1)
-    dst.close()
+        arrays = [data[band] for band in bands]
+    arrays = [array.transpose(y_coord, x_coord) for array in arrays]
+    height, width = data.sizes[y_coord], data.sizes[x_coord]
+    dtype = np.result_type(*[array.dtype for array in arrays])
+    if dtype == np.bool_:
+        dtype = np.dtype(np.uint8)
+    if no_data is not None and np.issubdtype(dtype, np.integer) and \
+            not np.iinfo(dtype).min <= no_data <= np.iinfo(dtype).max:
+        no_data = np.iinfo(dtype).max if np.issubdtype(dtype, np.unsignedinteger) else np.iinfo(dtype).min
+
+    profile = dict(driver='GTiff', height=height, width=width, count=len(arrays), dtype=dtype,
+                   crs=crs, transform=_get_transform_from_xr(data, x_coord=x_coord, y_coord=y_coord),
+                   nodata=no_data)
+    if height >= block_size and width >= block_size:
+        profile.update(tiled=True, blockxsize=block_size, blockysize=block_size)
+    if compress is not None:
+        profile.update(compress=compress)
+    with rasterio.open(tif_path, 'w', **profile) as dst:
+        for row in range(0, height, block_size):
+            rows = slice(row, min(row + block_size, height))
+            window = Window(0, row, width, rows.stop - row)
+            for index, array in enumerate(arrays):
+                dst.write(np.asarray(array[rows].values, dtype=dtype), index + 1, window=window)
 
 ## End export ##
\ No newline at end of file
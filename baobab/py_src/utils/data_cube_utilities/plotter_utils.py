@@ -62,6 +62,14 @@ def n64_to_epoch(timestamp):
     return epoch
 
 
+def n64_to_epochs(timestamps):
+    """Applies `n64_to_epoch` to an array of NumPy datetime64 objects, converting each distinct day once."""
+    days, inverse = np.unique(np.asarray(timestamps).astype('datetime64[D]'), return_inverse=True)
+    # Midnight local time of each day (datetime.date objects), as in `n64_to_epoch`.
+    epochs = [int(time.mktime(day.timetuple())) for day in days.astype(object)]
+    return np.array(epochs, dtype=np.int64)[inverse.reshape(-1)]
+
+
 def np_dt64_to_str(np_datetime, fmt='%Y-%m-%d'):
     """Converts a NumPy datetime64 object to a string based on a format string supplied to pandas strftime."""
     return pd.to_datetime(str(np_datetime)).strftime(fmt)
@@ -245,10 +253,92 @@ def xarray_plot_ndvi_boxplot_wofs_lineplot_over_time(dataset, resolution=None, c
     plt.show()
 
 
+# Statistics of every time in the tables of `time_series_plot_table`, followed by the percentiles.
+time_series_statistics = ['count', 'min', 'mean', 'median', 'max']
+
+
+def _time_series_percentile_name(percentile):
+    """Returns the name of a percentile in the tables of `time_series_plot_table` (e.g. 'p25')."""
+    return 'p{:g}'.format(percentile)
+
+
+def _time_series_block_statistics(values, percentiles):
+    """
+    Computes the statistics of the pixels of a block of times at once.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Array whose last two axes are the y and x dimensions.
+    percentiles: list of float
+        The percentiles to compute after the statistics of `time_series_statistics`.
+
+    Returns
+    -------
+    statistics: np.ndarray of float64
+        `values` reduced over its last two axes, with a last axis of statistics.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(values.shape[:-2] + (-1,))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN times
+        quantiles = np.nanpercentile(values, [0, 50, 100] + list(percentiles), axis=-1)
+        count = np.count_nonzero(~np.isnan(values), axis=-1)
+        mean = np.nanmean(values, axis=-1)
+    return np.stack([count, quantiles[0], mean, quantiles[1], quantiles[2]] + list(quantiles[3:]), axis=-1)
+
+
+def time_series_plot_table(dataset, data_vars=None, x_coord='longitude', y_coord='latitude',
+                           percentiles=(25, 75)):
+    """
+    Computes the spatial aggregations used by `xarray_time_series_plot()` once, as a small
+    table with one row per time: the count of non-NaN values, the min, mean, median and max,
+    and percentiles (including the 25th and 75th, used for box plots).
+
+    All the statistics of all the data variables are computed in a single pass over `dataset`,
+    one chunk of times at a time for Dask arrays. Pass the table to `xarray_time_series_plot()`
+    to redraw plots (e.g. with different styling) without aggregating `dataset` again.
+
+    Parameters
+    ----------
+    dataset: xarray.Dataset
+        The Dataset to aggregate. It must have a time dimension ('time', 'week' or 'month')
+        and x and y dimensions with names specified by the 'x_coord' and 'y_coord' parameters.
+    data_vars: list-like
+        The names of the data variables to aggregate. Defaults to all of them.
+    x_coord, y_coord: str
+        Names of the x and y coordinates in `dataset`.
+    percentiles: list-like
+        The percentiles to compute, in range [0, 100].
+
+    Returns
+    -------
+    table: xarray.Dataset
+        A Dataset with the data variables of `data_vars`, each having the time dimension of
+        `dataset` and a 'statistic' dimension with coordinates
+        ['count', 'min', 'mean', 'median', 'max', 'p25', 'p75', ...].
+    """
+    data_vars = list(dataset.data_vars) if data_vars is None else list(data_vars)
+    percentiles = sorted(set(percentiles) | {25, 75})
+    statistics = time_series_statistics + [_time_series_percentile_name(percentile) for percentile in percentiles]
+
+    table = {}
+    for data_var in data_vars:
+        data_arr = dataset[data_var]
+        if data_arr.chunks is not None:
+            data_arr = data_arr.chunk({x_coord: -1, y_coord: -1})
+        table[data_var] = xr.apply_ufunc(_time_series_block_statistics, data_arr,
+                                         kwargs=dict(percentiles=percentiles),
+                                         input_core_dims=[[y_coord, x_coord]],
+                                         output_core_dims=[['statistic']],
+                                         dask='parallelized', output_dtypes=[np.float64],
+                                         dask_gufunc_kwargs=dict(output_sizes={'statistic': len(statistics)}))
+    return xr.Dataset(table).assign_coords(statistic=statistics).compute()
+
+
 def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
                             y_coord='latitude', fig_params=None,
                             fig=None, ax=None, show_legend=True, title=None,
-                            max_times_per_plot=None, max_cols=1):
+                            max_times_per_plot=None, max_cols=1, table=None):
     """
     Plot data variables in an xarray.Dataset together in one figure, with different
     plot types for each (e.g. box-and-whisker plot, line plot, scatter plot), and
@@ -271,7 +361,11 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
         Aggregation happens within time slices and can be many-to-many or many-to-one.
         Some plot types require many-to-many aggregation (e.g. 'none'), and some other plot types
         require many-to-one aggregation (e.g. 'mean'). Aggregation types can be any of
-        ['min', 'mean', 'median', 'none', 'max'], with 'none' performing no aggregation.
+        ['min', 'mean', 'median', 'none', 'max'], with 'none' performing no aggregation,
+        or a percentile such as 'p10' (many-to-one).
+        Aggregations are computed once with `time_series_plot_table()`. Box plots use its
+        quartiles, with whiskers 'whis' (default 1.5) times the interquartile range beyond
+        the quartiles, bounded by the min and max.
 
         Plot types can be any of
         ['scatter', 'line', 'box', 'gaussian', 'gaussian_filter', 'poly', 'cubic_spline', 'fourier'].
@@ -323,6 +417,9 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
         of columns being at most `max_cols`.
     max_cols: int
         The maximum number of columns in the plot grid.
+    table: xarray.Dataset
+        The table returned by `time_series_plot_table()` for `dataset`, to reuse its aggregations.
+        It is computed if not supplied.
 
     Returns
     -------
@@ -331,7 +428,8 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
     plotting_data: dict
         A dictionary mapping 3-tuples of data array names, aggregation types, and plot types
         (e.g. ('ndvi', 'none', 'box')) to `xarray.DataArray` objects of the data that was
-        plotted for those combinations of aggregation types and plot types.
+        plotted for those combinations of aggregation types and plot types
+        (the rows of the table for box plots).
 
     Raises
     ------
@@ -369,17 +467,21 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
         if possible_time_agg_str in list(dataset.coords):
             time_agg_str = possible_time_agg_str
             break
-    # Make the data 2D - time and a stack of all other dimensions.
     all_plotting_data_arrs = list(plot_descs.keys())
     all_plotting_data = dataset[all_plotting_data_arrs]
-    all_times = all_plotting_data[time_agg_str].values
+    # Percentile aggregation types (e.g. 'p10') are many-to-one.
+    percentile_agg_types = [agg_type for agg_dict in plot_descs.values() for agg_type in agg_dict
+                            if re.fullmatch(r'p\d+(\.\d+)?', agg_type)]
+    many_to_one_agg_types = many_to_one_agg_types + percentile_agg_types
+    # Aggregate all data variables along the x and y dimensions once, unless a table is supplied.
+    if table is None:
+        table = time_series_plot_table(all_plotting_data, x_coord=x_coord, y_coord=y_coord,
+                                       percentiles=[float(agg_type[1:]) for agg_type in percentile_agg_types])
+    all_times = table[time_agg_str].values
     # Mask out times for which no data variable to plot has any non-NaN data.
-    nan_mask_data_vars = list(all_plotting_data[all_plotting_data_arrs] \
-                              .notnull().data_vars.values())
-    for i, data_var in enumerate(nan_mask_data_vars):
-        time_nan_mask = data_var if i == 0 else time_nan_mask | data_var
-    time_nan_mask = time_nan_mask.any([x_coord, y_coord])
+    time_nan_mask = (table[all_plotting_data_arrs].sel(statistic='count') > 0).to_array().any('variable')
     times_not_all_nan = all_times[time_nan_mask.values]
+    non_nan_table = table[all_plotting_data_arrs].loc[{time_agg_str: times_not_all_nan}]
     non_nan_plotting_data = all_plotting_data.loc[{time_agg_str: times_not_all_nan}]
 
     # Determine the number of extrapolation data points. #
@@ -445,14 +547,13 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
     # Compute all of the plotting data - handling aggregations and extrapolations.
     plotting_data_not_nan_and_extrap = {}  # Maps data arary names to plotting data (NumPy arrays).
     # Get the x locations of data points not filled with NaNs and the x locations of extrapolation points.
-    epochs = np.array(list(map(n64_to_epoch, times_not_all_nan_and_extrap))) \
+    epochs = n64_to_epochs(times_not_all_nan_and_extrap) \
         if time_agg_str == 'time' else times_not_all_nan_and_extrap
     epochs_not_extrap = epochs[:len(times_not_all_nan)]
 
     # Handle aggregations and curve fits. #
     # For each data array to plot...
     for data_arr_name, agg_dict in plot_descs.items():
-        data_arr_plotting_data = non_nan_plotting_data[data_arr_name]
         # For each aggregation type (e.g. 'mean', 'median')...
         for agg_type, plot_dicts in agg_dict.items():
             # For each plot for this aggregation type...
@@ -482,16 +583,16 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
                                              .format(data_arr_name, plot_type, agg_type,
                                                      many_to_many_agg_types))
 
-                    # Aggregate if necessary.
-                    y = data_arr_plotting_data
-                    if agg_type == 'min':
-                        y = y.min([x_coord, y_coord])
-                    if agg_type == 'mean':
-                        y = y.mean([x_coord, y_coord])
-                    if agg_type == 'median':
-                        y = y.median([x_coord, y_coord])
-                    if agg_type == 'max':
-                        y = y.max([x_coord, y_coord])
+                    # Retrieve the aggregations from the table.
+                    # Only scatter plots of non-aggregated data use the data itself.
+                    if agg_type in many_to_one_agg_types:
+                        statistic = agg_type if agg_type in time_series_statistics else \
+                            _time_series_percentile_name(float(agg_type[1:]))
+                        y = non_nan_table[data_arr_name].sel(statistic=statistic, drop=True)
+                    elif plot_type == 'box':
+                        y = non_nan_table[data_arr_name]
+                    else:
+                        y = non_nan_plotting_data[data_arr_name]
 
                     # Handle curve fits.
                     if plot_type in plot_types_curve_fit:
@@ -606,12 +707,12 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
                         num_unique_times_y = len(np.unique(y[time_agg_str].values[not_nat_times]))
                         if num_unique_times_y == 0:  # There is no data.
                             continue
-                        if num_unique_times_y == 1:  # There is 1 data point.
+                        if num_unique_times_y == 1 and plot_type != 'box':  # There is 1 data point.
                             plot_type = 'scatter'
                             plot_kwargs = {}
 
                         data_arr_epochs = \
-                            np.array(list(map(n64_to_epoch, y[time_agg_str].values))) \
+                            n64_to_epochs(y[time_agg_str].values) \
                                 if time_agg_str == 'time' else \
                                 ax_times_not_all_nan_and_extrap
                         data_arr_x_locs = np.interp(data_arr_epochs,
@@ -659,7 +760,7 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
                             data_arr_non_extrap = \
                                 y.sel({time_agg_str: slice(*data_arr_non_extrap_plotting_time_bounds)})
                             data_arr_non_extrap_epochs = \
-                                np.array(list(map(n64_to_epoch, data_arr_non_extrap[time_agg_str].values))) \
+                                n64_to_epochs(data_arr_non_extrap[time_agg_str].values) \
                                     if time_agg_str == 'time' else data_arr_non_extrap[time_agg_str].values
                             data_arr_non_extrap_x_locs = \
                                 np.interp(data_arr_non_extrap_epochs, ax_epochs, ax_x_locs)
@@ -672,7 +773,7 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
                             data_arr_extrap = \
                                 y.sel({time_agg_str: slice(*data_arr_extrap_plotting_time_bounds)})
                             data_arr_extrap_epochs = \
-                                np.array(list(map(n64_to_epoch, data_arr_extrap[time_agg_str].values))) \
+                                n64_to_epochs(data_arr_extrap[time_agg_str].values) \
                                     if time_agg_str == 'time' else data_arr_extrap[time_agg_str].values
                             data_arr_extrap_x_locs = \
                                 np.interp(data_arr_extrap_epochs, ax_epochs, ax_x_locs)
@@ -720,20 +821,26 @@ def xarray_time_series_plot(dataset, plot_descs, x_coord='longitude',
                                                'poly', 'cubic_spline', 'fourier']:
                                 plot_obj = ax.plot(x_locs, data_arr)[0]
                             elif plot_type == 'box':
-                                boxplot_nan_mask = ~np.isnan(data_arr)
-                                # Data formatted for matplotlib.pyplot.boxplot().
-                                filtered_formatted_data = []
-                                for i, (d, m) in enumerate(zip(data_arr.values,
-                                                               boxplot_nan_mask.values)):
-                                    if len(d[m] != 0):
-                                        filtered_formatted_data.append(d[m])
+                                # Box statistics formatted for matplotlib.axes.Axes.bxp()
+                                # from the rows of the table, skipping times without data.
+                                whis = plot_kwargs.pop('whis', 1.5)
+                                box_stats, box_x_locs = [], []
+                                for x_loc, row in zip(x_locs, data_arr.transpose(time_agg_str, 'statistic')):
+                                    row = dict(zip(row['statistic'].values, row.values))
+                                    if row['count'] == 0:
+                                        continue
+                                    iqr = row['p75'] - row['p25']
+                                    box_stats.append(dict(med=row['median'], q1=row['p25'], q3=row['p75'],
+                                                          whislo=max(row['min'], row['p25'] - whis * iqr),
+                                                          whishi=min(row['max'], row['p75'] + whis * iqr),
+                                                          fliers=[]))
+                                    box_x_locs.append(x_loc)
                                 box_width = 0.5 * np.min(np.diff(x_locs)) \
                                     if len(x_locs) > 1 else 0.5
                                 # `manage_ticks=False` to avoid excessive padding on x-axis.
-                                bp = ax.boxplot(filtered_formatted_data,
-                                                widths=[box_width] * len(filtered_formatted_data),
-                                                positions=x_locs, patch_artist=True,
-                                                manage_ticks=False, **plot_kwargs)
+                                bp = ax.bxp(box_stats, widths=[box_width] * len(box_stats),
+                                            positions=box_x_locs, patch_artist=True,
+                                            manage_ticks=False, **plot_kwargs)
                                 plot_obj = bp['boxes'][0]
                             return plot_obj
 
@@ -1748,8 +1855,10 @@ def xarray_imshow(data, x_coord='longitude', y_coord='latitude', width=10,
 
     Parameters
     ----------
-    data: xarray.DataArray
+    data: xarray.DataArray or list of xarray.DataArray
         The xarray.DataArray containing only latitude and longitude coordinates.
+        It can also be the levels of a pyramid (see `aggregate.xr_pyramid()`), in which case
+        the coarsest level with at least as many pixels as the axes is shown.
     x_coord, y_coord: str
         Names of the x and y coordinates in `data` to use as tick and axis labels.
     width: numeric
@@ -1810,6 +1919,10 @@ def xarray_imshow(data, x_coord='longitude', y_coord='latitude', width=10,
         John Rattz (john.c.rattz@ama-inc.com)
     """
     from mpl_toolkits.axes_grid1 import make_axes_locatable
+    from .aggregate import xr_select_pyramid_level
+
+    levels = data if isinstance(data, (list, tuple)) else None
+    data = levels[0] if levels is not None else data
 
     # Figure kwargs
     # Use `copy()` to avoid modifying the original dictionaries.
@@ -1825,6 +1938,8 @@ def xarray_imshow(data, x_coord='longitude', y_coord='latitude', width=10,
 
     fig, ax = retrieve_or_create_fig_ax(fig, ax, **fig_kwargs)
     axsize = get_ax_size(fig, ax)  # Scale fonts on axis size, not figure size.
+    if levels is not None:
+        data = xr_select_pyramid_level(levels, np.array(axsize) * fig.dpi, x_coord, y_coord)
 
     # Axis label kwargs
     x_label_kwargs = {} if x_label_kwargs is None else x_label_kwargs.copy()
@@ -2161,56 +2276,149 @@ def n64_to_month_and_year(n64):
 
 ## DEA Plotting Utils ##
 
+# Number of values sampled from the whole time series to compute the percentile stretch of an animation.
+animation_stretch_sample_size = 2 ** 20
+
+# Number of frames queued per worker process by `animated_timeseries`.
+# Memory use scales with the number of workers rather than with the number of timesteps.
+animation_frames_per_worker = 2
+
+# Per process figure of the animation workers, created once by `_init_animation_worker`.
+_animation_worker_figure = {}
+
+
+def _percentile_stretch(ds, bands, time_dim, x_dim, y_dim, percentile_stretch,
+                        sample_size=animation_stretch_sample_size):
+    """
+    Computes the low and high values of the percentile stretch shared by all the frames of an animation
+    from a sample of at most about `sample_size` values, evenly spread across time and space,
+    so that the time series never has to be loaded at once.
+    """
+    n_times, n_y, n_x = len(ds[time_dim]), len(ds[y_dim]), len(ds[x_dim])
+    frame_size = n_y * n_x * len(bands)
+    n_sample_times = min(n_times, max(64, sample_size // frame_size))
+    times = np.unique(np.linspace(0, n_times - 1, n_sample_times).round().astype(int))
+    stride = max(1, int(np.ceil(np.sqrt(len(times) * frame_size / sample_size))))
+    sample = ds[bands][{time_dim: times, y_dim: slice(None, None, stride), x_dim: slice(None, None, stride)}]
+    sample = np.asarray(sample.to_array().values, dtype=np.float64)
+    return np.nanquantile(sample, percentile_stretch)
+
+
+def _stretch_frame(ds_i, bands, p_low, p_high, image_proc_func=None):
+    """
+    Converts a single timestep of an xarray dataset to a one or three band numpy array for plt.imshow plotting.
+    One band arrays are clipped to the stretch. Three band arrays are rescaled from the stretch to [0, 1].
+    """
+    if len(bands) == 1:
+        return np.clip(np.asarray(ds_i[bands[0]].values, dtype=np.float32), p_low, p_high)
+
+    img_toshow = np.stack([np.asarray(ds_i[band].values, dtype=np.float32) for band in bands], axis=-1)
+    img_toshow = ((img_toshow - p_low) / (p_high - p_low)).clip(0, 1)
+
+    # Optionally image processing
+    if image_proc_func:
+        img_toshow = image_proc_func(img_toshow).clip(0, 1)
+    return img_toshow
+
+
 # Define function to convert xarray dataset to list of one or three band numpy arrays
-def _ds_to_arraylist(ds, bands, time_dim, x_dim, y_dim, percentile_stretch, image_proc_func=None): 
+def _ds_to_arraylist(ds, bands, time_dim, x_dim, y_dim, percentile_stretch, image_proc_func=None):
+    """
+    Converts an xarray dataset to a list of numpy arrays for plt.imshow plotting.
+    Note that `animated_timeseries` converts and renders one frame at a time instead.
+    """
+    p_low, p_high = _percentile_stretch(ds, bands, time_dim, x_dim, y_dim, percentile_stretch)
+    array_list = [_stretch_frame(ds[{time_dim: i}], bands, p_low, p_high, image_proc_func)
+                  for i in range(len(ds[time_dim]))]
+    return array_list, p_low, p_high
+
 
+def _add_colourbar(ax, im, vmin, vmax, cmap='Greys', tick_fontsize=15, tick_colour='black'):
     """
-    Converts an xarray dataset to a list of numpy arrays for plt.imshow plotting
+    Adds a nicely formatted horizontal colourbar along the bottom of an axes.
     """
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
-    # Compute percents
-    p_low, p_high = ds[bands].to_array().quantile(percentile_stretch).values
+    cax = inset_axes(ax, width='97%', height='4%', loc=8, borderpad=1)
+    ax.figure.colorbar(im, cax=cax, orientation='horizontal', ticks=np.linspace(vmin, vmax, 3))
+    cax.xaxis.set_ticks_position('top')
+    cax.tick_params(axis='x', colors=tick_colour, labelsize=tick_fontsize)
 
-    array_list = []
-    for i, timestep in enumerate(ds[time_dim]):
+    # Justify left and right labels to edge of plot
+    cax.get_xticklabels()[0].set_horizontalalignment('left')
+    cax.get_xticklabels()[-1].set_horizontalalignment('right')
 
-        # Select single timestep from the data array
-        ds_i = ds[{time_dim: i}]
 
-        # Get shape of array
-        x = len(ds[x_dim])
-        y = len(ds[y_dim])
+def _init_animation_worker(config):
+    """
+    Creates the figure of an animation worker process once. Frames only update its image and annotation.
+    The figure is not managed by pyplot, so workers do not depend on the interactive backend.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-        if len(bands) == 1:    
+    fig = Figure(figsize=config['figsize'], dpi=config['dpi'])
+    FigureCanvasAgg(fig)
+    ax1 = fig.add_subplot(111)
+    fig.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
+    ax1.axis('off')
 
-            # Create new one band array
-            img_toshow = exposure.rescale_intensity(ds_i[bands[0]].values, 
-                                                    in_range=(p_low, p_high),
-                                                    out_range='image')
+    extents = config['extents']
+    im = ax1.imshow(config['first_image'], extent=extents, **config['onebandplot_kwargs'])
+    t = ax1.annotate('', **config['annotation_kwargs'])
 
-        else:
+    # Optionally add shapefile overlay(s)
+    if config['shapefiles']:
+        import geopandas as gpd
+        for shapefile_path, shapefile_kwargs in config['shapefiles']:
+            gpd.read_file(shapefile_path).plot(**shapefile_kwargs, ax=ax1)
 
-            # Create new three band array                
-            rawimg = np.zeros((y, x, 3), dtype=np.float32)
+    # After adding shapefile, fix extents of plot
+    ax1.set_xlim(extents[0], extents[1])
+    ax1.set_ylim(extents[2], extents[3])
 
-            # Add xarray bands into three dimensional numpy array
-            for band, colour in enumerate(bands):
+    # Optionally add colourbar for one band images
+    if config['colourbar_kwargs'] is not None:
+        _add_colourbar(ax1, im, **config['colourbar_kwargs'])
 
-                rawimg[:, :, band] = ds_i[colour].values
+    _animation_worker_figure.update(fig=fig, im=im, t=t)
 
-            # Stretch contrast using percentile values
-            img_toshow = exposure.rescale_intensity(rawimg, 
-                                                    in_range=(p_low, p_high),
-                                                    out_range=(0, 1.0))
 
-            # Optionally image processing
-            if image_proc_func:
-                
-                img_toshow = image_proc_func(img_toshow).clip(0, 1)
+def _render_animation_frame(image, title_date):
+    """
+    Renders a frame with the figure of the worker process.
 
-        array_list.append(img_toshow)
+    Returns
+    -------
+    frame: np.ndarray
+        The (height, width, 4) uint8 RGBA pixels of the frame.
+    """
+    fig, im, t = (_animation_worker_figure[key] for key in ('fig', 'im', 't'))
+    im.set_array(image)
+    t.set_text(title_date)
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
 
-    return array_list, p_low, p_high
+
+def _animation_writer_command(output_path, frame_shape, fps):
+    """
+    Returns the ffmpeg command encoding raw RGBA frames read from its standard input to `output_path`,
+    or None if the file extension is not supported. GIF palettes are computed per frame, so
+    ffmpeg does not buffer the animation either.
+    """
+    # Video codecs require even frame sizes.
+    even_size = ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+    extension_args = {
+        'mp4': ['-vcodec', 'libx264', '-pix_fmt', 'yuv420p'] + even_size,
+        'wmv': ['-vcodec', 'wmv2', '-b:v', '4000k'] + even_size,
+        'gif': ['-filter_complex', 'split[a][b];[a]palettegen=stats_mode=single[p];[b][p]paletteuse=new=1'],
+    }.get(output_path[-3:])
+    if extension_args is None:
+        return None
+    height, width = frame_shape[:2]
+    return [mpl.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-vcodec', 'rawvideo', '-s', '{}x{}'.format(width, height),
+            '-pix_fmt', 'rgba', '-r', str(fps), '-i', 'pipe:'] + extension_args + [output_path]
 
 def animated_timeseries(ds, output_path, 
                         width_pixels=600, interval=200, bands=['red', 'green', 'blue'], 
@@ -2218,7 +2426,7 @@ def animated_timeseries(ds, output_path,
                         title=False, show_date=True, annotation_kwargs={},
                         onebandplot_cbar=True, onebandplot_kwargs={}, 
                         shapefile_path=None, shapefile_kwargs={},
-                        time_dim = 'time', x_dim = 'x', y_dim = 'y'):
+                        time_dim = 'time', x_dim = 'x', y_dim = 'y', n_workers=None):
     
     """
     NOTE: This function came from DEA's plotting utilities here: https://github.com/GeoscienceAustralia/dea-notebooks/blob/master/10_Scripts/DEAPlotting.py#L211
@@ -2316,6 +2524,12 @@ def animated_timeseries(ds, output_path,
     
     :param y_dim:
         An optional string allowing you to override the xarray dimension used for y coordinates. Defaults to 'y'.
+
+    :param n_workers:
+        An optional integer giving the number of processes rendering frames. Defaults to the number of CPUs.
+        Frames are converted, rendered and streamed to ffmpeg one at a time, so memory use does not depend
+        on the number of timesteps. The percentile stretch is computed once from a sample of the time series.
+        ffmpeg (`matplotlib.rcParams['animation.ffmpeg_path']`) is used for all output formats.
     
     See this webpage for usage information: https://docs.dea.ga.gov.au/notebooks/08_Outputting_data/PlottingAnimatedGifs.html#Plot-entire-time-series-as-a-one-panel-animated-GIF
     
@@ -2331,12 +2545,17 @@ def animated_timeseries(ds, output_path,
         # First test if there are three bands, and that all exist in both datasets:
         if ((len(bands) == 3) | (len(bands) == 1)) & all([(b in ds.data_vars) for b in bands]): 
 
-            # Import xarrays as lists of three band numpy arrays
-            imagelist, vmin, vmax = _ds_to_arraylist(ds, bands=bands, 
-                                                      time_dim=time_dim, x_dim=x_dim, y_dim=y_dim, 
-                                                      percentile_stretch=percentile_stretch,
-                                                      image_proc_func=image_proc_func)
-        
+            import os
+            import calendar
+            import subprocess
+            from collections import deque
+            from concurrent.futures import ProcessPoolExecutor
+            import matplotlib.patheffects as PathEffects
+
+            # Compute the percentile stretch shared by all frames from a sample of the time series
+            vmin, vmax = _percentile_stretch(ds, bands, time_dim=time_dim, x_dim=x_dim, y_dim=y_dim,
+                                             percentile_stretch=percentile_stretch)
+
             # Get time, x and y dimensions of dataset and calculate width vs height of plot
             timesteps = len(ds[time_dim])    
             width = len(ds[x_dim])
@@ -2370,85 +2589,18 @@ def animated_timeseries(ds, output_path,
                                       'fontsize': 28, 'color': 'white', 
                                       'path_effects': [PathEffects.withStroke(linewidth=3, foreground='black')]},
                                       **annotation_kwargs)  
-            
-            ###################
-            # Initialise plot #
-            ################### 
-            
-            # Set up figure
-            fig, ax1 = plt.subplots(ncols=1) 
-            fig.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
-            fig.set_size_inches(10.0, height, forward=True)
-            ax1.axis('off')
-
-            # Initialise axesimage objects to be updated during animation, setting extent from dims
-            extents = [float(ds[x_dim].min()), float(ds[x_dim].max()), 
-                       float(ds[y_dim].min()), float(ds[y_dim].max())]
-            im = ax1.imshow(imagelist[0], extent=extents, **onebandplot_kwargs)
-
-            # Initialise annotation objects to be updated during animation
-            t = ax1.annotate('', **annotation_kwargs) 
-    
 
-            #########################
-            # Add optional overlays #
-            #########################        
-            
-            # Optionally add shapefile overlay(s) from either string path or list of string paths
-            if isinstance(shapefile_path, str):
-                
-                # Define default plotting parameters for the overlaying shapefile(s). The nested dict structure sets 
-                # default values which can be overwritten/customised by the manually specified `shapefile_kwargs`
-                shapefile_kwargs = dict({'linewidth': 2, 'edgecolor': 'black', 'facecolor': "#00000000"}, 
-                                         **shapefile_kwargs)  
-
-                shapefile = gpd.read_file(shapefile_path)
-                shapefile.plot(**shapefile_kwargs, ax=ax1)
-            
-            elif isinstance(shapefile_path, list):
-        
-                # Iterate through list of string paths
-                for i, shapefile in enumerate(shapefile_path):
-                    
-                    if isinstance(shapefile_kwargs, list):
-                        
-                        # If a list of shapefile_kwargs is supplied, use one for each shapefile
-                        shapefile_kwargs_i = dict({'linewidth': 2, 'edgecolor': 'black', 'facecolor': "#00000000"}, 
-                                                   **shapefile_kwargs[i])  
-
-                        shapefile = gpd.read_file(shapefile)
-                        shapefile.plot(**shapefile_kwargs_i, ax=ax1) 
-                    
-                    else:
-                        
-                        # If one shapefile_kwargs is provided, use for all shapefiles
-                        shapefile_kwargs = dict({'linewidth': 2, 'edgecolor': 'black', 'facecolor': "#00000000"}, 
-                                                 **shapefile_kwargs)  
-                        
-                        shapefile = gpd.read_file(shapefile)
-                        shapefile.plot(**shapefile_kwargs, ax=ax1)   
-
-            # After adding shapefile, fix extents of plot
-            ax1.set_xlim(extents[0], extents[1])
-            ax1.set_ylim(extents[2], extents[3])
-            
-            # Optionally add colourbar for one band images
-            if (len(bands) == 1) & onebandplot_cbar:   
-                
-                _add_colourbar(ax1, im, 
-                               tick_fontsize=onebandplot_tick_fontsize,
-                               tick_colour=onebandplot_tick_colour,
-                               vmin=onebandplot_kwargs['vmin'], 
-                               vmax=onebandplot_kwargs['vmax'],
-                               cmap=onebandplot_kwargs['cmap'])
-
-
-            ########################################
-            # Create function to update each frame #
-            ########################################
-
-            # Function to update figure
-            def update_figure(frame_i):            
+            # Optionally add shapefile overlay(s) from either string path or list of string paths.
+            # Define default plotting parameters for the overlaying shapefile(s). The nested dict structure sets 
+            # default values which can be overwritten/customised by the manually specified `shapefile_kwargs`
+            shapefile_paths = [shapefile_path] if isinstance(shapefile_path, str) else (shapefile_path or [])
+            shapefile_kwargs_list = shapefile_kwargs if isinstance(shapefile_kwargs, list) else \
+                                    [shapefile_kwargs] * len(shapefile_paths)
+            shapefiles = [(path, dict({'linewidth': 2, 'edgecolor': 'black', 'facecolor': "#00000000"}, **kwargs))
+                          for path, kwargs in zip(shapefile_paths, shapefile_kwargs_list)]
+
+            # Function to get the annotation of a frame
+            def frame_annotation(frame_i):            
             
                 # If possible, extract dates from time dimension
                 try:
@@ -2467,46 +2619,78 @@ def animated_timeseries(ds, output_path,
                 # Create annotation string based on title and date specifications:
                 title = title_list[frame_i]
                 if title and show_date:
-                    title_date = '{}\n{}'.format(date_string, title)
+                    return '{}\n{}'.format(date_string, title)
                 elif title and not show_date:
-                    title_date = '{}'.format(title)
+                    return '{}'.format(title)
                 elif show_date and not title:
-                    title_date = '{}'.format(date_string)           
+                    return '{}'.format(date_string)           
                 else:
-                    title_date = ''
-
-                # Update figure for frame
-                im.set_array(imagelist[frame_i])
-                t.set_text(title_date) 
-
-                # Return the artists set
-                return [im, t]
+                    return ''
 
+            def frame_image(frame_i):
+                return _stretch_frame(ds[{time_dim: frame_i}], bands, vmin, vmax, image_proc_func)
 
-            ##############################
-            # Generate and run animation #
-            ##############################
+            output_format = output_path[-3:]
+            if output_format not in ('mp4', 'wmv', 'gif'):
+                print('    Output file type must be either .mp4, .wmv or .gif')
+                return
+
+            #########################################
+            # Render frames in a pool of processes #
+            #########################################
+
+            # Every worker creates the figure once, with its overlays, and then only updates the image and
+            # annotation of each frame. Frames are converted, rendered and written to the encoder in order,
+            # with at most `animation_frames_per_worker` frames per worker queued at any time.
+            n_workers = os.cpu_count() if n_workers is None else n_workers
+            first_image = frame_image(0)
+            config = dict(figsize=(10.0, height), dpi=width_pixels / 10.0, first_image=first_image,
+                          extents=[float(ds[x_dim].min()), float(ds[x_dim].max()), 
+                                   float(ds[y_dim].min()), float(ds[y_dim].max())],
+                          onebandplot_kwargs=onebandplot_kwargs, annotation_kwargs=annotation_kwargs,
+                          shapefiles=shapefiles,
+                          colourbar_kwargs=dict(tick_fontsize=onebandplot_tick_fontsize,
+                                                tick_colour=onebandplot_tick_colour,
+                                                vmin=onebandplot_kwargs['vmin'], 
+                                                vmax=onebandplot_kwargs['vmax'],
+                                                cmap=onebandplot_kwargs['cmap'])
+                                            if (len(bands) == 1) & onebandplot_cbar else None)
 
-            # Generate animation
             print('Generating {} frame animation'.format(timesteps))
-            ani = animation.FuncAnimation(fig, update_figure, frames=timesteps, interval=interval, blit=True)
-
-            # Export as either MP4 or GIF
-            if output_path[-3:] == 'mp4':
-                print('    Exporting animation to {}'.format(output_path))
-                ani.save(output_path, dpi=width_pixels / 10.0)
-
-            elif output_path[-3:] == 'wmv':
-                print('    Exporting animation to {}'.format(output_path))
-                ani.save(output_path, dpi=width_pixels / 10.0, 
-                         writer=animation.FFMpegFileWriter(fps=1000 / interval, bitrate=4000, codec='wmv2'))
-
-            elif output_path[-3:] == 'gif':
-                print('    Exporting animation to {}'.format(output_path))
-                ani.save(output_path, dpi=width_pixels / 10.0, writer='imagemagick')
-
-            else:
-                print('    Output file type must be either .mp4, .wmv or .gif')
+            print('    Exporting animation to {}'.format(output_path))
+            encoder = None
+            encoder_failed = False
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_animation_worker,
+                                     initargs=(config,)) as executor:
+                pending = deque()
+                for frame_i in range(timesteps):
+                    image = first_image if frame_i == 0 else frame_image(frame_i)
+                    pending.append(executor.submit(_render_animation_frame, image, frame_annotation(frame_i)))
+                    while pending and (len(pending) >= n_workers * animation_frames_per_worker or
+                                       frame_i == timesteps - 1):
+                        frame = pending.popleft().result()
+                        # Stream the frame straight to the encoder
+                        if encoder is None:
+                            encoder = subprocess.Popen(
+                                _animation_writer_command(output_path, frame.shape, 1000 / interval),
+                                stdin=subprocess.PIPE)
+                        try:
+                            encoder.stdin.write(frame.tobytes())
+                        except BrokenPipeError:
+                            # The encoder exited: stop rendering the remaining frames
+                            encoder_failed = True
+                            break
+                    if encoder_failed:
+                        for future in pending:
+                            future.cancel()
+                        break
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = encoder.wait()
+            if encoder_failed or returncode != 0:
+                raise RuntimeError('ffmpeg failed to encode {} (exit code {})'.format(output_path, returncode))
 
         else:        
             print('Please select either one or three bands that all exist in the input dataset')  
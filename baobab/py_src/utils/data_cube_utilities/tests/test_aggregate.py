@@ -0,0 +1,100 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from utils.data_cube_utilities.aggregate import xr_coarsen_2x, xr_pyramid, write_pyramid_to_zarr, \
+    open_zarr_pyramid
+
+equal = np.testing.assert_array_equal
+close_enough = np.testing.assert_allclose
+
+'''
+The 2x2 block aggregations of xr_coarsen_2x (odd sizes, NumPy and Dask arrays) are compared with the same statistics
+computed block by block, the blocks of the last row and column being truncated.
+'''
+
+
+def _mode(values):
+    # The first of the most frequent values in the order of the block
+    counts = [np.sum(values == value) for value in values]
+    return values[int(np.argmax(counts))]
+
+
+_reference_methods = dict(mean=np.mean, median=np.median, mode=_mode, any=np.any, all=np.all)
+
+
+def _reference(values, method):
+    height, width = (values.shape[0] + 1) // 2, (values.shape[1] + 1) // 2
+    return np.array([[_reference_methods[method](values[2 * y:2 * y + 2, 2 * x:2 * x + 2].ravel())
+                      for x in range(width)] for y in range(height)])
+
+
+@pytest.fixture
+def classes():
+    rng = np.random.default_rng(0)
+    return xr.DataArray(rng.integers(0, 4, (7, 9)).astype(np.uint8), dims=('latitude', 'longitude'),
+                        coords=dict(latitude=47. - 0.01 * np.arange(7), longitude=7. + 0.01 * np.arange(9)))
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('method', ['mean', 'median', 'mode', 'any', 'all'])
+def test_coarsen_2x_matches_blocks(classes, method, lazy):
+    if lazy:
+        pytest.importorskip('dask')
+    data = classes.chunk({'latitude': 3, 'longitude': 4}) if lazy else classes
+    coarsened = xr_coarsen_2x(data, method=method)
+    assert coarsened.sizes == {'latitude': 4, 'longitude': 5}
+    assert (coarsened.chunks is not None) == lazy
+    expected = _reference(classes.values, method)
+    if method == 'mode':
+        assert coarsened.dtype == np.uint8
+        equal(coarsened.values, expected)
+    elif method in ('any', 'all'):
+        assert coarsened.dtype == bool
+        equal(coarsened.values, expected)
+    else:
+        close_enough(coarsened.values, expected)
+    close_enough(coarsened.longitude.values[:-1], _reference(classes.longitude.values[None, :], 'mean')[0, :-1])
+    close_enough(coarsened.longitude.values[-1], classes.longitude.values[-1])
+
+
+def test_coarsen_2x_dataset_methods(classes):
+    dataset = xr.Dataset({'classes': classes, 'ndvi': classes / 4.})
+    coarsened = xr_coarsen_2x(dataset, method={'classes': 'mode'})
+    equal(coarsened.classes.values, _reference(classes.values, 'mode'))
+    close_enough(coarsened.ndvi.values, _reference(classes.values / 4., 'mean'))
+    with pytest.raises(ValueError):
+        xr_coarsen_2x(classes, method='max')
+
+
+def test_pyramid_stopping_rules():
+    data = xr.DataArray(np.zeros((70, 100)), dims=('latitude', 'longitude'))
+    sizes = lambda levels: [level.sizes['longitude'] for level in levels]
+    assert sizes(xr_pyramid(data, min_size=16)) == [100, 50, 25, 13]
+    assert sizes(xr_pyramid(data, min_size=100)) == [100]
+    assert sizes(xr_pyramid(data, num_levels=2, min_size=1000)) == [100, 50]
+    # The coarsest level is a single pixel
+    levels = xr_pyramid(data, num_levels=20)
+    assert sizes(levels) == [100, 50, 25, 13, 7, 4, 2, 1]
+    assert levels[-1].sizes['latitude'] == 1
+
+
+def test_zarr_pyramid_round_trip(classes, tmp_path):
+    pytest.importorskip('zarr')
+    dataset = xr.Dataset({'classes': classes, 'ndvi': classes / 4.})
+    levels = xr_pyramid(dataset, method={'classes': 'mode'}, min_size=2)
+    path = str(tmp_path / 'pyramid.zarr')
+    write_pyramid_to_zarr(levels, path, method={'classes': 'mode'})
+    opened = open_zarr_pyramid(path)
+    assert len(opened) == len(levels) == 4
+    for level, expected in zip(opened, levels):
+        xr.testing.assert_identical(level.load(), expected)
+    # A DataArray pyramid
+    write_pyramid_to_zarr(xr_pyramid(classes.rename('classes'), method='mode', num_levels=2), path)
+    equal(open_zarr_pyramid(path)[1].classes.values, _reference(classes.values, 'mode'))
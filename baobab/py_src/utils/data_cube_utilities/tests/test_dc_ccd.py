@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('ccd')
+from utils.data_cube_utilities import dc_ccd
+
+equal = np.testing.assert_array_equal
+
+'''
+The array driver of process_xarray is compared with the per pixel path it replaced (_run_ccd_on_pixel on every
+1x1xt pixel, models mapped to the nearest acquisitions). ccd.detect is replaced by a deterministic stand-in
+(a model starts wherever the red band jumps), so that the drivers are compared independently of lcmap-pyccd.
+'''
+
+
+class _Model(object):
+    def __init__(self, start_day):
+        self.start_day = start_day
+
+
+def _fake_detect(dates, blue, green, red, nir, swir1, swir2, thermals, qa):
+    red = np.asarray(red, dtype=np.float64)
+    if np.all(np.asarray(qa) == 1):
+        # Stands for the singular matrices of fully masked pixels
+        raise np.linalg.LinAlgError('singular')
+    starts = [0] + [i for i in range(1, len(red)) if abs(red[i] - red[i - 1]) > 1000]
+    return {'change_models': [_Model(int(dates[i])) for i in starts]}
+
+
+@pytest.fixture
+def tile(monkeypatch):
+    monkeypatch.setattr(dc_ccd.ccd, 'detect', _fake_detect)
+    rng = np.random.default_rng(0)
+    n_time, n_lat, n_lon = 24, 3, 4
+    times = pd.date_range('2015-01-01', periods=n_time, freq='16D') + pd.Timedelta(hours=10)
+    red = rng.integers(500, 800, (n_time, n_lat, n_lon)).astype(np.int16)
+    # Pixels with zero, one and several breaks
+    red[8:, 0, 1] += 2000
+    red[5:, 1, 2] += 2000
+    red[15:, 1, 2] -= 2000
+    red[3:, 2, 3] += 1500
+    qa = np.full((n_time, n_lat, n_lon), 66, dtype=np.uint16)
+    qa[:, 2, 0] = 1
+    dims = ('time', 'latitude', 'longitude')
+    ds = xr.Dataset({band: (dims, red + offset) for offset, band in
+                     enumerate(['blue', 'green', 'red', 'nir', 'swir1', 'swir2'])},
+                    coords=dict(time=times.values.astype('datetime64[ns]'),
+                                latitude=47. - 0.001 * np.arange(n_lat),
+                                longitude=7. + 0.001 * np.arange(n_lon)))
+    ds['red'] = (dims, red)
+    ds['pixel_qa'] = (dims, qa)
+    return ds
+
+
+def _per_pixel_reference(ds):
+    """The change matrix, change count and first change of the per pixel path"""
+    n_lat, n_lon = len(ds.latitude), len(ds.longitude)
+    matrix = np.zeros((len(ds.time), n_lat, n_lon))
+    count = np.full((n_lat, n_lon), np.nan)
+    first = np.full((n_lat, n_lon), np.nan)
+    for i in range(n_lat):
+        for j in range(n_lon):
+            pixel = ds.isel(latitude=i, longitude=j)
+            try:
+                results = dc_ccd._run_ccd_on_pixel(pixel)
+            except np.linalg.LinAlgError:
+                continue
+            start_times = [pd.Timestamp.fromordinal(model.start_day) for model in results['change_models']]
+            changed = pixel.sel(time=start_times, method='nearest').time.values
+            indices = np.flatnonzero(np.isin(ds.time.values, changed))
+            matrix[indices, i, j] = 1
+            count[i, j] = len(indices) - 1
+            if len(indices) > 1:
+                first[i, j] = dc_ccd._n64_datetime_to_scalar(ds.time.values[indices[1]])
+    return matrix, count, first
+
+
+def test_change_count_matches_per_pixel(tile):
+    _, count, _ = _per_pixel_reference(tile)
+    equal(count, [[0, 1, 0, 0], [0, 0, 2, 0], [np.nan, 0, 0, 1]])
+    equal(dc_ccd.process_xarray(tile, process='change_count').values, count)
+
+
+def test_first_change_matches_per_pixel(tile):
+    _, _, first = _per_pixel_reference(tile)
+    equal(dc_ccd.process_xarray(tile, process='first').values, first)
+
+
+def test_matrix_matches_per_pixel(tile):
+    matrix, _, _ = _per_pixel_reference(tile)
+    result = dc_ccd.process_xarray(tile, process='matrix')
+    changed_times = matrix.any(axis=(1, 2))
+    equal(result.time.values, tile.time.values[changed_times])
+    equal(np.nan_to_num(result.values), matrix[changed_times])
+
+
+def test_row_blocks_match_single_rows(tile):
+    single = dc_ccd.process_xarray(tile, process='change_count', rows_per_block=1)
+    blocks = dc_ccd.process_xarray(tile, process='change_count', rows_per_block=2)
+    equal(single.values, blocks.values)
+
+
+def test_checkpoints_resume(tile, tmp_path):
+    expected = dc_ccd.process_xarray(tile, process='change_count', checkpoint_dir=str(tmp_path))
+    assert len(os.listdir(str(tmp_path))) == len(tile.latitude)
+    progress = []
+    resumed = dc_ccd.process_xarray(tile, process='change_count', checkpoint_dir=str(tmp_path),
+                                    progress=lambda completed, total: progress.append((completed, total)))
+    equal(resumed.values, expected.values)
+    assert progress[-1] == (len(tile.latitude), len(tile.latitude))
+
+
+def test_checkpoints_of_another_area(tile, tmp_path):
+    dc_ccd.process_xarray(tile, process='change_count', checkpoint_dir=str(tmp_path))
+    moved = tile.assign_coords(longitude=tile.longitude + 1)
+    with pytest.raises(ValueError):
+        dc_ccd.process_xarray(moved, process='change_count', checkpoint_dir=str(tmp_path))
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('datacube')
+pytest.importorskip('gdal')
+optimize = pytest.importorskip('scipy.optimize')
+from utils.data_cube_utilities import dc_fractional_coverage_classifier as fc
+
+close_enough = np.testing.assert_allclose
+
+'''
+The passive set NNLS unmixing of a block of pixels is compared with scipy.optimize.nnls, pixel by pixel,
+as the classifier used it before.
+'''
+
+
+def _scipy_unmix(features):
+    end_members = fc._load_end_members().astype(np.float64)
+    return np.array([optimize.nnls(end_members, pixel.astype(np.float64))[0] for pixel in features.T])
+
+
+def _random_features(n_pixels, seed=0):
+    rng = np.random.default_rng(seed)
+    bands = [rng.integers(1, 6000, n_pixels).astype(np.int16) for _ in range(6)]
+    # Saturated and nodata pixels
+    bands[0][:20] = 16000
+    bands[3][20:40] = -9999
+    features = np.empty((64, n_pixels), dtype=np.float32)
+    fc._frac_coverage_features(bands, features)
+    return features
+
+
+def test_nnls_matches_scipy_on_reflectances():
+    features = _random_features(2000)
+    close_enough(fc._nnls_unmix(features), _scipy_unmix(features), rtol=1e-6, atol=1e-6)
+
+
+def test_nnls_matches_scipy_on_random_features():
+    # Features of any sign, so that every subset of endmembers is the solution of some pixels
+    rng = np.random.default_rng(1)
+    features = rng.normal(0, 1, (64, 2000)).astype(np.float32)
+    end_members = fc._load_end_members()
+    features += end_members @ rng.normal(0, 1, (3, 2000)).astype(np.float32)
+    expected = _scipy_unmix(features)
+    assert len(set(map(tuple, expected > 0))) == 8
+    close_enough(fc._nnls_unmix(features), expected, rtol=1e-6, atol=1e-6)
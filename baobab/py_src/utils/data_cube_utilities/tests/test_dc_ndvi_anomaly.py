@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('gdal')
+pytest.importorskip('rasterio')
+pytest.importorskip('netCDF4')
+from utils.data_cube_utilities.dc_ndvi_anomaly import NdviBaselineStore, _clean_ndvi, compute_ndvi_anomaly, \
+    compute_ndvi_anomaly_from_baseline
+
+equal = np.testing.assert_array_equal
+close_enough = np.testing.assert_allclose
+
+'''
+The baselines of NdviBaselineStore, built from incremental and overlapping updates by blocks of rows, are compared
+with the statistics of all the clear observations computed at once, and the anomalies computed from a baseline with
+those of compute_ndvi_anomaly.
+'''
+
+
+@pytest.fixture
+def baseline_data():
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2017-01-03', '2019-12-31', freq='8D').values.astype('datetime64[ns]')
+    shape = (len(times), 4, 5)
+    dims = ('time', 'latitude', 'longitude')
+    red = rng.integers(100, 2000, shape)
+    nir = rng.integers(100, 4000, shape)
+    red[rng.random(shape) < 0.05] = -9999
+    data = xr.Dataset({'red': (dims, red), 'nir': (dims, nir)},
+                      coords=dict(time=times, latitude=47. - 0.01 * np.arange(4), longitude=7. + 0.01 * np.arange(5)))
+    clear = xr.DataArray(rng.random(shape) < 0.7, dims=dims, coords=data.coords)
+    clear[:, 0, 0] = False
+    return data, clear
+
+
+def _expected(data, clear, season):
+    ndvi = _clean_ndvi(data, clear)
+    grouped = ndvi.groupby('time.' + season)
+    return xr.Dataset({'median': grouped.median('time'), 'mean': grouped.mean('time'),
+                       'std': grouped.std('time'), 'count': grouped.count('time')}).rename({season: 'season'})
+
+
+@pytest.mark.parametrize('season', ['month', 'season'])
+def test_baseline_matches_one_shot(baseline_data, tmp_path, season):
+    data, clear = baseline_data
+    store = NdviBaselineStore(str(tmp_path), block_rows=3)
+    assert store.update(data, clear, aoi='aoi', product='ls8') == [2017, 2018, 2019]
+    baseline = store.baseline('aoi', 'ls8', season=season)
+    expected = _expected(data, clear, season)
+    equal(baseline.season.values, expected.season.values)
+    equal(baseline['count'].values, expected['count'].values)
+    # The observations are stored as float32
+    for name in ['median', 'mean', 'std']:
+        close_enough(baseline[name].values, expected[name].values, rtol=1e-6, atol=1e-7, err_msg=name)
+    assert np.isnan(baseline['median'].values[expected['count'].values == 0]).all()
+
+
+def test_incremental_updates_match_single_update(baseline_data, tmp_path):
+    data, clear = baseline_data
+    store = NdviBaselineStore(str(tmp_path / 'once'))
+    store.update(data, clear, aoi='aoi', product='ls8')
+    expected = store.baseline('aoi', 'ls8', years=[2017, 2018], season=None)
+
+    incremental = NdviBaselineStore(str(tmp_path / 'incremental'))
+    half = len(data.time) // 2
+    incremental.update(data.isel(time=slice(None, half)), clear.isel(time=slice(None, half)), aoi='aoi', product='ls8')
+    cached = incremental.baseline('aoi', 'ls8', years=[2017, 2018], season=None)
+    # Overlapping load: the first scenes are skipped, the new scenes of the current year are added.
+    overlap = slice(half - 10, None)
+    assert incremental.update(data.isel(time=overlap), clear.isel(time=overlap), aoi='aoi', product='ls8') == [2018, 2019]
+    assert incremental.update(data, clear, aoi='aoi', product='ls8') == []
+    updated = incremental.baseline('aoi', 'ls8', years=[2017, 2018], season=None)
+
+    assert int(cached['count'].sum()) < int(expected['count'].sum())
+    xr.testing.assert_identical(updated, expected)
+
+
+def test_anomaly_from_baseline_matches_compute_ndvi_anomaly(baseline_data, tmp_path):
+    data, clear = baseline_data
+    rng = np.random.default_rng(1)
+    shape = data.red.shape[1:]
+    scene = xr.Dataset({band: (('latitude', 'longitude'), rng.integers(100, 4000, shape))
+                        for band in ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']},
+                       coords=dict(latitude=data.latitude, longitude=data.longitude))
+    scene_clear = rng.random(shape) < 0.8
+
+    store = NdviBaselineStore(str(tmp_path))
+    store.update(data, clear, aoi='aoi', product='ls8')
+    from_baseline = compute_ndvi_anomaly_from_baseline(store.baseline('aoi', 'ls8', season=None), scene,
+                                                       selected_scene_clear_mask=scene_clear)
+    expected = compute_ndvi_anomaly(data, scene, baseline_clear_mask=clear, selected_scene_clear_mask=scene_clear)
+    for name in expected.data_vars:
+        close_enough(from_baseline[name].values, expected[name].values, rtol=1e-6, atol=1e-6, err_msg=name)
+
+
+def test_reading_does_not_create_directories(tmp_path):
+    store = NdviBaselineStore(str(tmp_path / 'store'))
+    assert store.years('aoi', 'ls8') == []
+    with pytest.raises(ValueError):
+        store.baseline('aoi', 'ls8')
+    assert not os.path.exists(str(tmp_path / 'store'))
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('pandas')
+from utils.data_cube_utilities import dc_timing
+from utils.data_cube_utilities.dc_timing import timed_stage, enable_stage_timing, disable_stage_timing, \
+    stage_records, read_stage_log, stage_summary
+
+'''
+The records of nested stages (context managers and decorators) are checked in memory and in the JSON lines log,
+and summarized with stage_summary.
+'''
+
+
+@pytest.fixture(autouse=True)
+def timing():
+    yield
+    disable_stage_timing()
+    dc_timing._timing['records'] = []
+
+
+@timed_stage('classify', product='ls8')
+def _classify(values):
+    return values > 0
+
+
+def _analysis():
+    with timed_stage('load') as load:
+        values = load.add_bytes(np.ones(1000))
+        load.add_bytes(24)
+    with timed_stage('process'):
+        for _ in range(2):
+            _classify(values)
+        with timed_stage('mosaic') as mosaic:
+            mosaic.add_bytes([values, values])
+
+
+def test_nested_stages(tmp_path):
+    path = str(tmp_path / 'stages.jsonl')
+    enable_stage_timing(path, reset=True)
+    _analysis()
+    records = stage_records()
+    # Records are written as the stages end
+    assert [(record['stage'], record['parent'], record['depth']) for record in records] == \
+        [('load', None, 0), ('classify', 'process', 1), ('classify', 'process', 1), ('mosaic', 'process', 1),
+         ('process', None, 0)]
+    assert [record['bytes'] for record in records] == [8024, 1000, 1000, 16000, 0]
+    assert records[1]['product'] == 'ls8'
+    assert len(set(record['run'] for record in records)) == 1
+    assert all(record['pid'] == os.getpid() and 'error' not in record for record in records)
+    assert records[-1]['wall_s'] >= sum(record['wall_s'] for record in records[1:4])
+
+    # The log has the same records (the times as strings)
+    assert read_stage_log(path) == records
+
+    summary = stage_summary()
+    assert summary.index.tolist() == ['load', 'classify', 'mosaic', 'process']
+    assert summary.calls.tolist() == [1, 2, 1, 1]
+    assert summary.loc['classify', 'mb'] == 2000 / 2 ** 20
+    assert summary.loc['classify', 'wall_s'] == pytest.approx(records[1]['wall_s'] + records[2]['wall_s'])
+
+
+def test_runs_and_errors(tmp_path):
+    path = str(tmp_path / 'stages.jsonl')
+    enable_stage_timing(path)
+    _analysis()
+    first_run = stage_records()
+    enable_stage_timing(path)
+    with pytest.raises(ZeroDivisionError):
+        with timed_stage('process'):
+            with timed_stage('divide'):
+                1 / 0
+    records = stage_records()
+    assert [(record['stage'], record['parent'], record['error']) for record in records] == \
+        [('divide', 'process', 'ZeroDivisionError'), ('process', None, 'ZeroDivisionError')]
+    # The stack is empty again after the error
+    with timed_stage('load'):
+        pass
+    assert stage_records()[-1]['parent'] is None
+
+    # The log keeps both runs; the summary is of the last one unless a run is given
+    log = read_stage_log(path)
+    assert log == first_run + stage_records()
+    assert stage_summary(log).index.tolist() == ['divide', 'process', 'load']
+    assert stage_summary(log, run=first_run[0]['run']).calls.sum() == 5
+    # reset empties the log
+    enable_stage_timing(path, reset=True)
+    assert read_stage_log(path) == []
+
+
+def test_disabled_stages_leave_no_records(tmp_path):
+    path = str(tmp_path / 'stages.jsonl')
+    enable_stage_timing(path)
+    disable_stage_timing()
+    _analysis()
+    with timed_stage('load') as stage:
+        assert stage.add_bytes(np.ones(10)).size == 10
+    assert stage.bytes == 0
+    assert stage_records() == []
+    assert not os.path.exists(path)
+    assert stage_summary().empty
+    assert _classify(np.ones(3)).all()
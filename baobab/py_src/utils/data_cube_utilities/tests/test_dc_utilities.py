@@ -0,0 +1,94 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('gdal')
+pytest.importorskip('rasterio')
+from utils.data_cube_utilities.dc_utilities import TimeseriesAccumulator, perform_timeseries_analysis
+
+equal = np.testing.assert_array_equal
+close_enough = np.testing.assert_allclose
+
+'''
+The statistics streamed through TimeseriesAccumulator (updates by time chunks and merges of accumulators)
+are compared with the same statistics computed at once over the whole timeseries.
+'''
+
+
+@pytest.fixture
+def ndvi():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-1, 1, (40, 5, 6))
+    values[rng.random(values.shape) < 0.3] = -9999
+    values[:, 0, 0] = -9999
+    values[:-1, 0, 1] = np.nan
+    return xr.DataArray(values, dims=('time', 'latitude', 'longitude'),
+                        coords=dict(latitude=np.arange(5.), longitude=np.arange(6.)))
+
+
+def _one_shot(ndvi):
+    data = ndvi.where(ndvi != -9999)
+    return dict(count=data.notnull().sum('time').values, sum=data.sum('time').values,
+                mean=data.mean('time').values, variance=data.var('time').values,
+                min=data.min('time').values, max=data.max('time').values)
+
+
+def _check(stats, ndvi):
+    for name, expected in _one_shot(ndvi).items():
+        close_enough(stats[name].values, expected, rtol=1e-12, atol=1e-12, err_msg=name)
+
+
+def test_update_by_chunks_matches_one_shot(ndvi):
+    accumulator = TimeseriesAccumulator()
+    for start in range(0, 40, 7):
+        accumulator.update(ndvi.isel(time=slice(start, start + 7)))
+    stats = accumulator.finalize()
+    _check(stats, ndvi)
+    assert accumulator.histogram is None
+
+
+def test_merge_matches_one_shot(ndvi):
+    accumulators = [TimeseriesAccumulator(histogram_range=(-1, 1), bins=50).update(ndvi.isel(time=slice(start, start + 13)))
+                    for start in range(0, 40, 13)]
+    merged = TimeseriesAccumulator(histogram_range=(-1, 1), bins=50)
+    for accumulator in accumulators:
+        merged.merge(accumulator)
+    _check(merged.finalize(), ndvi)
+    whole = TimeseriesAccumulator(histogram_range=(-1, 1), bins=50).update(ndvi)
+    assert merged.histogram.dtype == np.uint32
+    equal(merged.histogram, whole.histogram)
+    equal(merged.histogram.sum(axis=-1), whole.count)
+
+
+def test_percentiles_within_a_bin(ndvi):
+    accumulator = TimeseriesAccumulator(histogram_range=(-1, 1), bins=200).update(ndvi)
+    median = accumulator.finalize(percentiles=[50])['percentiles'].sel(percentile=50).values
+    data = ndvi.where(ndvi != -9999).values
+    count = np.isfinite(data).sum(axis=0)
+    width = 2 / 200
+    # Half of the observations lie below the median, give or take the observations of its bin
+    assert np.all((data < median - width).sum(axis=0)[count > 0] <= count[count > 0] / 2)
+    assert np.all((data <= median + width).sum(axis=0)[count > 0] >= count[count > 0] / 2)
+    assert np.isnan(median[count == 0]).all()
+    # Computed by blocks of pixels
+    equal(accumulator._percentiles([10, 50, 90], block_size=7), accumulator._percentiles([10, 50, 90]))
+    with pytest.raises(ValueError):
+        TimeseriesAccumulator().update(ndvi).finalize(percentiles=[50])
+
+
+def test_timeseries_analysis_matches_one_shot(ndvi):
+    dataset = ndvi.to_dataset(name='ndvi')
+    product = perform_timeseries_analysis(dataset.isel(time=slice(0, 25)), 'ndvi')
+    product = perform_timeseries_analysis(dataset.isel(time=slice(25, None)), 'ndvi', intermediate_product=product)
+    expected = _one_shot(ndvi)
+    equal(product.total_clean.values, expected['count'])
+    close_enough(product.total_data.values, expected['sum'], rtol=1e-12)
+    close_enough(product.normalized_data.values, expected['mean'], rtol=1e-12)
+    close_enough(product['min'].values, expected['min'])
+    close_enough(product['max'].values, expected['max'])
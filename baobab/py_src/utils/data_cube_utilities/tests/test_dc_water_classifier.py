@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('datacube')
+pytest.importorskip('gdal')
+from utils.data_cube_utilities import dc_water_classifier as wc
+
+equal = np.testing.assert_array_equal
+
+'''
+The fused numba kernel and the NumPy implementation of the WOfS regression tree are compared with the
+original node by node implementation of wofs_classify (below, unchanged but for the output initialization:
+every pixel reaches a leaf, so the initial value is never kept).
+'''
+
+
+def _band_ratio(a, b):
+    return (a - b) / (a + b)
+
+
+def _original_regression(band1, band2, band3, band4, band5, band7):
+    ndi_52 = _band_ratio(band5, band2)
+    ndi_43 = _band_ratio(band4, band3)
+    ndi_72 = _band_ratio(band7, band2)
+
+    classified = np.zeros(band1.shape, dtype='uint8')
+
+    # Left branch
+    r1 = ndi_52 <= -0.01
+    r2 = band1 <= 2083.5
+    classified[r1 & ~r2] = 0  #Node 3
+    r3 = band7 <= 323.5
+    _tmp = r1 & r2
+    _tmp2 = _tmp & r3
+    _tmp &= ~r3
+    r4 = ndi_43 <= 0.61
+    classified[_tmp2 & r4] = 1  #Node 6
+    classified[_tmp2 & ~r4] = 0  #Node 7
+    r5 = band1 <= 1400.5
+    _tmp2 = _tmp & ~r5
+    r6 = ndi_43 <= -0.01
+    classified[_tmp2 & r6] = 1  #Node 10
+    classified[_tmp2 & ~r6] = 0  #Node 11
+    _tmp &= r5
+    r7 = ndi_72 <= -0.23
+    _tmp2 = _tmp & ~r7
+    r8 = band1 <= 379
+    classified[_tmp2 & r8] = 1  #Node 14
+    classified[_tmp2 & ~r8] = 0  #Node 15
+    _tmp &= r7
+    r9 = ndi_43 <= 0.22
+    classified[_tmp & r9] = 1  #Node 17
+    _tmp &= ~r9
+    r10 = band1 <= 473
+    classified[_tmp & r10] = 1  #Node 19
+    classified[_tmp & ~r10] = 0  #Node 20
+
+    # Right branch
+    r1 = ~r1
+    r11 = ndi_52 <= 0.23
+    _tmp = r1 & r11
+    r12 = band1 <= 334.5
+    _tmp2 = _tmp & ~r12
+    classified[_tmp2] = 0  #Node 23
+    _tmp &= r12
+    r13 = ndi_43 <= 0.54
+    _tmp2 = _tmp & ~r13
+    classified[_tmp2] = 0  #Node 25
+    _tmp &= r13
+    r14 = ndi_52 <= 0.12
+    _tmp2 = _tmp & r14
+    classified[_tmp2] = 1  #Node 27
+    _tmp &= ~r14
+    r15 = band3 <= 364.5
+    _tmp2 = _tmp & r15
+    r16 = band1 <= 129.5
+    classified[_tmp2 & r16] = 1  #Node 31
+    classified[_tmp2 & ~r16] = 0  #Node 32
+    _tmp &= ~r15
+    r17 = band1 <= 300.5
+    _tmp2 = _tmp & ~r17
+    _tmp &= r17
+    classified[_tmp] = 1  #Node 33
+    classified[_tmp2] = 0  #Node 34
+    _tmp = r1 & ~r11
+    r18 = ndi_52 <= 0.34
+    classified[_tmp & ~r18] = 0  #Node 36
+    _tmp &= r18
+    r19 = band1 <= 249.5
+    classified[_tmp & ~r19] = 0  #Node 38
+    _tmp &= r19
+    r20 = ndi_43 <= 0.45
+    classified[_tmp & ~r20] = 0  #Node 40
+    _tmp &= r20
+    r21 = band3 <= 364.5
+    classified[_tmp & ~r21] = 0  #Node 42
+    _tmp &= r21
+    r22 = band1 <= 129.5
+    classified[_tmp & r22] = 1  #Node 44
+    classified[_tmp & ~r22] = 0  #Node 45
+    return classified
+
+
+def _random_bands(dtype, shape=(7, 53, 61), seed=0):
+    """Random reflectances around the thresholds of the tree, with nodata, zeros and saturated values"""
+    rng = np.random.default_rng(seed)
+    bands = []
+    for high in (2500, 2500, 2500, 4000, 3000, 1500):
+        band = rng.integers(-100, high, shape).astype(dtype)
+        band[rng.random(shape) < 0.05] = -9999
+        band[rng.random(shape) < 0.02] = 0
+        band[rng.random(shape) < 0.01] = 16000
+        bands.append(band)
+    # Pixels of water like spectra, so that every leaf is reached
+    water = rng.random(shape) < 0.3
+    for band, value in zip(bands, (100, 200, 150, 80, 40, 20)):
+        band[water] = value + rng.integers(-60, 60, water.sum())
+    return bands
+
+
+def _with_nan(bands, seed=1):
+    rng = np.random.default_rng(seed)
+    bands = [band.astype(np.float64) for band in bands]
+    for band in bands:
+        band[rng.random(band.shape) < 0.05] = np.nan
+    return bands
+
+
+def test_reference_reaches_both_classes():
+    classified = _original_regression(*_random_bands(np.int16))
+    assert 0.05 < classified.mean() < 0.95
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.int32, np.float32, np.float64])
+def test_numpy_matches_original(dtype):
+    bands = _random_bands(dtype)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        equal(wc._wofs_water_numpy(*bands).astype('uint8'), _original_regression(*bands))
+
+
+def test_numpy_with_nan_matches_original():
+    bands = _with_nan(_random_bands(np.float64))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        equal(wc._wofs_water_numpy(*bands).astype('uint8'), _original_regression(*bands))
+        equal(wc._wofs_classify_block(*bands), _original_regression(*bands))
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.int32, np.int64])
+def test_kernel_matches_original(dtype):
+    if wc.numba is None:
+        pytest.skip('numba is not installed')
+    bands = _random_bands(dtype)
+    out = np.empty(bands[0].size, dtype='uint8')
+    wc._wofs_water_kernel(*[band.ravel() for band in bands], bits=np.dtype(dtype).itemsize * 8, out=out)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        expected = _original_regression(*bands)
+    equal(out.reshape(bands[0].shape), expected)
+
+
+def test_int16_overflow_matches_original():
+    # int16 sums of saturated values wrap around in the original implementation
+    bands = [np.array([16000, 30000, -9999, 20000], dtype=np.int16) for _ in range(6)]
+    bands[1] = np.array([20000, 30000, -9999, -20000], dtype=np.int16)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        expected = _original_regression(*bands)
+    equal(wc._wofs_classify_block(*bands), expected)
+    equal(wc._wofs_classify_block(*bands, block_size=1), expected)
+
+
+def test_blocks_match_single_block():
+    bands = _random_bands(np.int16)
+    equal(wc._wofs_classify_block(*bands, block_size=100), wc._wofs_classify_block(*bands))
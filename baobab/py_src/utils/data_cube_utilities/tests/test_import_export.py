@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('gdal')
+pytest.importorskip('datacube')
+rasterio = pytest.importorskip('rasterio')
+from utils.data_cube_utilities.import_export import export_xarray_to_geotiff, export_xarray_to_multiple_geotiffs
+
+equal = np.testing.assert_array_equal
+
+'''
+The GeoTIFFs exported with the default arguments are read back with rasterio and compared with the source arrays,
+dtype and nodata value included.
+'''
+
+
+def _dataset(dtype, n_time=None):
+    rng = np.random.default_rng(0)
+    shape = (37, 45) if n_time is None else (n_time, 37, 45)
+    dims = ('latitude', 'longitude') if n_time is None else ('time', 'latitude', 'longitude')
+    coords = dict(latitude=46.5 - 0.001 * np.arange(37), longitude=7. + 0.001 * np.arange(45))
+    if n_time is not None:
+        coords['time'] = pd.date_range('2020-01-01', periods=n_time, freq='5D').values
+    return xr.Dataset({'wofs': (dims, rng.integers(0, 2, shape).astype(dtype)),
+                       'clean': (dims, rng.integers(0, 2, shape).astype(dtype))}, coords=coords)
+
+
+@pytest.mark.parametrize('dtype, no_data', [(np.uint8, 255), (np.bool_, 255), (np.int8, -128), (np.int16, -9999)])
+def test_default_no_data_fits_the_dtype(tmp_path, dtype, no_data):
+    data = _dataset(dtype)
+    path = str(tmp_path / 'wofs.tif')
+    export_xarray_to_geotiff(data, path, block_size=16)
+    with rasterio.open(path) as src:
+        assert src.dtypes == (np.dtype(dtype if dtype != np.bool_ else np.uint8).name,) * 2
+        assert src.nodata == no_data
+        equal(src.read(1), data.wofs.values)
+        equal(src.read(2), data.clean.values)
+
+
+def test_multiple_uint8_geotiffs(tmp_path):
+    data = _dataset(np.uint8, n_time=3)
+    paths = export_xarray_to_multiple_geotiffs(data, str(tmp_path / 'wofs'))
+    assert len(paths) == 3
+    for t_ind, path in enumerate(paths):
+        with rasterio.open(path) as src:
+            assert src.nodata == 255
+            equal(src.read(1), data.wofs.values[t_ind])
@@ -0,0 +1,94 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+stats = pytest.importorskip('scipy.stats')
+mk = pytest.importorskip('pymannkendall')
+from utils.data_cube_utilities.trend import trends
+
+close_enough = np.testing.assert_allclose
+
+'''
+The block implementation of `trends` is compared pixel by pixel with pymannkendall (Mann-Kendall S, Z and p-value)
+and scipy (Theil-Sen slope, Kendall's tau-b and least squares slope), on series with nan gaps and ties.
+'''
+
+
+@pytest.fixture
+def cube():
+    rng = np.random.default_rng(0)
+    n_time, n_lat, n_lon = 30, 6, 7
+    # Rounded values: many ties
+    values = np.round(rng.normal(0, 1, (n_time, n_lat, n_lon)) + 0.05 * np.arange(n_time)[:, None, None], 1)
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:, 0, 0] = np.nan
+    values[:-1, 0, 1] = np.nan
+    values[:, 0, 2] = 1.
+    values[::2, 0, 3] = 3.
+    return xr.DataArray(values, dims=('time', 'latitude', 'longitude'))
+
+
+def _reference(y, x):
+    valid = np.isfinite(y)
+    y, x = y[valid], x[valid]
+    if len(y) < 2:
+        return dict(count=len(y))
+    result = mk.original_test(y)
+    constant = np.all(y == y[0])
+    return dict(count=len(y),
+                ols_slope=stats.linregress(x, y).slope,
+                sen_slope=stats.theilslopes(y, x)[0],
+                mk_s=result.s,
+                mk_z=result.z,
+                mk_p=result.p,
+                kendall_tau=np.nan if constant else stats.kendalltau(x, y).statistic)
+
+
+@pytest.mark.parametrize('irregular', [False, True])
+def test_trends_match_references(cube, irregular):
+    x = np.arange(cube.sizes['time'], dtype=np.float64)
+    if irregular:
+        x = np.cumsum(np.random.default_rng(1).integers(1, 30, len(x))).astype(np.float64)
+    result = trends(cube, x=None if not irregular else x)
+    for i in range(cube.sizes['latitude']):
+        for j in range(cube.sizes['longitude']):
+            expected = _reference(cube.values[:, i, j], x)
+            assert int(result['count'][i, j]) == expected.pop('count')
+            for name, value in expected.items():
+                close_enough(float(result[name][i, j]), value, rtol=1e-10, atol=1e-12, err_msg=name)
+            if int(result['count'][i, j]) < 2:
+                assert np.isnan(float(result.sen_slope[i, j]))
+
+
+def test_trends_with_tied_x_match_scipy(cube):
+    from scipy.special import ndtr
+
+    # Monthly data against the year: groups of 12 tied positions
+    x = np.repeat(np.arange(2000, 2003), 12)[:cube.sizes['time']].astype(np.float64)
+    cube = cube.isel(time=slice(0, len(x)))
+    result = trends(cube, x=x)
+    for i in range(cube.sizes['latitude']):
+        for j in range(cube.sizes['longitude']):
+            y = cube.values[:, i, j]
+            valid = np.isfinite(y)
+            if valid.sum() < 2 or np.all(y[valid] == y[valid][0]) or len(np.unique(x[valid])) < 2:
+                continue
+            expected = stats.kendalltau(x[valid], y[valid], method='asymptotic')
+            close_enough(float(result.sen_slope[i, j]), stats.theilslopes(y[valid], x[valid])[0], rtol=1e-10)
+            close_enough(float(result.kendall_tau[i, j]), expected.statistic, rtol=1e-10)
+            # scipy's p-value has no continuity correction: S / sqrt(var(S)) with the same tie corrected variance
+            s, z = float(result.mk_s[i, j]), float(result.mk_z[i, j])
+            if abs(s) > 1:
+                close_enough(2 * ndtr(-abs(s) * abs(z) / (abs(s) - 1)), expected.pvalue, rtol=1e-8)
+
+
+def test_trends_dask_matches_numpy(cube):
+    pytest.importorskip('dask')
+    lazy = trends(cube.chunk({'latitude': 2, 'longitude': 3}))
+    xr.testing.assert_allclose(lazy.compute(), trends(cube))
@@ -0,0 +1,80 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+pytest.importorskip('datacube')
+pytest.importorskip('sklearn')
+from sklearn.svm import LinearSVC
+from sklearn.metrics import f1_score, precision_score, recall_score
+from utils.data_cube_utilities import wasard
+
+equal = np.testing.assert_array_equal
+close_enough = np.testing.assert_allclose
+
+'''
+The pixels of a SAR scene with a NaN band are labelled no_data by wasard_classify; the water frequency and the
+scores are compared with the same statistics computed on the pixels with data only.
+'''
+
+
+@pytest.fixture
+def classified():
+    rng = np.random.default_rng(0)
+    # Water is dark in both bands
+    features = rng.normal(0, 1, (400, 2))
+    labels = (features.sum(1) < 0).astype(int)
+    classifier = wasard.wasard_classifier(classifier=LinearSVC().fit(features, labels))
+
+    shape = (4, 20, 30)
+    dims = ('time', 'latitude', 'longitude')
+    vh = rng.normal(0, 1, shape)
+    vv = rng.normal(0, 1, shape)
+    vh[:, 5:8, 5:8] = -3
+    vv[:, 5:8, 5:8] = -3
+    vh[rng.random(shape) < 0.1] = np.nan
+    vv[:, 0, :] = np.nan
+    sar = xr.Dataset({'vh': (dims, vh), 'vv': (dims, vv)},
+                     coords=dict(time=np.arange(4), latitude=np.arange(20), longitude=np.arange(30)))
+    return classifier.wasard_classify(sar, max_size=1), np.isnan(vh) | np.isnan(vv)
+
+
+def test_water_frequency_ignores_no_data(classified):
+    sar, invalid = classified
+    labels = sar.wasard.values
+    equal(labels[invalid], 255)
+    assert np.isin(labels[~invalid], [0, 1]).all()
+
+    frequency = wasard._water_frequency(sar, range(4))
+    water = np.where(invalid, 0, labels).sum(0)
+    counts = (~invalid).sum(0)
+    with np.errstate(invalid='ignore'):
+        close_enough(frequency, water / counts)
+    assert np.isnan(frequency[0]).all()
+    assert np.nanmax(frequency) == 1
+
+
+def test_scores_ignore_no_data(classified, monkeypatch):
+    sar, invalid = classified
+    scene = sar.isel(time=1)
+    truth = np.random.default_rng(1).integers(0, 2, invalid[1].shape)
+    truth[:2] = -9999
+    monkeypatch.setattr(wasard, 'get_wofs_values', lambda landsat_dataset: None)
+    monkeypatch.setattr(wasard, '_fit_landsat_dataset_resolution', lambda wofs, sar_dataset: truth)
+
+    f1, precision, recall = wasard._get_scores(scene, xr.Dataset(coords=dict(time=[0])), 0)
+    keep = (truth >= 0) & ~invalid[1]
+    expected_truth, expected_pred = truth[keep], scene.wasard.values[keep]
+    close_enough((f1, precision, recall), (f1_score(expected_truth, expected_pred),
+                                           precision_score(expected_truth, expected_pred),
+                                           recall_score(expected_truth, expected_pred)))
+
+    result = wasard.get_correlation(sar, xr.Dataset(coords=dict(time=[0])), 1, 0)
+    differences = truth[~invalid[1]] - scene.wasard.values[~invalid[1]].astype(int)
+    close_enough(result['Correlating'], np.mean(differences == 0))
+    close_enough(result['False Positives'], np.mean(differences == -1))
@@ -1,8 +1,8 @@
 import numpy as np
 
 def _reformat(xs, ys):
-    '''Zips a list of xs and a list of ys. Converts to np.array. Casts to int'''
-    return np.array(list(zip(xs, ys))).astype(int)
+    '''Stacks an array of xs and an array of ys into an array of coordinate pairs. Casts to int'''
+    return np.stack([np.asarray(xs), np.asarray(ys)], axis=-1).astype(int)
 
 def line_scan(c1, c2):
     '''
@@ -16,13 +16,13 @@ def line_scan(c1, c2):
     y_direction = int( 2 * (int(c1[1] < c2[1]) - .5))
 
     if c1[0] == c2[0]:
-        range_of_ys = list(range(c1[1], c2[1] + 1, y_direction))
-        range_of_xs = [c1[0] for x in range_of_ys]
+        range_of_ys = np.arange(c1[1], c2[1] + 1, y_direction)
+        range_of_xs = np.full(range_of_ys.shape, c1[0])
         return _reformat(range_of_xs, range_of_ys)
     
     if c1[1] == c2[1]:
-        range_of_xs = list(range(c1[0], c2[0] + 1, x_direction))
-        range_of_ys = [c1[1] for x in range_of_xs]
+        range_of_xs = np.arange(c1[0], c2[0] + 1, x_direction)
+        range_of_ys = np.full(range_of_xs.shape, c1[1])
         return _reformat(range_of_xs, range_of_ys)
 
     dy = c2[1] - c1[1]
@@ -36,13 +36,33 @@ def line_scan(c1, c2):
     
     if abs(m) >= 1:
         
-        range_of_ys = list(range(c1[1], c2[1] + sign, sign*x_direction))
-        range_of_xs =  [ (((y-_y)/m) + _x)//1 for y in range_of_ys]
+        range_of_ys = np.arange(c1[1], c2[1] + sign, sign*x_direction)
+        range_of_xs = np.floor(((range_of_ys - _y) / m) + _x)
         return _reformat(range_of_xs, range_of_ys)
         
     elif abs(m) < 1:
         
-        range_of_xs = list(range(c1[0], c2[0] + 1, x_direction))
-        range_of_ys =  [ (m * (x-_x))//1 + _y  for x in range_of_xs]        
+        range_of_xs = np.arange(c1[0], c2[0] + 1, x_direction)
+        range_of_ys = np.floor(m * (range_of_xs - _x)) + _y
         
-        return _reformat(range_of_xs, range_of_ys)
\ No newline at end of file
+        return _reformat(range_of_xs, range_of_ys)
+
+def line_scan_many(starts, ends):
+    '''
+    Rasterizes many lines at once with a vectorised DDA.
+    Accepts two (n, 2) arrays of integer coordinate pairs, the starts and ends of n lines.
+    Every line is sampled once per pixel of its longest axis, from its start to its end (both included).
+    Returns a (n, max_samples, 2) integer array of coordinate pairs and a (n, max_samples) boolean array,
+    False for the padding samples past the end of the shorter lines (whose coordinates repeat the end).
+    '''
+    starts = np.asarray(starts, dtype=int).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=int).reshape(-1, 2)
+    deltas = ends - starts
+    n_samples = np.abs(deltas).max(axis=1) + 1
+    max_samples = int(n_samples.max()) if len(n_samples) else 0
+
+    steps = np.arange(max_samples)
+    valid = steps[None, :] < n_samples[:, None]
+    fraction = np.minimum(steps[None, :], n_samples[:, None] - 1) / np.maximum(n_samples - 1, 1)[:, None]
+    coordinates = np.floor(starts[:, None, :] + fraction[:, :, None] * deltas[:, None, :] + .5).astype(int)
+    return coordinates, valid
@@ -5,7 +5,7 @@ import numpy as np
 import sys
 
 sys.path.append('../')
-from line_scan import line_scan
+from line_scan import line_scan, line_scan_many
 equal = np.testing.assert_array_equal
 
 '''
@@ -146,6 +146,36 @@ def test_v_ud():
     equal(np.array(line_scan(a, b)), np.array(expected_answer))
     
     
+############### many lines at once
+def test_many_endpoints_and_padding():
+    starts = np.array([[1, 10], [10, 4], [3, 3]])
+    ends = np.array([[4, 2], [2, 4], [3, 3]])
+    coordinates, valid = line_scan_many(starts, ends)
+
+    equal(valid.sum(axis=1), [9, 9, 1])
+    equal(coordinates[:, 0], starts)
+    equal(coordinates[[0, 1, 2], [8, 8, 0]], ends)
+    # Padding samples repeat the end of the line.
+    equal(coordinates[2], np.repeat([[3, 3]], 9, axis=0))
+
+
+def test_many_contiguous():
+    starts = np.array([[0, 0], [20, 3], [5, 17], [0, 9]])
+    ends = np.array([[13, 4], [1, 15], [5, 2], [9, 0]])
+    coordinates, valid = line_scan_many(starts, ends)
+
+    for line, line_valid in zip(coordinates, valid):
+        steps = np.abs(np.diff(line[line_valid], axis=0))
+        assert (steps.max(axis=1) == 1).all()
+
+
+def test_many_straight_lines():
+    coordinates, valid = line_scan_many([[10, 2], [2, 4]], [[10, 8], [10, 4]])
+
+    equal(coordinates[0][valid[0]], [[10, y] for y in range(2, 9)])
+    equal(coordinates[1][valid[1]], [[x, 4] for x in range(2, 11)])
+
+
 ################################################################################
 
 points = {}
@@ -0,0 +1,53 @@
+import numpy as np
+import xarray as xr
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from utils.data_cube_utilities.transect.line_scan import line_scan_many
+from utils.data_cube_utilities.transect.xarraypath import get_index_at, create_transects, create_pixel_trail
+
+equal = np.testing.assert_array_equal
+
+def _dataset():
+    rng = np.random.default_rng(0)
+    dims = ('time', 'latitude', 'longitude')
+    ds = xr.Dataset({'red': (dims, rng.integers(0, 3000, (3, 12, 15)).astype(np.int16)),
+                     'pixel_qa': (dims, rng.integers(0, 255, (3, 12, 15)).astype(np.uint16)),
+                     'ndvi': (dims, rng.uniform(-1, 1, (3, 12, 15)))},
+                    coords=dict(time=np.arange(3), latitude=47. - 0.01 * np.arange(12),
+                                longitude=7. + 0.01 * np.arange(15)))
+    ds.red.attrs['nodata'] = -9999
+    return ds
+
+def test_pixel_trail_matches_line_scan():
+    ds = _dataset()
+    start, end = (46.99, 7.01), (46.9, 7.12)
+    trail = create_pixel_trail(start, end, ds)
+    coordinates, _ = line_scan_many([get_index_at(start, ds)], [get_index_at(end, ds)])
+    expected = [ds.isel(latitude=x, longitude=y) for x, y in coordinates[0]]
+    assert isinstance(trail, list) and len(trail) == len(expected)
+    for pixel, expected_pixel in zip(trail, expected):
+        assert pixel.red.dtype == np.int16
+        equal(pixel.red.values, expected_pixel.red.values)
+        equal(pixel.latitude.values, expected_pixel.latitude.values)
+        equal(pixel.longitude.values, expected_pixel.longitude.values)
+
+def test_transects_without_padding_keep_dtypes():
+    ds = _dataset()
+    transects = create_transects([(47., 7.), (46.95, 7.)], [(47., 7.05), (46.95, 7.05)], ds)
+    assert bool(transects.valid.all())
+    for band in ds.data_vars:
+        assert transects[band].dtype == ds[band].dtype
+
+def test_padding_masked_with_nodata():
+    ds = _dataset()
+    transects = create_transects([(47., 7.), (46.95, 7.)], [(47., 7.1), (46.95, 7.02)], ds)
+    padding = ~transects.valid
+    assert bool(padding.any())
+    assert transects.red.dtype == np.int16
+    assert bool((transects.red.where(padding, -9999) == -9999).all())
+    assert bool(transects.ndvi.isnull().transpose('transect', 'sample', 'time').values[padding.values].all())
+    # No nodata attribute: promoted to float and masked with NaN
+    assert bool(transects.pixel_qa.isnull().transpose('transect', 'sample', 'time').values[padding.values].all())
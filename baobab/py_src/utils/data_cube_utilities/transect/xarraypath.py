@@ -1,24 +1,71 @@
 import numpy as np
+import xarray as xr
+
+from .line_scan import line_scan_many
+
+def _nearest_indices(coordinate, values):
+    '''Returns the indices of the elements of the 1D array coordinate nearest to each of values'''
+    order = np.argsort(coordinate)
+    ordered = coordinate[order]
+    right = np.clip(np.searchsorted(ordered, values), 1, len(ordered) - 1)
+    left = right - 1
+    nearest = np.where(np.abs(values - ordered[left]) <= np.abs(ordered[right] - values), left, right)
+    return order[nearest] if len(ordered) > 1 else np.zeros(np.shape(values), dtype=int)
 
 def get_index_at(coords, ds):
     lat = coords[0]
     lon = coords[1]
-    
-    nearest_lat = ds.sel(latitude = lat, method = 'nearest').latitude.values
-    nearest_lon = ds.sel(longitude = lon, method = 'nearest').longitude.values
-    
-    lat_index = np.where(ds.latitude.values == nearest_lat)[0]
-    lon_index = np.where(ds.longitude.values == nearest_lon)[0]
-    
+
+    lat_index = _nearest_indices(ds.latitude.values, np.array([lat]))[0]
+    lon_index = _nearest_indices(ds.longitude.values, np.array([lon]))[0]
+
     return (int(lat_index), int(lon_index))
 
-def create_pixel_trail(start, end, ds):
-    a = get_index_at(start, ds)
-    b = get_index_at(end, ds)
-    
-    indices = line_scan(a, b)
+def _mask_padding(array, valid):
+    '''
+    Masks the padding samples of array: with its nodata attribute for integer arrays (which keep their dtype),
+    with NaN otherwise.
+    '''
+    nodata = array.attrs.get('nodata')
+    if np.issubdtype(array.dtype, np.integer) and nodata is not None:
+        return array.where(valid, nodata).astype(array.dtype)
+    return array.where(valid)
 
-    pixels = [ ds.isel(latitude = x, longitude = y) for x, y in indices]
-    return pixels
+def create_transects(starts, ends, ds):
+    '''
+    Extracts the pixels of many transects at once.
+    starts and ends are (n, 2) arrays of (latitude, longitude) pairs, the ends of n transects.
+    The transects are rasterized with a vectorised DDA (see line_scan_many) and all their pixels are
+    extracted with a single pointwise isel.
+    Returns ds with its latitude and longitude dimensions replaced by (transect, sample) and a boolean
+    'valid' coordinate, False for the padding samples past the end of the shorter transects. The padding samples
+    are NaN, or the nodata attribute of integer variables (which keep their dtype).
+    '''
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    points = np.concatenate([starts, ends])
+    indices = np.stack([_nearest_indices(ds.latitude.values, points[:, 0]),
+                        _nearest_indices(ds.longitude.values, points[:, 1])], axis=1)
 
+    coordinates, valid = line_scan_many(indices[:len(starts)], indices[len(starts):])
+    dims = ('transect', 'sample')
+    transects = ds.isel(latitude=xr.DataArray(coordinates[..., 0], dims=dims),
+                        longitude=xr.DataArray(coordinates[..., 1], dims=dims))
+    valid = xr.DataArray(valid, dims=dims)
+    if not valid.all():
+        if isinstance(transects, xr.Dataset):
+            transects = transects.map(_mask_padding, valid=valid, keep_attrs=True)
+        else:
+            transects = _mask_padding(transects, valid)
+    transects = transects.assign_coords(valid=valid)
+    other_dims = [dim for dim in transects.dims if dim not in dims]
+    return transects.transpose(*dims, *other_dims)
 
+def create_pixel_trail(start, end, ds):
+    '''
+    Extracts the pixels of the transect from start to end, two (latitude, longitude) pairs.
+    Returns the list of the pixels (ds.isel at every pixel of the transect, in order). Use create_transects
+    to get them as a single xarray.
+    '''
+    trail = create_transects([start], [end], ds).isel(transect=0).reset_coords('valid', drop=True)
+    return [trail.isel(sample=sample) for sample in range(trail.sizes['sample'])]
@@ -1,56 +1,138 @@
-from functools import partial  
-from itertools import islice, product  
+from functools import partial
+from itertools import islice, product
+import warnings
 import numpy as np
 import xarray as xr
 
-def __where_not_nan(arr: np.ndarray):
-    """Finds position of not nan values in an nd-array
+# Maximum number of pairwise differences held in memory at once by `__trend_block`.
+# Pixels are processed in blocks so memory does not grow with the size of the cube.
+trend_pair_budget = 2 ** 24
+
+trend_variables = ['count', 'ols_slope', 'sen_slope', 'mk_s', 'mk_z', 'mk_p', 'kendall_tau']
+
+
+def __trend_pixel_block(y: np.ndarray, x: np.ndarray):
+    """Computes every trend statistic for a 2-D block of time series at once.
 
     Args:
-        arr (numpy.ndarray): nd-array with nan values
-        
+        y (numpy.ndarray): nd-array with dimensions (pixel, time), nan for missing values
+        x (numpy.ndarray): positions of the samples along time
+
     Returns:
-        data (xr.DataArray): nd-array with indices of finite(not nan) values
+        statistics (list): one 1-D nd-array per name of `trend_variables`
     """
-    return np.where(np.isfinite(arr))
+    from scipy.special import ndtr
+
+    valid = np.isfinite(y)
+    count = valid.sum(axis=1)
+    not_enough = count < 2
+
+    # Ordinary least squares slope over the valid samples
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y_valid = np.where(valid, y, 0)
+        x_mean = (valid * x).sum(axis=1) / count
+        dx = np.where(valid, x - x_mean[:, None], 0)
+        ols_slope = (dx * y_valid).sum(axis=1) / (dx * dx).sum(axis=1)
+
+    # Broadcast over the pairwise time differences (j > i) of every pixel. Pairs at the same position (tied x)
+    # have no slope and do not contribute to S.
+    i, j = np.triu_indices(y.shape[1], 1)
+    dx = x[j] - x[i]
+    dy = y[:, j] - y[:, i]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        sen_slope = np.nanmedian(np.where(dx != 0, dy / np.where(dx != 0, dx, 1), np.nan), axis=1)
+    mk_s = (np.nan_to_num(np.sign(dy)) * np.sign(dx)).sum(axis=1)
+    del dy
+
+    # Size of the group of equal values (y) and positions (x) of every valid sample (1 when not tied);
+    # a sum over the samples of f(t) is the sum over the groups of t * f(t)
+    ties_y = np.where(valid, (y[:, :, None] == y[:, None, :]).sum(axis=2), 1)
+    ties_x = np.where(valid, (valid[:, None, :] & (x[:, None] == x[None, :])).sum(axis=2), 1)
+
+    # Mann-Kendall variance of S corrected for ties in x and y (Kendall, 1970)
+    n = count.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mk_variance = (n * (n - 1) * (2 * n + 5)
+                       - ((ties_y - 1) * (2 * ties_y + 5)).sum(axis=1)
+                       - ((ties_x - 1) * (2 * ties_x + 5)).sum(axis=1)) / 18 \
+            + np.where(n > 2, ((ties_y - 1) * (ties_y - 2)).sum(axis=1) * ((ties_x - 1) * (ties_x - 2)).sum(axis=1)
+                       / (9 * n * (n - 1) * (n - 2)), 0) \
+            + (ties_y - 1).sum(axis=1) * (ties_x - 1).sum(axis=1) / (2 * n * (n - 1))
+        mk_z = np.where(mk_s == 0, 0, (mk_s - np.sign(mk_s)) / np.sqrt(mk_variance))
+        mk_p = 2 * ndtr(-np.abs(mk_z))
 
+        # Kendall's tau-b: pairs tied in x or y are left out of the normalization
+        pairs = n * (n - 1) / 2
+        kendall_tau = mk_s / np.sqrt((pairs - (ties_x - 1).sum(axis=1) / 2) * (pairs - (ties_y - 1).sum(axis=1) / 2))
+
+    statistics = [count, ols_slope, sen_slope, mk_s.astype(np.float64), mk_z, mk_p, kendall_tau]
+    for statistic in statistics[1:]:
+        statistic[not_enough] = np.nan
+    return statistics
+
+
+def __trend_block(y: np.ndarray, x: np.ndarray):
+    """Computes the trend statistics of an nd-array whose last axis is time, a block of pixels at a time.
 
-def __flatten_shallow(arr):
-    """Flattens first two axes of nd-array
     Args:
-        arr (numpy.ndarray): nd-array with dimensions (n, m)
-        
-    Returns: 
-        arr (numpy.ndarray): nd-array with dimensions (n*m)
+        y (numpy.ndarray): nd-array with time as last dimension, nan for missing values
+        x (numpy.ndarray): positions of the samples along time
+
+    Returns:
+        statistics (tuple): one nd-array per name of `trend_variables`, with the shape of y without its last axis
     """
-    # TODO: Done in a hurry, Find numpy native way of resizing 
-    return arr.reshape(arr.shape[0] * arr.shape[1])
+    shape = y.shape[:-1]
+    n_times = y.shape[-1]
+    pixels = np.asarray(y, dtype=np.float64).reshape(-1, n_times)
 
+    statistics = [np.empty(pixels.shape[0], dtype=np.int64)] + \
+                 [np.empty(pixels.shape[0], dtype=np.float64) for _ in trend_variables[1:]]
+    block_size = max(1, trend_pair_budget // max(1, n_times * n_times))
+    for start in range(0, pixels.shape[0], block_size):
+        block = __trend_pixel_block(pixels[start:start + block_size], x)
+        for statistic, values in zip(statistics, block):
+            statistic[start:start + block_size] = values
+    return tuple(statistic.reshape(shape) for statistic in statistics)
 
-def __linear_fit(da: xr.DataArray):
-    """Applies linear regression on a 1-D xr.DataArray. 
+
+def trends(da: xr.DataArray, dim: str = 'time', x: np.ndarray = None):
+    """Reduces xarray along a time component into per pixel trend statistics.
+
+    Ordinary least squares slope, Sen's slope, Mann-Kendall S, Z and p-value (two sided, variance corrected for ties)
+    and Kendall's tau-b are computed on whole blocks of pixels, nan values being ignored. Samples at the same
+    position (ties in `x`) are supported: their pairs are left out of Sen's slope and S, and the variance of S and
+    tau-b are corrected for them. Dask backed arrays are processed lazily, chunk by chunk.
 
     Args:
-        da (xr.DataArray): 1-D Data-Array being manipulated. 
-        
+        da (xr.DataArray): N-D Data-Array being manipulated, containing `dim`.
+        dim (str): dimension along which trends are computed.
+        x (numpy.ndarray): positions of the samples along `dim` (e.g. the days since the first acquisition,
+            `(da.time - da.time[0]).dt.days`, for slopes per day). Defaults to 0, 1, ..., n - 1, which yields slopes
+            per time step.
+
     Returns:
-        data (xr.DataArray): DataArray with a single element(slope of regression).
+        trend_product (xr.Dataset): Dataset with the dimensions of `da` except `dim` and the variables
+            count (number of valid samples), ols_slope, sen_slope, mk_s, mk_z, mk_p and kendall_tau.
+            Statistics are nan where less than 2 samples are valid.
     """
-    
-    xs = np.array(list(range(len(da.time))))
-    ys = __flatten_shallow(da.values)
-        
-    not_nan = __where_not_nan(ys)[0].astype(int)
-
-    xs = xs[not_nan]
-    ys = ys[not_nan] 
+    n_times = da.sizes[dim]
+    x = np.arange(n_times, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    if x.shape != (n_times,):
+        raise ValueError("x must hold one position per element of dimension '{}'".format(dim))
 
-    pf = np.polyfit(xs,ys, 1)
-    return xr.DataArray(pf[0])
+    if da.chunks is not None:
+        da = da.chunk({dim: -1})
+    statistics = xr.apply_ufunc(partial(__trend_block, x=x), da,
+                                input_core_dims=[[dim]],
+                                output_core_dims=[[] for _ in trend_variables],
+                                dask='parallelized',
+                                output_dtypes=[np.int64] + [np.float64] * (len(trend_variables) - 1))
+    return xr.Dataset(dict(zip(trend_variables, statistics)))
 
 
 def linear(da: xr.DataArray):
-    """Reduces xarray along a time component. The reduction yields a slope for each spatial coordinate in the xarray. 
+    """Reduces xarray along a time component. The reduction yields a slope for each spatial coordinate in the xarray.
 
     Args:
         da (xr.DataArray): 3-D Data-Array being manipulated. `latitude` and `longitude` are required dimensions.
@@ -59,13 +141,4 @@ def linear(da: xr.DataArray):
         linear_trend_product (xr.DataArray): 2-D Data-Array
     """
 
-    # TODO: Decouple from coordinate system, and allow regression along multiple components.
-    stacked = da.stack(allpoints = ['latitude',
-                                    'longitude'])
-    
-    trend = stacked.groupby('allpoints').apply(__linear_fit)
-    
-    unstacked = trend.unstack('allpoints')
-    
-    return unstacked.rename(dict(allpoints_level_0 = "latitude",
-                                 allpoints_level_1 = "longitude"))
\ No newline at end of file
+    return trends(da.transpose('time', 'latitude', 'longitude')).ols_slope
@@ -1,3 +1,4 @@
+import os
 import datacube
 import xarray as xr
 import datetime
@@ -10,6 +11,8 @@ import matplotlib.pyplot as plt
 from .dc_water_classifier import wofs_classify
 import random
 import itertools
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from sklearn import svm
 # from sklearn.externals import joblib
 import joblib
@@ -115,43 +118,73 @@ class wasard_classifier:
         self.coefficient     = self.classifier.coef_
    
    
-    def wasard_classify (self, sar_dataset):
-        """Return new xarray Dataset identical to sar_dataset but with predicted water values added, using a provided classifier
-        :param sar_dataset: xarray Dataset containing sar data, loaded from datacube
-        :return: new xarray Dataset identical to sar_dataset with new array "wasard" added, containing predicted water values
+    def wasard_predict(self, sar_dataset, max_size=100, time_chunk=None, n_workers=None, no_data=255):
+        """Return a new DataArray of predicted water values for every time slice of sar_dataset, using a provided classifier
+        The linear SVM decision function is evaluated directly on the bands, `time_chunk` time slices at a time, and
+        isolated blocks of water are filtered from the time slices of a chunk in parallel. sar_dataset is not copied.
+        :param sar_dataset: xarray Dataset containing sar data, loaded from datacube (numpy or dask backed)
+        :param max_size: indicates maximum size of isolated blocks of predicted water to be filtered
+        :param time_chunk: number of time slices loaded at once, defaults to the time chunks of dask backed datasets and to all time slices otherwise
+        :param n_workers: number of threads classifying and filtering time slices, defaults to the number of CPUs
+        :param no_data: value of the pixels where a band is NaN (255 by default, the labels being 0 and 1); it must be
+            representable in the dtype of the labels
+        :return: xarray DataArray "wasard" with dims time, latitude and longitude containing predicted water values
         """
-        satellite_type      = 'sentinel' if hasattr(sar_dataset, 'vv') else 'alos'
-        dataset_dims        = (sar_dataset.coords.dims['time'], sar_dataset.coords.dims['latitude'], sar_dataset.coords.dims['longitude'])
-        
+        satellite_type  = 'sentinel' if hasattr(sar_dataset, 'vv') else 'alos'
         bands           = self.coefficient.size
-        
-        band2 = None
-        if satellite_type   == 'sentinel':
-            band1       = sar_dataset.vh.values.ravel()
-            if bands == 2:
-                band2       = sar_dataset.vv.values.ravel()
-        elif satellite_type == 'alos':
-            band1       = sar_dataset.hv.values.ravel()
-            # band2       = sar_dataset.incidence_angle.values.ravel()
-
-        # assemble features into array and predict water using the classifier
-        if bands == 1:
-            dinput      = np.dstack([band1])
-            predictions = self.classifier.predict(dinput[0])
-        elif bands == 2:
-            dinput      = np.dstack([band1, band2])
-            predictions = self.classifier.predict(dinput[0])
-        else:
+        if bands not in (1, 2):
             raise ValueError("Bands must be 1 or 2")
 
-        predictions                = predictions.reshape(dataset_dims)
-        sar_dataset_copy           = sar_dataset.copy(deep=True)
-        sar_dataset_copy['wasard'] = (('time', 'latitude', 'longitude'),predictions)
-
-        # reduce noise from speckle and other isolated fals positives
-        sar_dataset_copy           = _filter_all(sar_dataset_copy, max_size=100)
-
-        return sar_dataset_copy
+        if satellite_type   == 'sentinel':
+            band_names  = ['vh', 'vv'][:bands]
+        elif bands == 1:
+            band_names  = ['hv']
+        else:
+            raise ValueError("ALOS datasets can only be classified with a 1 band classifier")
+        band_arrays     = [sar_dataset[name].transpose('time', 'latitude', 'longitude') for name in band_names]
+
+        dims            = ('time', 'latitude', 'longitude')
+        predictions     = np.empty(band_arrays[0].shape, dtype=_wasard_label_dtype(self.classifier))
+        struct          = np.ones((3,3))
+        if np.asarray(no_data).astype(predictions.dtype) != no_data:
+            raise ValueError("no_data {} can not be represented in the {} labels".format(no_data, predictions.dtype))
+
+        if time_chunk is None:
+            chunks      = band_arrays[0].chunks
+            time_chunk  = chunks[0][0] if chunks else predictions.shape[0]
+        time_chunk      = max(1, time_chunk)
+
+        def classify_time_slice(chunk, start, index):
+            bands                       = [band[index] for band in chunk]
+            prediction                  = _wasard_decision(self.classifier, bands)
+            # pixels without data are not water for the isolated cells filter, then no_data
+            invalid                     = np.zeros(prediction.shape, dtype=bool)
+            for band in bands:
+                invalid                |= np.isnan(band)
+            prediction[invalid]         = 0
+            prediction                  = _filter_isolated_cells(prediction, struct, max_size)
+            prediction[invalid]         = no_data
+            predictions[start + index]  = prediction
+
+        n_workers       = os.cpu_count() if n_workers is None else n_workers
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for start in range(0, predictions.shape[0], time_chunk):
+                # only one chunk of the bands is loaded at a time; numpy backed bands are not copied
+                chunk = [np.asarray(band[start:start + time_chunk].values) for band in band_arrays]
+                list(executor.map(functools.partial(classify_time_slice, chunk, start), range(chunk[0].shape[0])))
+
+        coords = {dim: sar_dataset[dim] for dim in dims}
+        return xr.DataArray(predictions, coords=coords, dims=dims, name='wasard')
+
+    def wasard_classify (self, sar_dataset, max_size=100, time_chunk=None, n_workers=None, no_data=255):
+        """Return new xarray Dataset identical to sar_dataset but with predicted water values added, using a provided classifier
+        The returned Dataset shares the data variables of sar_dataset, which are not copied. See wasard_predict.
+        :param sar_dataset: xarray Dataset containing sar data, loaded from datacube
+        :return: new xarray Dataset identical to sar_dataset with new array "wasard" added, containing predicted water values
+        """
+        wasard = self.wasard_predict(sar_dataset, max_size=max_size, time_chunk=time_chunk, n_workers=n_workers,
+                                     no_data=no_data)
+        return sar_dataset.assign(wasard=wasard)
 
     def save(self, filestring):
         """saves a classfier to the disk
@@ -235,25 +268,19 @@ def wasard_plot(sar_dataset,
             pass
 
 
-def wasard_time_plot(sar_dataset, size=(15,15), plot_over_image = False):
+def wasard_time_plot(sar_dataset, size=(15,15), plot_over_image = False, no_data=255):
     """creates a plot showing the presence of water over time in a given area
     :param sar_dataset: xarray Dataset of sar data, with wasard values added from wasard_classify
     :param size: tuple indicating the size of the output plot
     :param plot_over_image: boolean indicating whether the wasard values will be plot on top of a landsat_dataset image, preventing a new figure from being drawn
+    :param no_data: value of the wasard pixels without data (see wasard_classify), left out of the water frequency
     :return: None
     """
     
     # create an array containing the percent of time slices in which each pixel is predicted to hold water
     sar_dataset_copy      = sar_dataset.copy(deep=True)
     valid_time_indices    = _find_nodatas(sar_dataset_copy)
-    aggregate_predictions = np.zeros((sar_dataset_copy.latitude.size, sar_dataset_copy.longitude.size))
-    divisor               = len(valid_time_indices)
-    
-    for x in valid_time_indices:
-        aggregate_predictions += np.nan_to_num(sar_dataset_copy.wasard[x])
-            
-    # divide total by number of valid datases in order to get the percent of the time each pixel holds water
-    aggregate_predictions                     = aggregate_predictions / divisor
+    aggregate_predictions = _water_frequency(sar_dataset_copy, valid_time_indices, no_data)
     sar_dataset_copy['aggregate_predictions'] = (('latitude', 'longitude'), aggregate_predictions)
 
     start_color_index     = 1
@@ -285,12 +312,13 @@ def wasard_time_plot(sar_dataset, size=(15,15), plot_over_image = False):
     print("% of time containing water:\nblack: 0%\nred: 0-20%\norange: 20-40%\nyellow: 40-60%\ngreen: 60-80%\nblue: 80-100%")
     
 #specific names for sar_dataset
-def get_correlation(sar_wasard_dataset, landsat_dataset, sar_time_index, landsat_time_index):
+def get_correlation(sar_wasard_dataset, landsat_dataset, sar_time_index, landsat_time_index, no_data=255):
     """returns the percent of pixels from the sar_dataset scene_index that have the same predicted water value as the landsat_dataset scene_index
     :param landsat_dataset: xarray Dataset containing landsat data, loaded from datacube. If none, program predicts water values from the most recently trained classifier
     :param sar_dataset: xarray Dataset of sar data, with wasard values added from wasard_classify
     :param landsat_time_index: int indicating which time index from the landat Dataset will be used
     :param sar_time_index: int indicating which time index from the SAR dataset will be used
+    :param no_data: value of the wasard pixels without data (see wasard_classify), left out of the comparison
     :return: Ratio of pixels with the same predicted water value between the two scene_indexs to the total number of pixels 
     """
     
@@ -306,16 +334,17 @@ def get_correlation(sar_wasard_dataset, landsat_dataset, sar_time_index, landsat
     
     
     # subtract wasard arrays of one dataset from the other, resulting array has value 0 when the wasard values were the same, and 1 when they were different
-    differences_array             = wofs_with_adjusted_resolution - sar_dataset_at_time.wasard
+    wasard                        = sar_dataset_at_time.wasard.values
+    differences_array             = (wofs_with_adjusted_resolution - wasard.astype(np.int16))[wasard != no_data]
     total                         = differences_array.size
     
     # generate dict containing the number of false positives, false negatives, and correlating values between each acquisition
     unique, counts                = np.unique(differences_array, return_counts=True)
     difference_counts             = dict(zip(unique, counts))
     result                        = {'False Positives':0, 'False Negatives':0, 'Correlating':0}
-    result['False Positives']     = difference_counts[-1] / total
-    result['False Negatives']     = difference_counts[1] / total
-    result['Correlating']         = difference_counts[0] / total
+    result['False Positives']     = difference_counts.get(-1, 0) / total
+    result['False Negatives']     = difference_counts.get(1, 0) / total
+    result['Correlating']         = difference_counts.get(0, 0) / total
     
     return result
    
@@ -530,6 +559,36 @@ def _get_train_data(sar_dataset, landsat_dataset, pct = .09, displaydates = Fals
 
 
 
+def _wasard_label_dtype(classifier):
+    """returns the dtype of the predicted water values: uint8 for the usual 0 (not water) / 1 (water) labels, the dtype of the classifier's labels otherwise"""
+    classes = np.asarray(classifier.classes_)
+    return np.uint8 if np.isin(classes, [0, 1]).all() else classes.dtype
+
+
+def _wasard_decision(classifier, bands):
+    """Return the labels predicted by a linear classifier for arrays of feature values, without stacking the features
+    Equivalent to classifier.predict on the stacked, flattened bands: the decision function is evaluated as a sum of
+    coefficient * band products over the whole arrays.
+    :param classifier: fitted linear classifier, e.g. LinearSVC
+    :param bands: list of arrays of the same shape, one per feature
+    :return: array of the shape of the bands with the predicted labels
+    """
+    coefficients = np.atleast_2d(classifier.coef_)
+    intercepts   = np.ravel(classifier.intercept_)
+    classes      = np.asarray(classifier.classes_).astype(_wasard_label_dtype(classifier))
+
+    def decision(row):
+        scores = np.full(bands[0].shape, intercepts[row])
+        for coefficient, band in zip(coefficients[row], bands):
+            scores += coefficient * band
+        return scores
+
+    if coefficients.shape[0] == 1:
+        return classes[(decision(0) > 0).astype(np.intp)]
+    scores = np.stack([decision(row) for row in range(coefficients.shape[0])])
+    return classes[scores.argmax(axis=0)]
+
+
 def _filter_isolated_cells(array, struct, max_size):
     """ Return array with completely isolated blocks of cells removed
     :param array: Array with completely isolated single cells
@@ -537,7 +596,7 @@ def _filter_isolated_cells(array, struct, max_size):
     :param max_size: Int indicating how how small isolated blocks must be to be masked
     :return: Array with minimum region size > max_size
     """
-    import scipy
+    import scipy.ndimage
     
     filtered_array                        = np.copy(array)
     id_regions, num_ids                   = scipy.ndimage.label(filtered_array, structure=struct)
@@ -547,18 +606,23 @@ def _filter_isolated_cells(array, struct, max_size):
     return filtered_array
 
 
-def _filter_all(sar_dataset, max_size=50):
+def _filter_all(sar_dataset, max_size=50, n_workers=None):
     """Filters max_sizelated blocks of predicted water values from a sar_dataset object's wasard array to try to remove false positives
+    The time slices are filtered in parallel, in place.
     :param sar_dataset: xarray Dataset of sar data, with wasard values added from wasard_classify
     :param max_size: indicates maximum size of max_sizelated blocks to be filtered
+    :param n_workers: number of threads filtering time slices, defaults to the number of CPUs
     :return: new sar_dataset object with wasard values filtered for max_sizelated blocks
     """
-    # sar_dataset_copy           = sar_dataset.copy(deep=True)
-    dims                       = ('time','latitude','longitude')
     struct                     = np.ones((3,3))
-    for x in range(sar_dataset.wasard.shape[0]):
-                   sar_dataset.wasard[x] = _filter_isolated_cells(sar_dataset.wasard[x], struct, max_size)
-    # sar_dataset['wasard'] = (dims, _filter_isolated_cells(sar_dataset.wasard, struct, max_size))
+    wasard                     = sar_dataset.wasard.values
+
+    def filter_time_slice(x):
+        wasard[x] = _filter_isolated_cells(wasard[x], struct, max_size)
+
+    n_workers                  = os.cpu_count() if n_workers is None else n_workers
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(filter_time_slice, range(wasard.shape[0])))
     return sar_dataset
     
     
@@ -573,12 +637,34 @@ def _find_nodatas(sentinel):
     return acceptable_indices
 
 
-def _get_scores(sar_wasard_dataset, landsat_dataset, landsat_time_index):
+def _water_frequency(sar_dataset, time_indices, no_data=255):
+    """returns the ratio of the time slices predicted to hold water for each pixel, out of the time slices in which the pixel has data
+    :param sar_dataset: xarray Dataset of sar data, with wasard values added from wasard_classify
+    :param time_indices: list of the time slices to aggregate, see _find_nodatas
+    :param no_data: value of the wasard pixels without data, left out of both the count of water and the count of time slices
+    :return: 2D array of frequencies, NaN for the pixels without data in any time slice
+    """
+    aggregate_predictions = np.zeros((sar_dataset.latitude.size, sar_dataset.longitude.size))
+    divisor               = np.zeros(aggregate_predictions.shape)
+
+    for x in time_indices:
+        wasard                 = sar_dataset.wasard[x].values
+        valid                  = wasard != no_data
+        aggregate_predictions += np.where(valid, wasard, 0)
+        divisor               += valid
+
+    # divide total by number of valid time slices of each pixel in order to get the percent of the time it holds water
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return aggregate_predictions / divisor
+
+
+def _get_scores(sar_wasard_dataset, landsat_dataset, landsat_time_index, no_data=255):
     """returns the accuracy metrics for a SAR classifier
     :param landsat_dataset: xarray Dataset containing landsat data, loaded from datacube. If none, program predicts water values from the most recently trained classifier
     :param sar_dataset: xarray Dataset of sar data, with wasard values added from wasard_classify
     :param landsat_time_index: int indicating which time index from the landat Dataset will be used
     :param sar_time_index: int indicating which time index from the SAR dataset will be used
+    :param no_data: value of the wasard pixels without data (see wasard_classify), left out of the scores
     :return: Ratio of pixels with the same predicted water value between the two scene_indexs to the total number of pixels 
     """
     assert 'wasard' in sar_wasard_dataset.data_vars, "sar_dataset must include ""wasard"" datavar"
@@ -591,8 +677,8 @@ def _get_scores(sar_wasard_dataset, landsat_dataset, landsat_time_index):
     truth = wofs_with_adjusted_resolution.flatten()
     pred  = sar_wasard_dataset.wasard.values.flatten()
     
-    pred1 = [pred[x] for x in range(len(pred)) if truth[x] >= 0]
-    truth1 = [truth[x] for x in range(len(truth)) if truth[x] >= 0]
+    pred1 = [pred[x] for x in range(len(pred)) if truth[x] >= 0 and pred[x] != no_data]
+    truth1 = [truth[x] for x in range(len(truth)) if truth[x] >= 0 and pred[x] != no_data]
     
     
     precision = precision_score(truth1, pred1)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+## requires pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+rasterio = pytest.importorskip('rasterio')
+pytest.importorskip('osgeo')
+pytest.importorskip('click')
+shapely_geometry = pytest.importorskip('shapely.geometry')
+import rasterio.features
+import shapely.affinity
+import shapely.ops
+from rasterio.transform import from_origin
+
+import usgs_ls_c1_ard_prepare as prepare
+
+'''
+The valid region located from a decimated read of the masks is compared with the region of the full resolution
+masks, as computed before the decimation (polygons of all the valid pixels, their convex hull, buffered by one
+pixel, simplified and clipped to the image).
+'''
+
+PIXEL = 30.
+
+
+def _full_resolution_region(images):
+    mask = None
+    for fname in images:
+        with rasterio.open(str(fname), 'r') as ds:
+            transform = ds.transform
+            new_mask = ds.read(1) != ds.nodata
+            mask = new_mask if mask is None else mask | new_mask
+    shapes = rasterio.features.shapes(mask.astype('uint8'), mask=mask)
+    shape = shapely.ops.unary_union([shapely_geometry.shape(shape) for shape, val in shapes if val == 1])
+    geom = shape.convex_hull.buffer(1, join_style=3, cap_style=3).simplify(1)
+    geom = geom.intersection(shapely_geometry.box(0, 0, mask.shape[1], mask.shape[0]))
+    return shapely.affinity.affine_transform(geom, (transform.a, transform.b, transform.d, transform.e,
+                                                    transform.xoff, transform.yoff))
+
+
+def _write_band(path, data):
+    with rasterio.open(str(path), 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1,
+                       dtype=data.dtype, crs='EPSG:32632', nodata=-9999,
+                       transform=from_origin(500000, 5200000, PIXEL, PIXEL)) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def scene(tmp_path):
+    """Two bands of a tilted (Landsat like) swath, with holes and isolated valid pixels, not a multiple of 16"""
+    rng = np.random.default_rng(0)
+    height, width = 301, 413
+    rows, cols = np.mgrid[:height, :width]
+    swath = (np.abs((cols - 200) - 0.2 * (rows - 150)) < 150) & (np.abs((rows - 150) + 0.2 * (cols - 200)) < 120)
+    paths = []
+    for band in range(2):
+        data = np.where(swath, rng.integers(1, 10000, (height, width)), -9999).astype(np.int16)
+        data[rng.random((height, width)) < 0.02] = -9999
+        data[rng.integers(0, height, 3), rng.integers(0, width, 3)] = 100 + band
+        paths.append(tmp_path / 'band{}.tif'.format(band + 1))
+        _write_band(paths[-1], data)
+    return paths
+
+
+def test_decimated_region_within_one_pixel(scene):
+    decimated = shapely_geometry.shape(prepare.valid_region(scene, decimation=16))
+    full = _full_resolution_region(scene)
+    assert decimated.hausdorff_distance(full) <= PIXEL + 1e-6
+    assert decimated.buffer(PIXEL + 1e-6).contains(full)
+
+
+def test_decimation_does_not_change_the_hull(scene):
+    decimated = shapely_geometry.shape(prepare.valid_region(scene, decimation=16))
+    undecimated = shapely_geometry.shape(prepare.valid_region(scene, decimation=1))
+    assert decimated.symmetric_difference(undecimated).area < 1e-6 * PIXEL ** 2
@@ -4,6 +4,7 @@ Ingest data from the command-line.
 """
 from __future__ import absolute_import, division
 
+import json
 import logging
 import uuid
 from xml.etree import ElementTree
@@ -17,13 +18,16 @@ import rasterio.warp
 import click
 from osgeo import osr
 import os
+from contextlib import ExitStack
+from functools import partial
+import numpy as np
 # image boundary imports
 import rasterio
 from rasterio.errors import RasterioIOError
-import rasterio.features
+from rasterio.enums import Resampling
+from rasterio.windows import Window
 import shapely.affinity
 import shapely.geometry
-import shapely.ops
 
 _STATIONS = {
     '023': 'TKSC',
@@ -60,46 +64,144 @@ BANDS = ['coastal_aerosol', 'blue', 'green', 'red', 'nir', 'swir1', 'swir2']
 
 # IMAGE BOUNDARY CODE
 
+# Decimation factor of the coarse read locating the valid pixels in valid_region. Only the full
+# resolution blocks at the ends of every row of coarse blocks are then read.
+VALID_REGION_DECIMATION = 16
+# Tolerance (in pixels) of the simplification of the valid region.
+VALID_REGION_TOLERANCE = 1
+# Cache of the valid region, in the scene folder.
+VALID_REGION_CACHE = '.valid_region.json'
 
-def safe_valid_region(images, mask_value=None):
+
+def safe_valid_region(images, mask_value=None, decimation=VALID_REGION_DECIMATION,
+                      tolerance=VALID_REGION_TOLERANCE, cache_dir=None):
     try:
-        return valid_region(images, mask_value)
+        if cache_dir is not None:
+            return cached_valid_region(cache_dir, images, mask_value, decimation, tolerance)
+        return valid_region(images, mask_value, decimation, tolerance)
     except (OSError, RasterioIOError):
         return None
 
 
-def valid_region(images, mask_value=None):
-    mask = None
+def cached_valid_region(cache_dir, images, mask_value=None, decimation=VALID_REGION_DECIMATION,
+                        tolerance=VALID_REGION_TOLERANCE):
+    """
+    valid_region of images, cached in cache_dir and recomputed when the images or the parameters change
+    """
+    stats = [(os.path.basename(str(fname)), os.stat(str(fname))) for fname in images]
+    key = {'images': [[name, stat.st_mtime_ns, stat.st_size] for name, stat in sorted(stats)],
+           'mask_value': mask_value, 'tolerance': tolerance}
+    cache_path = os.path.join(str(cache_dir), VALID_REGION_CACHE)
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return cached['valid_data']
+    output = valid_region(images, mask_value, decimation, tolerance)
+    with open(cache_path + '.part', 'w') as f:
+        json.dump({'key': key, 'valid_data': output}, f)
+    os.replace(cache_path + '.part', cache_path)
+    return output
 
-    for fname in images:
-        # ensure formats match
-        with rasterio.open(str(fname), 'r') as ds:
-            transform = ds.transform
-            img = ds.read(1)
 
-            if mask_value is not None:
-                new_mask = img & mask_value == mask_value
-            else:
-                new_mask = img != ds.nodata
-            if mask is None:
-                mask = new_mask
-            else:
-                mask |= new_mask
+def _valid_mask(datasets, mask_value, window=None):
+    mask = None
+    for ds in datasets:
+        img = ds.read(1, window=window)
+        if mask_value is not None:
+            new_mask = img & mask_value == mask_value
+        else:
+            new_mask = img != ds.nodata
+        if mask is None:
+            mask = new_mask
+        else:
+            mask |= new_mask
+    return mask
+
+
+def _coarse_valid_mask(datasets, decimation):
+    """
+    Mask of the decimation x decimation blocks holding valid (not nodata) pixels. The incomplete blocks of
+    the last row and column are considered valid.
+    """
+    height, width = datasets[0].height, datasets[0].width
+    rows, cols = height // decimation, width // decimation
+    coarse = np.ones((-(-height // decimation), -(-width // decimation)), dtype=bool)
+    if rows and cols:
+        # The average of the dataset mask (0 or 255) over a block is 0 only when none of its pixels is valid.
+        window = Window(0, 0, cols * decimation, rows * decimation)
+        coarse[:rows, :cols] = np.any([ds.read_masks(1, window=window, out_shape=(rows, cols),
+                                                     resampling=Resampling.average) > 0
+                                       for ds in datasets], axis=0)
+    return coarse
+
+
+def _row_extents(datasets, mask_value, decimation):
+    """
+    Returns the columns of the first and last valid pixels of every row (-1 for the rows without any).
+    With a decimation > 1 and no mask_value, the full resolution mask is only read block by block
+    from both ends of every row of valid coarse blocks, until the extents of all its rows are known.
+    """
+    height, width = datasets[0].height, datasets[0].width
+    first, last = np.full(height, -1), np.full(height, -1)
+    if decimation <= 1 or mask_value is not None:
+        mask = _valid_mask(datasets, mask_value)
+        valid = mask.any(axis=1)
+        first[valid] = mask[valid].argmax(axis=1)
+        last[valid] = width - 1 - mask[valid][:, ::-1].argmax(axis=1)
+        return first, last
+
+    coarse = _coarse_valid_mask(datasets, decimation)
+    for i in np.flatnonzero(coarse.any(axis=1)):
+        top, bottom = i * decimation, min((i + 1) * decimation, height)
+        block_cols = np.flatnonzero(coarse[i])
+        for extents, order in ((first, block_cols), (last, block_cols[::-1])):
+            for j in order:
+                left, right = j * decimation, min((j + 1) * decimation, width)
+                mask = _valid_mask(datasets, mask_value, Window(left, top, right - left, bottom - top))
+                new = (extents[top:bottom] < 0) & mask.any(axis=1)
+                if extents is first:
+                    extents[top:bottom][new] = left + mask[new].argmax(axis=1)
+                else:
+                    extents[top:bottom][new] = right - 1 - mask[new][:, ::-1].argmax(axis=1)
+                # The last pixels are searched in the rows having a first one only.
+                wanted = np.ones(bottom - top, dtype=bool) if extents is first else first[top:bottom] >= 0
+                if (extents[top:bottom][wanted] >= 0).all():
+                    break
+    return first, last
+
+
+def valid_region(images, mask_value=None, decimation=VALID_REGION_DECIMATION, tolerance=VALID_REGION_TOLERANCE):
+    """
+    Footprint of the valid pixels of images (the union of their masks), in the CRS of the first one: their
+    convex hull, buffered by 1 pixel, simplified with a tolerance of tolerance pixels and clipped to the image.
+
+    The convex hull of the valid pixels is the one of the corners of the first and last valid pixels of every
+    row, which are located with a coarse read decimated by decimation (see _row_extents). The hull is exact,
+    the decimation only reduces the number of pixels read.
+    """
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(rasterio.open(str(fname), 'r')) for fname in images]
+        transform = datasets[0].transform
+        height, width = datasets[0].height, datasets[0].width
+        first, last = _row_extents(datasets, mask_value, decimation)
 
-    shapes = rasterio.features.shapes(mask.astype('uint8'), mask=mask)
-    shape = shapely.ops.unary_union([shapely.geometry.shape(shape) for shape, val in shapes if val == 1])
+    rows = np.flatnonzero(first >= 0)
+    corners = [(x, y) for xs, ys in ((first[rows], rows), (first[rows], rows + 1),
+                                     (last[rows] + 1, rows), (last[rows] + 1, rows + 1))
+               for x, y in zip(xs.tolist(), ys.tolist())]
 
     # convex hull
-    geom = shape.convex_hull
+    geom = shapely.geometry.MultiPoint(corners).convex_hull
 
     # buffer by 1 pixel
     geom = geom.buffer(1, join_style=3, cap_style=3)
 
-    # simplify with 1 pixel radius
-    geom = geom.simplify(1)
+    # simplify with tolerance pixels radius
+    geom = geom.simplify(tolerance)
 
     # intersect with image bounding box
-    geom = geom.intersection(shapely.geometry.box(0, 0, mask.shape[1], mask.shape[0]))
+    geom = geom.intersection(shapely.geometry.box(0, 0, width, height))
 
     # transform from pixel space into CRS space
     geom = shapely.affinity.affine_transform(geom, (transform.a, transform.b, transform.d, transform.e, transform.xoff,
@@ -120,6 +222,18 @@ def _to_lists(x):
     return x
 
 
+def valid_region_images(images_list):
+    """
+    The pixel_qa band alone if it flags its fill pixels as nodata, else all the band images
+    """
+    qa_images = [fname for fname in images_list if fname.endswith('pixel_qa.tif')]
+    if qa_images:
+        with rasterio.open(qa_images[0]) as ds:
+            if ds.nodata is not None:
+                return qa_images
+    return [fname for fname in images_list if 'band' in os.path.basename(fname)]
+
+
 # END IMAGE BOUNDARY CODE
 
 
@@ -186,13 +300,13 @@ def crazy_parse(timestr):
         return parser.parse(timestr[:-2] + '00') + timedelta(minutes=1)
 
 
-def prep_dataset(fields, path):
+def prep_dataset(fields, path, valid_data=False):
     # getting the list of all images
     images_list = []
     for file in os.listdir(str(path)):
         if file.endswith(".xml") and (not file.endswith('aux.xml')):
             metafile = file
-        if file.endswith(".tif") and ("band" in file):
+        if file.endswith(".tif") and ("band" in file or file.endswith("pixel_qa.tif")):
             images_list.append(os.path.join(str(path), file))
 
     # parsing xml based metadata
@@ -218,7 +332,9 @@ def prep_dataset(fields, path):
 
     #getting the projection details
     projdict = get_projection(path / next(iter(images.values()))['path'])
-    # projdict['valid_data'] = safe_valid_region(images_list)  # BC commented as very slow and probably unecessary
+    # valid_data is optional (--valid-data): the footprint of the valid pixels, slow to compute
+    if valid_data:
+        projdict['valid_data'] = safe_valid_region(valid_region_images(images_list), cache_dir=path)
 
     # generating the .yaml document
     doc = {
@@ -274,7 +390,7 @@ def dataset_folder(fields):
     return fmt_str.format(**fields)
 
 
-def prepare_datasets(nbar_path):
+def prepare_datasets(nbar_path, valid_data=False):
 
     fields = re.match((r"(?P<code>LC08|LE07|LT05|LT04)"
                        r"(?P<path>[0-9]{3})"
@@ -293,21 +409,42 @@ def prepare_datasets(nbar_path):
         'creation_dt':
         datetime.datetime(int(fields['productyear']), int(fields['productmonth']), int(fields['productday']))
     })
-    nbar = prep_dataset(fields, nbar_path)
+    nbar = prep_dataset(fields, nbar_path, valid_data)
     return (nbar, nbar_path)
 
 
+def is_scene(path):
+    """True for a folder holding an unpacked USGS LS C1 ARD scene."""
+    return re.match(r"(LC08|LE07|LT05|LT04)[0-9]{14}[0-9]{2}(RT|T1|T2)", path.name) is not None and \
+        any(path.glob('*.xml'))
+
+
 @click.command(help="Prepare USGS LS dataset for ingestion into the Data Cube.")
 @click.argument('datasets', type=click.Path(exists=True, readable=True, writable=True), nargs=-1)
-def main(datasets):
+@click.option('--scan', is_flag=True,
+              help="Scan DATASETS recursively for scenes and prepare them in parallel, skipping the unchanged ones.")
+@click.option('--workers', type=int, default=None, help="Number of worker processes of --scan (default: CPU count).")
+@click.option('--manifest', type=click.Path(dir_okay=False), default=None,
+              help="Manifest of the prepared scenes of --scan (default: .prepare-manifest.json in the first folder).")
+@click.option('--force', is_flag=True, help="Prepare all the scenes found by --scan, even the unchanged ones.")
+@click.option('--valid-data', is_flag=True,
+              help="Add the footprint of the valid pixels (grid_spatial.projection.valid_data) to the metadata "
+                   "(with --scan, add --force for the scenes already prepared).")
+def main(datasets, scan, workers, manifest, force, valid_data):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
+    if scan:
+        from swiss_utils.data_cube_utilities.sdc_batch_prepare import prepare_tree
+        prepare_tree(datasets, partial(prepare_datasets, valid_data=valid_data), is_scene, 'datacube-metadata.yaml',
+                     manifest_path=manifest, workers=workers, force=force)
+        return
+
     for dataset in datasets:
 
         path = Path(dataset)
 
         logging.info("Processing %s", path)
-        documents = prepare_datasets(path)
+        documents = prepare_datasets(path, valid_data)
 
         dataset, folder = documents
         yaml_path = str(folder.joinpath('datacube-metadata.yaml'))
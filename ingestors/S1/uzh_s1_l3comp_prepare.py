@@ -106,13 +106,30 @@ def prepare_datasets(s1_path):
     return (s1, s1_path)
 
 
+def is_scene(path):
+    """True for a folder holding UZH Sentinel 1 L3 backscatter composites."""
+    return any('_VH_' in im_path.name or '_VV_' in im_path.name for im_path in path.glob('*.tif'))
+
+
 @click.command(help="Prepare SENTINEL 1 L3 backscatter composite processed by UZH Geography Dept. for ingestion into the Data Cube.")
 @click.argument('datasets',
                 type=click.Path(exists=True, readable=True, writable=True),
                 nargs=-1)
-def main(datasets):
+@click.option('--scan', is_flag=True,
+              help="Scan DATASETS recursively for scenes and prepare them in parallel, skipping the unchanged ones.")
+@click.option('--workers', type=int, default=None, help="Number of worker processes of --scan (default: CPU count).")
+@click.option('--manifest', type=click.Path(dir_okay=False), default=None,
+              help="Manifest of the prepared scenes of --scan (default: .prepare-manifest.json in the first folder).")
+@click.option('--force', is_flag=True, help="Prepare all the scenes found by --scan, even the unchanged ones.")
+def main(datasets, scan, workers, manifest, force):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
+    if scan:
+        from swiss_utils.data_cube_utilities.sdc_batch_prepare import prepare_tree
+        prepare_tree(datasets, prepare_datasets, is_scene, 'l3comp-metadata.yaml',
+                     manifest_path=manifest, workers=workers, force=force)
+        return
+
     for dataset in datasets:
         path = Path(dataset)
 
@@ -127,10 +127,29 @@ def prepare_datasets(nbar_path):
     nbar = prep_dataset(fields, nbar_path)
     return (nbar, nbar_path)
 
+def is_scene(path):
+    """True for a folder holding a dc_preproc Sentinel 2 L2A scene."""
+    return re.match(r"(S2A|S2B)_MSIL1C_[0-9]{8}T[0-9]{6}_N[0-9]{4}_R[0-9]{3}_T[A-Z0-9]{5}_", path.name) is not None and \
+        path.joinpath('MTD.xml').exists()
+
+
 @click.command(help="Prepare a Sentinel 2 L2A scene prepared with dc_preproc scripts for datacube indexing and ingestion.")
 @click.argument('datasets', type=click.Path(exists=True, readable=True, writable=True), nargs=-1)
-def main(datasets):
+@click.option('--scan', is_flag=True,
+              help="Scan DATASETS recursively for scenes and prepare them in parallel, skipping the unchanged ones.")
+@click.option('--workers', type=int, default=None, help="Number of worker processes of --scan (default: CPU count).")
+@click.option('--manifest', type=click.Path(dir_okay=False), default=None,
+              help="Manifest of the prepared scenes of --scan (default: .prepare-manifest.json in the first folder).")
+@click.option('--force', is_flag=True, help="Prepare all the scenes found by --scan, even the unchanged ones.")
+def main(datasets, scan, workers, manifest, force):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.ERROR)
+
+    if scan:
+        from swiss_utils.data_cube_utilities.sdc_batch_prepare import prepare_tree
+        prepare_tree(datasets, prepare_datasets, is_scene, 'agdc-metadata.yaml',
+                     manifest_path=manifest, workers=workers, force=force)
+        return
+
     print("Entering program")
     for dataset in datasets:
         path = Path(dataset)